@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class BurgerApiConfig(AppConfig):
     name = 'burger_api'
+
+    def ready(self):
+        from . import db, signals # noqa: connects the signal receivers
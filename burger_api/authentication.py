@@ -0,0 +1,120 @@
+"""
+Stateless signed tokens for the API clients (e.g. the mobile apps): a token carries the user id, the user flags and
+the time it was issued, signed with the SECRET_KEY, so it is checked without reading the sessions. The users are kept
+in a small per-process LRU, a request with a token makes no query once its user is cached.
+A token also carries a key made from the password hash of the user and the last revocation of its tokens, both stored
+in the database: a password change or a revocation refuses the tokens issued before, right away in the process that
+made it, and in the other processes once they read the user again (BURGER_TOKEN_USER_CACHE_TIMEOUT).
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from .models import TokenRevocation
+
+TOKEN_SALT = 'burger_api.authentication.token'
+
+
+def get_token_max_age():
+    return getattr(settings, 'BURGER_TOKEN_MAX_AGE', 7 * 24 * 60 * 60)
+
+
+def get_token_key(user):
+    """
+    Return the key of the tokens of the user, it changes with the password and with every revocation
+    """
+    try:
+        revoked = user.token_revocation.revoked
+    except TokenRevocation.DoesNotExist:
+        revoked = None
+    return salted_hmac(TOKEN_SALT, '%s %s' % (user.password, revoked)).hexdigest()[:16]
+
+
+def issue_token(user):
+    """
+    Return a new signed token of the user
+    """
+    payload = {'u': user.pk, 's': user.is_staff, 'a': user.is_superuser, 't': time.time(), 'k': get_token_key(user)}
+    return signing.dumps(payload, salt=TOKEN_SALT)
+
+
+def revoke_tokens(user_id):
+    """
+    Revoke all the tokens issued to the user so far
+    """
+    TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'revoked': timezone.now()})
+    user_cache.evict(user_id)
+
+
+class UserCache(object):
+    """
+    LRU of the active users authenticated with a token, at most BURGER_TOKEN_USER_CACHE_SIZE of them,
+    each one read again after BURGER_TOKEN_USER_CACHE_TIMEOUT seconds (users saved in this process are evicted)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+
+    def get(self, user_id):
+        timeout = getattr(settings, 'BURGER_TOKEN_USER_CACHE_TIMEOUT', 60)
+        with self.lock:
+            entry = self.users.pop(user_id, None)
+            if entry is not None and time.time() - entry[1] < timeout:
+                # most recently used last
+                self.users[user_id] = entry
+                return entry[0]
+        user = User.objects.select_related('token_revocation').filter(pk=user_id, is_active=True).first()
+        if user is not None:
+            size = getattr(settings, 'BURGER_TOKEN_USER_CACHE_SIZE', 1000)
+            with self.lock:
+                self.users[user_id] = (user, time.time())
+                while len(self.users) > size:
+                    self.users.popitem(last=False)
+        return user
+
+    def evict(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+
+user_cache = UserCache()
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate the requests sending 'Authorization: Bearer <token>' with a token from issue_token.
+    A token is refused once expired (BURGER_TOKEN_MAX_AGE), revoked (revoke_tokens) or the password changed, or when
+    the user is no longer active or does not have the staff/superuser flags it was issued with anymore.
+    """
+    keyword = b'bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode('ascii')
+            payload = signing.loads(token, salt=TOKEN_SALT, max_age=get_token_max_age())
+        except (UnicodeError, signing.BadSignature):
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        user = user_cache.get(payload['u'])
+        if user is None or (user.is_staff, user.is_superuser) != (payload['s'], payload['a']):
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        if not constant_time_compare(payload.get('k', ''), get_token_key(user)):
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        return user, token
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
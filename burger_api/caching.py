@@ -0,0 +1,162 @@
+"""
+Caching of the menu catalog: a catalog version bumped on every MenuItem write (stored in the database, see
+burger_api.versions), used for the ETag/Last-Modified of the menu responses and as part of the key of their cached data.
+Caching of the statistics: their data is kept for a while and refreshed in the background once stale.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from .routers import read_replica
+from .versions import SharedVersion
+
+catalog_version = SharedVersion('catalog')
+
+
+def get_cacheable_data(response):
+    # cache plain containers, the serializer return types don't keep their key order when pickled
+    return OrderedDict(response.data) if isinstance(response.data, dict) else list(response.data)
+
+
+def get_catalog_version():
+    """
+    Return the current catalog version
+    """
+    return catalog_version.get()
+
+
+def bump_catalog_version():
+    """
+    Mark the catalog as changed, called once a MenuItem write is committed. Return the previous and the new version.
+    """
+    return catalog_version.bump()
+
+
+class CatalogCacheMixin(object):
+    """
+    Answer list/retrieve requests of the menu catalog with an ETag and Last-Modified derived from the catalog version,
+    with a 304 when the client is up to date, and cache the response data per catalog version and url
+    """
+    def list(self, request, *args, **kwargs):
+        return self.get_catalog_response(super(CatalogCacheMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_catalog_response(super(CatalogCacheMixin, self).retrieve, request, *args, **kwargs)
+
+    def get_catalog_response(self, handler, request, *args, **kwargs):
+        version = get_catalog_version()
+        url = request.build_absolute_uri()
+        # the same url can be rendered differently (e.g. json or the browsable api)
+        etag = hashlib.md5(force_bytes('%s %s %s' % (version, url, request.accepted_media_type))).hexdigest()
+        # Last-Modified has a one second resolution: it is the end of the second of the version, only sent (and
+        # If-Modified-Since only honored) once that second is over, so that no later change can have the same one
+        last_modified = version // 1000000 + 1
+        if last_modified > time.time():
+            last_modified = None
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = 'burger_api:catalog:%s:%s' % (version, hashlib.md5(force_bytes(url)).hexdigest())
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                data = get_cacheable_data(response)
+                cache.set(key, data, getattr(settings, 'BURGER_CATALOG_CACHE_TIMEOUT', 60 * 60))
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+def get_statistics_key(request):
+    return 'burger_api:statistics:%s' % hashlib.md5(force_bytes(request.build_absolute_uri())).hexdigest()
+
+
+def compute_statistics(action, view, request, key, *args, **kwargs):
+    """
+    Run the statistics action and cache its data with the time it was computed, return (response, entry)
+    """
+    response = action(view, request, *args, **kwargs)
+    if response.status_code != 200:
+        return response, None
+    entry = {'data': get_cacheable_data(response), 'created': time.time()}
+    ttl = getattr(settings, 'BURGER_STATISTICS_CACHE_TTL', 5 * 60)
+    # the entries outlive their ttl so that they can be served while they are refreshed
+    cache.set(key, entry, ttl + getattr(settings, 'BURGER_STATISTICS_CACHE_MAX_STALENESS', 60 * 60))
+    return response, entry
+
+
+def refresh_statistics(action, view, request, key, *args, **kwargs):
+    """
+    Compute the statistics again in a background thread (inline when BURGER_STATISTICS_BACKGROUND_REFRESH is off),
+    unless another refresh of the same key holds the lock
+    """
+    lock_key = key + ':refreshing'
+    if not cache.add(lock_key, True, getattr(settings, 'BURGER_STATISTICS_REFRESH_TIMEOUT', 60)):
+        return False
+
+    def refresh():
+        try:
+            compute_statistics(action, view, request, key, *args, **kwargs)
+        finally:
+            cache.delete(lock_key)
+
+    if not getattr(settings, 'BURGER_STATISTICS_BACKGROUND_REFRESH', True):
+        refresh()
+        return True
+
+    def run():
+        try:
+            with read_replica():
+                refresh()
+        finally:
+            # the connections of the thread would stay open otherwise
+            connections.close_all()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+def cached_statistics(action):
+    """
+    Cache the data of a statistics action per url for BURGER_STATISTICS_CACHE_TTL seconds. Once stale it is still served,
+    up to BURGER_STATISTICS_CACHE_MAX_STALENESS seconds more, while one background refresh computes it again.
+    The Age header gives how old the data is, X-Cache tells where it came from (hit, stale, miss or refresh),
+    a 'Cache-Control: no-cache' request computes it again right away.
+    """
+    @functools.wraps(action)
+    def wrapper(self, request, *args, **kwargs):
+        key = get_statistics_key(request)
+        ttl = getattr(settings, 'BURGER_STATISTICS_CACHE_TTL', 5 * 60)
+        entry = None
+        if 'no-cache' in request.META.get('HTTP_CACHE_CONTROL', ''):
+            state = 'refresh'
+        else:
+            entry = cache.get(key)
+            state = 'miss' if entry is None else 'hit'
+        if entry is None:
+            response, entry = compute_statistics(action, self, request, key, *args, **kwargs)
+            if entry is None:
+                return response
+        elif time.time() - entry['created'] > ttl:
+            state = 'stale'
+            refresh_statistics(action, self, request, key, *args, **kwargs)
+        response = Response(entry['data'])
+        response['Age'] = str(max(int(time.time() - entry['created']), 0))
+        response['Last-Modified'] = http_date(entry['created'])
+        response['X-Cache'] = state
+        return response
+    return wrapper
@@ -0,0 +1,75 @@
+"""
+In-process snapshot of the menu catalog: the menu items are read once per catalog version and kept by every process,
+the menu reads and the pricing of the orders use the snapshot instead of reading the items again. The MenuItem signals
+swap in a new snapshot with the change made by the process, any other change of the catalog version (e.g. a change
+made by another process, seen within BURGER_VERSION_CHECK_INTERVAL seconds) loads it again.
+"""
+import threading
+from django.db import DEFAULT_DB_ALIAS, connections
+from .caching import get_catalog_version
+from .models import MenuItem
+
+
+class CatalogSnapshot(object):
+    """
+    The menu items of a catalog version, in the menu order and by id. A snapshot and its items are never changed,
+    a change of the catalog makes a new snapshot.
+    """
+    def __init__(self, version, items):
+        self.version = version
+        self.items = tuple(sorted(items, key=lambda item: (item.created, item.pk)))
+        self.by_id = dict((item.pk, item) for item in self.items)
+
+
+def clean_item(item):
+    # a copy with the python values of the fields, they may have been assigned by hand (e.g. a price given as a string)
+    clean = MenuItem()
+    for field in MenuItem._meta.concrete_fields:
+        setattr(clean, field.attname, field.to_python(getattr(item, field.attname)))
+    clean._state.adding = False
+    clean._state.db = item._state.db
+    return clean
+
+
+class MenuCatalog(object):
+    """
+    The snapshot of the current catalog version, swapped atomically: the readers get the whole old or the whole new one
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def get(self):
+        """
+        Return the snapshot of the current catalog version, loaded on first use and when the version changed.
+        Return None inside a transaction: it may have changed the menu, and the version is only bumped on commit.
+        """
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        version = get_catalog_version()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version != version:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.version != version:
+                    # read after the version, a change committed meanwhile has a newer version and is loaded again
+                    snapshot = self.snapshot = CatalogSnapshot(version, MenuItem.objects.all())
+        return snapshot
+
+    def apply_change(self, item, deleted, previous_version, version):
+        """
+        Swap in a snapshot with the change of a menu item that moved the catalog from previous_version to version.
+        A snapshot that was not up to date with previous_version is left as it is, it is loaded again on the next read.
+        """
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.version != previous_version:
+                return
+            items = dict(snapshot.by_id)
+            items.pop(item.pk, None)
+            if not deleted:
+                items[item.pk] = clean_item(item)
+            self.snapshot = CatalogSnapshot(version, items.values())
+
+
+menu_catalog = MenuCatalog()
@@ -0,0 +1,84 @@
+"""
+Setup of the database connections: the SQLite PRAGMAs of BURGER_SQLITE_PRAGMAS on every new connection,
+a health check of the persistent connections (CONN_MAX_AGE) at the start of every request, and the counting
+of the queries and their time for the request metrics and the load shedding
+"""
+import time
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # on the sqlite3 connection itself, these are not queries of the request
+    for name, value in getattr(settings, 'BURGER_SQLITE_PRAGMAS', ()):
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    if not getattr(settings, 'BURGER_DB_HEALTH_CHECKS', True):
+        return
+    for connection in connections.all():
+        # a connection dropped by the server since the last request is closed, the first query reconnects
+        if (connection.connection is not None and connection.settings_dict['CONN_MAX_AGE'] != 0
+                and not connection.in_atomic_block and not connection.is_usable()):
+            connection.close()
+
+
+class QueryCountingCursorWrapper(CursorWrapper):
+    """
+    Add the queries and their time to the totals of the connection, without the formatting and the log of the
+    debug cursor (which would also keep the last queries of every connection)
+    """
+    def execute(self, sql, params=None):
+        started = time.time()
+        try:
+            return super(QueryCountingCursorWrapper, self).execute(sql, params)
+        finally:
+            self.db.query_count += 1
+            self.db.query_duration += time.time() - started
+
+    def executemany(self, sql, param_list):
+        started = time.time()
+        try:
+            return super(QueryCountingCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.db.query_count += 1
+            self.db.query_duration += time.time() - started
+
+
+class QueryCountingCursorDebugWrapper(QueryCountingCursorWrapper, CursorDebugWrapper):
+    # DEBUG (or a CaptureQueriesContext) still logs the queries
+    pass
+
+
+def count_queries(connection):
+    """
+    Count the queries of the connection and their time in connection.query_count and connection.query_duration
+    """
+    if getattr(connection, 'query_count', None) is not None:
+        return
+    connection.query_count = 0
+    connection.query_duration = 0.0
+    connection.make_cursor = lambda cursor: QueryCountingCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: QueryCountingCursorDebugWrapper(cursor, connection)
+
+
+def get_query_totals():
+    """
+    Return the number of queries and their time so far on the connections of the current thread
+    """
+    queries = 0
+    duration = 0.0
+    for connection in connections.all():
+        count_queries(connection)
+        queries += connection.query_count
+        duration += connection.query_duration
+    return queries, duration
@@ -0,0 +1,150 @@
+"""
+Dispatch queue of the kitchen and the delivery drivers: the active orders (new or being processed) by delivery time.
+A dispatch version is bumped in the database (see burger_api.versions) once every order change is committed, so the
+screens wait for a change (long poll or server-sent events) instead of polling the order listing, and each process
+reads the queue once per version whatever the number of screens waiting.
+"""
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.utils.encoding import force_bytes
+from .models import Order
+from .serializers import LeanOrderSerializer, lean_order_rows
+from .versions import SharedVersion
+
+ACTIVE_STATUSES = ('N', 'P')
+
+dispatch_version = SharedVersion('dispatch')
+
+logger = logging.getLogger(__name__)
+
+
+def get_dispatch_version():
+    """
+    Return the current dispatch version
+    """
+    return dispatch_version.get()
+
+
+def bump_dispatch_version():
+    """
+    Mark the dispatch queue as changed, called once an order write is committed, and wake up the waiters of this process
+    """
+    previous, version = dispatch_version.bump()
+    dispatch_queue.notify()
+    return version
+
+
+def commit_dispatch_change():
+    # the orders are committed already, a failure must not fail the request (its client would send them again)
+    try:
+        bump_dispatch_version()
+    except DatabaseError:
+        logger.exception('Could not bump the dispatch version, the screens get the change with the next one')
+
+
+def dispatch_changed(using):
+    """
+    Bump the dispatch version once the current transaction is committed, once whatever the number of orders it changed
+    """
+    connection = connections[using]
+    if connection.in_atomic_block and any(func is commit_dispatch_change for sids, func in connection.run_on_commit):
+        return
+    transaction.on_commit(commit_dispatch_change, using=using)
+
+
+def close_connections():
+    # a screen waits most of the time, it does not need to hold database connections meanwhile
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+class DispatchQueue(object):
+    """
+    The waiters for a change of the dispatch version in this process, and the queue data of the current version
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.lock = threading.Lock()
+        self.version = None
+        self.data = {}
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        """
+        Return the dispatch version once it is not version anymore, or the same version after timeout seconds.
+        A change made by this process wakes the waiters up right away, the others are seen within
+        BURGER_DISPATCH_POLL_INTERVAL seconds (BURGER_VERSION_CHECK_INTERVAL if longer).
+        """
+        deadline = time.time() + timeout
+        interval = getattr(settings, 'BURGER_DISPATCH_POLL_INTERVAL', 1)
+        while True:
+            current = get_dispatch_version()
+            remaining = deadline - time.time()
+            if current != version or remaining <= 0:
+                return current
+            # the version may have been read from the database
+            close_connections()
+            with self.condition:
+                self.condition.wait(min(remaining, interval))
+
+    def get_data(self, version, request):
+        """
+        Return the active orders of the given version (read after it) serialized like the order listing,
+        read once per version and url prefix in this process, and every time inside a transaction
+        """
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return self.read(request)
+        # the urls of the orders are absolute
+        base = request.build_absolute_uri('/')
+        with self.lock:
+            if self.version == version and base in self.data:
+                return self.data[base]
+        data = self.read(request)
+        with self.lock:
+            # a slower reader of an older version does not replace the newer data
+            if self.version is None or version > self.version:
+                self.version = version
+                self.data = {}
+            if self.version == version:
+                self.data[base] = data
+        return data
+
+    def read(self, request):
+        orders = Order.objects.filter(status__in=ACTIVE_STATUSES).order_by('time_to_deliver', 'pk')
+        limit = getattr(settings, 'BURGER_DISPATCH_MAX_ORDERS', 500)
+        return LeanOrderSerializer(lean_order_rows(orders)[:limit], request).data
+
+
+dispatch_queue = DispatchQueue()
+
+
+def iter_events(request, version, duration):
+    """
+    Yield the server-sent events of the dispatch queue for duration seconds: the queue of every version after the given
+    one (event 'queue', with the version as the event id, so a reconnecting EventSource only gets what it missed)
+    and a comment every BURGER_DISPATCH_KEEPALIVE seconds so that the proxies keep the connection open
+    """
+    deadline = time.time() + duration
+    keepalive = getattr(settings, 'BURGER_DISPATCH_KEEPALIVE', 15)
+    yield b'retry: 1000\n\n'
+    close_connections()
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        current = dispatch_queue.wait_for_change(version, min(remaining, keepalive))
+        if current == version:
+            yield b': keepalive\n\n'
+            continue
+        data = json.dumps({'version': current, 'orders': dispatch_queue.get_data(current, request)}, separators=(',', ':'))
+        close_connections()
+        version = current
+        yield force_bytes('id: %s\nevent: queue\ndata: %s\n\n' % (current, data))
@@ -0,0 +1,74 @@
+"""
+Streaming export of orders with their items as NDJSON or CSV. The orders are read in keyset chunks on (created, id),
+so the memory used stays the same whatever the number of orders exported.
+"""
+import csv
+import json
+from django.db.models import Q
+from django.utils import six
+from django.utils.encoding import force_bytes
+from .serializers import LeanOrderSerializer, format_datetime, format_decimal, lean_order_rows
+
+CSV_COLUMNS = (
+    'order_id', 'created', 'owner', 'status', 'address', 'time_to_deliver', 'time_delivered', 'total_price',
+    'menu_item', 'quantity', 'item_price',
+)
+
+
+def iter_order_chunks(queryset, chunk_size):
+    """
+    Yield the orders of the queryset as lists of at most chunk_size OrderRow, ordered by creation
+    """
+    queryset = lean_order_rows(queryset).order_by('created', 'pk')
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        # the created__gte bound lets the database start the range at the cursor in the created index
+        after = queryset.filter(Q(created__gt=last.created) | Q(pk__gt=last.pk), created__gte=last.created)
+        chunk = list(after[:chunk_size])
+
+
+def iter_orders(queryset, request, chunk_size):
+    """
+    Yield (OrderRow, order data) for the orders of the queryset, the data is the one of the order listings
+    """
+    for chunk in iter_order_chunks(queryset, chunk_size):
+        for row, order in zip(chunk, LeanOrderSerializer(chunk, request).data):
+            yield row, order
+
+
+def export_ndjson(queryset, request, chunk_size):
+    """
+    Yield the orders as JSON lines, the data of the order listings with the creation time
+    """
+    for row, order in iter_orders(queryset, request, chunk_size):
+        order['created'] = format_datetime(row.created)
+        yield json.dumps(order, separators=(',', ':')) + '\n'
+
+
+class Echo(object):
+    # a file-like object returning what is written, for csv.writer
+    def write(self, value):
+        return value
+
+
+def export_csv(queryset, request, chunk_size):
+    """
+    Yield the orders as CSV lines, one line per order item (and one for an order without items)
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row, order in iter_orders(queryset, request, chunk_size):
+        columns = [
+            row.pk, format_datetime(row.created), row.owner_id, row.status, row.address,
+            format_datetime(row.time_to_deliver), format_datetime(row.time_delivered), format_decimal(row.total_price),
+        ]
+        for item in order['order_items'] or [{'menu_item': None, 'quantity': None, 'price': None}]:
+            values = columns + [item['menu_item'], item['quantity'], item['price']]
+            if six.PY2:
+                # the csv module of Python 2 only writes byte strings
+                values = [force_bytes(value) if value is not None else None for value in values]
+            yield writer.writerow(values)
@@ -0,0 +1,36 @@
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.filters import BaseFilterBackend
+from .models import Order
+from .utils import get_choices_param, get_datetime_param, get_int_param
+
+
+class OrderFilter(BaseFilterBackend):
+    """
+    Filter the orders on their creation ('from', 'to') and delivery ('deliver_from', 'deliver_to') date or datetime ranges,
+    their 'status' (comma separated) and, for admins, their 'owner'. Each filter is a range or a set of values of an
+    indexed column, and the customers' own orders are read through the (owner, created) index.
+    """
+    ranges = (
+        ('created', 'from', 'to'),
+        ('time_to_deliver', 'deliver_from', 'deliver_to'),
+    )
+
+    def filter_queryset(self, request, queryset, view):
+        for field, start_param, end_param in self.ranges:
+            start = get_datetime_param(request, start_param)
+            end = get_datetime_param(request, end_param, end_of_day=True)
+            if start is not None and end is not None and start >= end:
+                raise ValidationError({start_param: ['The start must be before the end.']})
+            if start is not None:
+                queryset = queryset.filter(**{field + '__gte': start})
+            if end is not None:
+                queryset = queryset.filter(**{field + '__lt': end})
+        statuses = get_choices_param(request, 'status', dict(Order.STATUS_CHOICES))
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        owner = get_int_param(request, 'owner', None, min_value=1)
+        if owner is not None:
+            if not request.user.is_superuser:
+                raise PermissionDenied('Only admins can filter the orders by owner.')
+            queryset = queryset.filter(owner_id=owner)
+        return queryset
@@ -0,0 +1,330 @@
+"""
+Concurrent load generator for the WSGI application: workers (threads or processes) send a mix of menu browsing,
+order posting and statistics requests, either straight to the application in their own process or over HTTP
+to a local threaded WSGI server, and the latencies and errors of every request are collected.
+"""
+import datetime
+import json
+import multiprocessing
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.core.signals import got_request_exception
+from django.db import connections
+from django.utils import timezone
+from django.utils.six import BytesIO
+from django.utils.six.moves import http_client, socketserver
+from django.utils.six.moves.urllib.parse import urlencode
+from .seeding import WeightedChoice
+
+LOGIN_PATH = '/burger/api-auth/login/'
+STATISTICS_PATHS = (
+    '/burger/statistics/best_customer/',
+    '/burger/statistics/average_spending/',
+    '/burger/statistics/monthly_revenue_report/',
+    '/burger/statistics/revenue_report/?granularity=week',
+)
+
+LOCKED_ERROR = re.compile(r'database (table )?is locked')
+
+
+class LockedErrors(object):
+    """
+    Number of requests of this process that failed with "database is locked"
+    (or "database table is locked", its form with a shared cache)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, sender, request=None, **kwargs):
+        # connected to got_request_exception, called while the exception is being handled
+        error = sys.exc_info()[1]
+        if error is not None and LOCKED_ERROR.search(str(error)):
+            with self.lock:
+                self.count += 1
+
+
+locked_errors = LockedErrors()
+got_request_exception.connect(locked_errors, dispatch_uid='burger_api.loadtest.locked_errors')
+
+
+class BaseClient(object):
+    """
+    Send requests keeping the cookies of the session, with the CSRF token of the session on unsafe requests
+    """
+    def __init__(self):
+        self.cookies = {}
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        if method != 'GET' and 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+        if body is not None:
+            headers['Content-Type'] = content_type
+        status, set_cookies, content = self.send(method, path, body, headers)
+        for set_cookie in set_cookies:
+            name, value = set_cookie.split(';', 1)[0].split('=', 1)
+            self.cookies[name.strip()] = value.strip().strip('"')
+        return status, content
+
+    def login(self, username, password):
+        self.request('GET', LOGIN_PATH)
+        body = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': self.cookies.get('csrftoken', '')})
+        status, content = self.request('POST', LOGIN_PATH, body.encode('ascii'), 'application/x-www-form-urlencoded')
+        if 'sessionid' not in self.cookies:
+            raise RuntimeError('Could not log in as %s (status %d).' % (username, status))
+
+    def send(self, method, path, body, headers):
+        """
+        Return the status, the Set-Cookie headers and the content of the response
+        """
+        raise NotImplementedError
+
+
+class WSGIClient(BaseClient):
+    """
+    Call the WSGI application directly, in the current thread
+    """
+    def __init__(self, application):
+        super(WSGIClient, self).__init__()
+        self.application = application
+
+    def send(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        body = body or b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': '127.0.0.1',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            environ[key if key == 'CONTENT_TYPE' else 'HTTP_' + key] = value
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = response_headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            # sends request_finished, which closes the database connection when it is too old
+            if hasattr(result, 'close'):
+                result.close()
+        set_cookies = [value for name, value in response['headers'] if name.lower() == 'set-cookie']
+        return response['status'], set_cookies, content
+
+
+class HTTPClient(BaseClient):
+    """
+    Send the requests to a server over HTTP, one connection per request
+    """
+    def __init__(self, host, port):
+        super(HTTPClient, self).__init__()
+        self.host = host
+        self.port = port
+
+    def send(self, method, path, body, headers):
+        connection = http_client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+            # getheaders() joins the repeated headers on Python 2
+            if hasattr(response.msg, 'get_all'):
+                set_cookies = response.msg.get_all('Set-Cookie') or []
+            else:
+                set_cookies = response.msg.getheaders('Set-Cookie')
+            return response.status, set_cookies, content
+        finally:
+            connection.close()
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def start_server(application):
+    """
+    Serve the application on a free local port from a background thread, return the server
+    """
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class Traffic(object):
+    """
+    The requests of a worker: kinds are drawn according to the mix (kind: weight) and sent with the right session
+    """
+    def __init__(self, mix, menu_item_ids, rng):
+        kinds = sorted(kind for kind, weight in mix.items() if weight > 0)
+        self.kinds = WeightedChoice(kinds, [mix[kind] for kind in kinds])
+        self.menu_item_ids = menu_item_ids
+        self.rng = rng
+
+    def pick(self):
+        return self.kinds.pick(self.rng)
+
+    def send(self, kind, clients):
+        rng = self.rng
+        if kind == 'menu':
+            if rng.random() < 0.5:
+                return clients['anonymous'].request('GET', '/burger/menuItems/')
+            return clients['anonymous'].request('GET', '/burger/menuItems/%d/' % rng.choice(self.menu_item_ids))
+        if kind == 'order':
+            order = {
+                'address': 'Load test address',
+                'time_to_deliver': (timezone.now() + datetime.timedelta(hours=1)).isoformat(),
+                'order_items': [
+                    {'menu_item': menu_item, 'quantity': 1}
+                    for menu_item in rng.sample(self.menu_item_ids, min(len(self.menu_item_ids), rng.randint(1, 3)))
+                ],
+            }
+            return clients['customer'].request('POST', '/burger/orders/', json.dumps(order).encode('utf-8'), 'application/json')
+        return clients['admin'].request('GET', rng.choice(STATISTICS_PATHS))
+
+
+def run_worker(index, options, make_client):
+    """
+    Send requests for the duration of the load test, return the (kind, status, seconds) of each one
+    (status 0 when the server could not be reached)
+    """
+    rng = random.Random(options['seed'] + index)
+    clients = {'anonymous': make_client(), 'customer': make_client(), 'admin': make_client()}
+    clients['customer'].login(options['customers'][index % len(options['customers'])], options['password'])
+    clients['admin'].login(options['admin'], options['password'])
+    traffic = Traffic(options['mix'], options['menu_item_ids'], rng)
+    results = []
+    try:
+        deadline = time.time() + options['duration']
+        while time.time() < deadline:
+            kind = traffic.pick()
+            started = time.time()
+            try:
+                status = traffic.send(kind, clients)[0]
+            except (socket.error, http_client.HTTPException):
+                status = 0
+            results.append((kind, status, time.time() - started))
+    finally:
+        connections.close_all()
+    return results
+
+
+def run_process_worker(index, options, mode, address, queue):
+    from django.core.wsgi import get_wsgi_application
+    locked_errors.count = 0
+    if mode == 'server':
+        make_client = lambda: HTTPClient(*address)
+    else:
+        application = get_wsgi_application()
+        make_client = lambda: WSGIClient(application)
+    try:
+        queue.put((run_worker(index, options, make_client), locked_errors.count, None))
+    except Exception as e:
+        queue.put(([], 0, '%s: %s' % (type(e).__name__, e)))
+
+
+def run_load_test(application, options):
+    """
+    Run options['workers'] workers of options['worker_type'] (thread or process) sending requests to the application
+    in the same process (mode 'inprocess') or through a local server (mode 'server') for options['duration'] seconds.
+    Return the results of all the requests and the number of "database is locked" errors.
+    """
+    mode = options['mode']
+    server = start_server(application) if mode == 'server' else None
+    address = server.server_address[:2] if server is not None else None
+    locked_errors.count = 0
+    results = []
+    locked = 0
+    try:
+        if options['worker_type'] == 'process':
+            # the workers must not share the connections of this process
+            connections.close_all()
+            queue = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=run_process_worker, args=(index, options, mode, address, queue))
+                for index in range(options['workers'])
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                worker_results, worker_locked, error = queue.get()
+                if error is not None:
+                    raise RuntimeError('A worker failed: %s' % error)
+                results.extend(worker_results)
+                locked += worker_locked
+            for process in processes:
+                process.join()
+        else:
+            if mode == 'server':
+                make_client = lambda: HTTPClient(*address)
+            else:
+                make_client = lambda: WSGIClient(application)
+            worker_results = [None] * options['workers']
+            errors = []
+
+            def run(index):
+                try:
+                    worker_results[index] = run_worker(index, options, make_client)
+                except Exception as e:
+                    errors.append('%s: %s' % (type(e).__name__, e))
+
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise RuntimeError('A worker failed: %s' % errors[0])
+            for worker_result in worker_results:
+                results.extend(worker_result)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return results, locked + locked_errors.count
+
+
+def parse_mix(value):
+    """
+    Parse a traffic mix like 'menu=70,order=20,statistics=10'
+    """
+    mix = {}
+    for part in value.split(','):
+        match = re.match(r'^\s*(menu|order|statistics)\s*=\s*(\d+(?:\.\d+)?)\s*$', part)
+        if match is None:
+            raise ValueError('Invalid traffic mix "%s", expected e.g. menu=70,order=20,statistics=10.' % value)
+        mix[match.group(1)] = float(match.group(2))
+    if not any(mix.values()):
+        raise ValueError('The traffic mix needs at least one positive weight.')
+    return mix
@@ -0,0 +1,153 @@
+import datetime
+import json
+import platform
+import subprocess
+import time
+from collections import OrderedDict
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from burger_api.caching import bump_catalog_version
+from burger_api.dispatch import bump_dispatch_version
+from burger_api.models import MenuItem
+from burger_api.seeding import seeded
+from burger_api.utils import percentile
+
+# JSON rather than the browsable API, the export only has its own formats
+ACCEPT = 'application/json, */*'
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Seed the database at increasing sizes and time every endpoint of the API at each size, with cold caches '
+            '(every version bumped and the cache cleared before each request) and warm ones. '
+            'Print the latency percentiles and query counts as JSON, to compare runs between commits. '
+            'The seeded data is committed for the run, as the caches only work outside of a transaction, '
+            'and deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated numbers of orders')
+        parser.add_argument('--orders-per-user', type=int, default=50, help='Average number of orders of a customer')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests of each endpoint at each size')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the random data')
+        parser.add_argument('--output', help='Write the JSON to this file instead of the standard output')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers.')
+        if options['requests'] < 1 or options['orders_per_user'] < 1:
+            raise CommandError('--requests and --orders-per-user must be at least 1.')
+        self.requests = options['requests']
+        results = OrderedDict((
+            ('commit', get_commit()),
+            ('date', timezone.now().isoformat()),
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('database', connection.vendor),
+            ('requests', self.requests),
+            ('sizes', []),
+        ))
+        for size in sizes:
+            # every size starts from the same tables, the views read the default database (the throttles are off)
+            started = time.time()
+            users = max(size // options['orders_per_user'], 1)
+            with seeded(DEFAULT_DB_ALIAS, users=users, menu_items=30, orders=size, seed=options['seed']), \
+                    override_settings(BURGER_USER_THROTTLE_RATES={}, BURGER_ROUTE_THROTTLE_RATES={}):
+                seed_time = time.time() - started
+                endpoints = OrderedDict()
+                for name, method, path, data, user in self.get_endpoints():
+                    endpoints[name] = OrderedDict((('method', method), ('path', path)))
+                    endpoints[name]['cold'] = self.measure(method, path, data, user, cold=True)
+                    endpoints[name]['warm'] = self.measure(method, path, data, user, cold=False)
+                results['sizes'].append(OrderedDict((
+                    ('orders', size), ('users', users), ('seed_seconds', round(seed_time, 2)), ('endpoints', endpoints),
+                )))
+            self.stderr.write('Measured %d endpoints with %d orders' % (len(endpoints), size))
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def get_endpoints(self):
+        """
+        Return the (name, method, path, data, user) of the endpoints to time
+        """
+        admin = User.objects.create(username='benchmark-admin', is_staff=True, is_superuser=True)
+        customer = User.objects.annotate(number_of_orders=Count('orders')).order_by('-number_of_orders').first()
+        order = customer.orders.order_by('-created').first()
+        menu_item = MenuItem.objects.order_by('pk').first()
+        today = timezone.now().date()
+        a_month_ago = (today - datetime.timedelta(days=30)).isoformat()
+        time_to_deliver = (timezone.now() + datetime.timedelta(hours=1)).isoformat()
+        batch = [{'address': 'Benchmark address', 'time_to_deliver': time_to_deliver,
+                  'order_items': [{'menu_item': menu_item.pk, 'quantity': 1}]}] * 10
+        return [
+            ('order-list', 'get', reverse('order-list'), None, admin),
+            ('order-list (customer)', 'get', reverse('order-list'), None, customer),
+            ('order-list (cursor)', 'get', reverse('order-list') + '?pagination=cursor&page_size=50', None, customer),
+            ('order-detail', 'get', reverse('order-detail', kwargs={'pk': order.pk}), None, customer),
+            ('order-batch (10 orders)', 'post', reverse('order-batch'), batch, customer),
+            ('order-export (last month)', 'get', reverse('order-export') + '?from=' + a_month_ago, None, admin),
+            ('order-dispatch', 'get', reverse('order-dispatch'), None, admin),
+            ('user-orders', 'get', reverse('user-orders', kwargs={'pk': customer.pk}), None, admin),
+            ('user-orders (cursor)', 'get', reverse('user-orders', kwargs={'pk': customer.pk}) + '?pagination=cursor&page_size=50', None, admin),
+            ('statistics-best-customer', 'get', reverse('statistics-best-customer') + '?top=10', None, admin),
+            ('statistics-average-spending', 'get', reverse('statistics-average-spending'), None, admin),
+            ('statistics-monthly-revenue-report', 'get', reverse('statistics-monthly-revenue-report'), None, admin),
+            ('statistics-revenue-report', 'get', reverse('statistics-revenue-report') + '?granularity=day&from=' + a_month_ago, None, admin),
+            ('menuitem-list', 'get', reverse('menuitem-list'), None, None),
+            ('menuitem-detail', 'get', reverse('menuitem-detail', kwargs={'pk': menu_item.pk}), None, None),
+        ]
+
+    def clear_caches(self):
+        # what a change of the menu and of the orders does, for every process
+        bump_catalog_version()
+        bump_dispatch_version()
+        cache.clear()
+
+    def measure(self, method, path, data, user, cold):
+        """
+        Request the path as the user, with the caches cleared before each request when cold and after a first untimed
+        request otherwise, return its status, query count and latencies
+        """
+        client = APIClient()
+        client.force_authenticate(user)
+        request = getattr(client, method)
+        if not cold:
+            request(path, data, format='json', HTTP_ACCEPT=ACCEPT)
+        latencies = []
+        for i in range(self.requests):
+            if cold:
+                self.clear_caches()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.time()
+                response = request(path, data, format='json', HTTP_ACCEPT=ACCEPT)
+                # the streamed responses are produced while they are read
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                latencies.append((time.time() - started) * 1000)
+        return OrderedDict((
+            ('status', response.status_code),
+            ('queries', len(queries)),
+            ('bytes', len(content)),
+            ('p50_ms', round(percentile(latencies, 50), 2)),
+            ('p90_ms', round(percentile(latencies, 90), 2)),
+            ('p99_ms', round(percentile(latencies, 99), 2)),
+            ('max_ms', round(max(latencies), 2)),
+        ))
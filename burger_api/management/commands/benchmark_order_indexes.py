@@ -0,0 +1,111 @@
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+from burger_api.models import Order
+from burger_api.seeding import rolled_back, seed_database
+from burger_api.utils import one_year_before
+
+# the columns of the Order indexes added for the hot queries
+ORDER_INDEXES = (['created'], ['time_to_deliver'], ['status', 'time_to_deliver'], ['owner_id', 'created', 'total_price'])
+
+
+class Command(BaseCommand):
+    help = ('Seed orders, then show the query plans and timings of the hot Order queries with and without '
+            'the Order indexes. Everything runs in a transaction that is rolled back, the database is left unchanged.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--menu-items', type=int, default=30)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each query, the best one is reported')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the random data')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('Dropping indexes inside a transaction needs SQLite or PostgreSQL.')
+        self.using = using
+        self.repeat = options['repeat']
+        with rolled_back(using):
+            started = time.time()
+            seed_database(users=options['users'], menu_items=options['menu_items'], orders=options['orders'],
+                          seed=options['seed'], using=using)
+            self.stdout.write('Seeded %d orders in %.1f s' % (options['orders'], time.time() - started))
+            queries = self.get_hot_queries()
+            with_indexes = [self.measure(queryset, 'with indexes') for name, queryset in queries]
+            dropped = self.drop_order_indexes(connection)
+            self.stdout.write('Dropped indexes: %s' % ', '.join(dropped))
+            without_indexes = [self.measure(queryset, 'without indexes') for name, queryset in queries]
+        for (name, queryset), before, after in zip(queries, without_indexes, with_indexes):
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write('  before: %8.2f ms   %s' % (before[0] * 1000, '\n                       '.join(before[1])))
+            self.stdout.write('  after:  %8.2f ms   %s' % (after[0] * 1000, '\n                       '.join(after[1])))
+            self.stdout.write('  speedup: %.1fx' % (before[0] / after[0] if after[0] else float('inf')))
+
+    def get_hot_queries(self):
+        now = timezone.now()
+        year_ago = one_year_before(now)
+        month_ago = now - (now - year_ago) / 12
+        orders = Order.objects.using(self.using)
+        customer = orders.values_list('owner_id', flat=True).order_by('-pk').first()
+        return [
+            ('Orders of a customer in the last year (order history, keyset pages)',
+             orders.filter(owner_id=customer, created__gte=year_ago, created__lt=now).order_by('created', 'pk')[:10]),
+            ('Best customers of the last year',
+             User.objects.using(self.using).filter(orders__created__unindexed__gte=year_ago, orders__created__unindexed__lt=now).annotate(
+                 number_of_orders=Count('orders'), revenue=Sum('orders__total_price')).order_by('-number_of_orders')[:10]),
+            ('Best customers of the last month',
+             User.objects.using(self.using).filter(orders__created__unindexed__gte=month_ago, orders__created__unindexed__lt=now).annotate(
+                 number_of_orders=Count('orders'), revenue=Sum('orders__total_price')).order_by('-number_of_orders')[:10]),
+            ('Revenue of the last month',
+             orders.filter(created__gte=month_ago, created__lt=now).order_by().values_list('total_price', flat=True)),
+            ('Orders by creation time (admin listing and export, first page)',
+             orders.order_by('created', 'pk')[:10]),
+            ('Orders created in a month (filtered listing, first page)',
+             orders.filter(created__gte=month_ago, created__lt=now).order_by('created', 'pk')[:10]),
+            ('Orders waiting for dispatch (dispatch queue)',
+             orders.filter(status__in=['N', 'P']).order_by('time_to_deliver', 'pk')[:500]),
+            ('Orders to deliver in a two hour window (filtered listing, first page)',
+             orders.filter(time_to_deliver__gte=month_ago, time_to_deliver__lt=month_ago + timedelta(hours=2)).order_by('created', 'pk')[:10]),
+            ('Delivered orders of a customer in the last month (filtered listing, first page)',
+             orders.filter(owner_id=customer, status__in=['D'], created__gte=month_ago, created__lt=now).order_by('created', 'pk')[:10]),
+        ]
+
+    def measure(self, queryset, label):
+        """
+        Return the best time of the query and its plan
+        """
+        best = None
+        for i in range(self.repeat):
+            started = time.time()
+            list(queryset.all())
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, self.explain(queryset, label)
+
+    def explain(self, queryset, label):
+        connection = connections[self.using]
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            # the label keeps the sqlite3 statement cache from returning the plan made before the indexes were dropped
+            cursor.execute('%s%s /* %s */' % (prefix, sql, label), params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+    def drop_order_indexes(self, connection):
+        table = Order._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            dropped = []
+            for name, constraint in sorted(constraints.items()):
+                if constraint['index'] and not constraint['unique'] and constraint['columns'] in ORDER_INDEXES:
+                    cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+                    dropped.append(name)
+        return dropped
@@ -0,0 +1,55 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from burger_api.seeding import rolled_back, seed_database
+from burger_api.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    help = ('Seed orders, then time the order listing (cursor pages of the given sizes, rendered to JSON) '
+            'with OrderSerializer and with the lean listings. The seeded data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--page-sizes', default='10,100,1000', help='Comma separated page sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests for each page size, the best one is reported')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the random data')
+
+    def handle(self, *args, **options):
+        try:
+            page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--page-sizes must be a comma separated list of integers.')
+        self.repeat = options['repeat']
+        # the views read the default database
+        with rolled_back(DEFAULT_DB_ALIAS):
+            seed_database(users=100, menu_items=30, orders=options['orders'], seed=options['seed'])
+            self.admin = User.objects.create(username='benchmark-admin', is_staff=True, is_superuser=True)
+            self.stdout.write('%10s %14s %14s %9s' % ('page size', 'serializer', 'lean', 'speedup'))
+            for page_size in page_sizes:
+                full, full_content = self.measure(page_size, lean=False)
+                lean, lean_content = self.measure(page_size, lean=True)
+                if lean_content != full_content:
+                    raise CommandError('The lean listing of %d orders differs from the serializer one.' % page_size)
+                self.stdout.write('%10d %11.2f ms %11.2f ms %8.1fx' % (page_size, full * 1000, lean * 1000, full / lean))
+
+    def measure(self, page_size, lean):
+        """
+        Return the best time of listing a page (from the request to the rendered JSON) and the response content
+        """
+        view = OrderViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        best = None
+        with override_settings(BURGER_LEAN_ORDER_LISTINGS=lean):
+            for i in range(self.repeat):
+                request = factory.get('/burger/orders/', {'pagination': 'cursor', 'page_size': page_size}, HTTP_ACCEPT='application/json')
+                force_authenticate(request, user=self.admin)
+                started = time.time()
+                response = view(request)
+                response.render()
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+        return best, response.content
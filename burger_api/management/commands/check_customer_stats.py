@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from burger_api.rollups import rebuild_customer_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-customer spending stats from the orders and report any drift from the stored stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, keep the stored stats')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to check the stats on')
+
+    def handle(self, *args, **options):
+        drift = rebuild_customer_stats(dry_run=options['dry_run'], using=options['database'])
+        for user_id, stored, expected in drift:
+            self.stdout.write('Customer %s: stored %s, expected %s' % (user_id, self.describe(stored), self.describe(expected)))
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING('%d customers drifted.' % len(drift)))
+        else:
+            self.stdout.write(self.style.WARNING('%d customers drifted and were rebuilt.' % len(drift)))
+
+    def describe(self, stats):
+        if stats is None:
+            return 'nothing'
+        orders, total_spent, first_order, last_order = stats
+        return '%d orders, $%s spent, first %s, last %s' % (orders, total_spent, first_order, last_order)
@@ -0,0 +1,95 @@
+import logging
+import random
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.utils.crypto import get_random_string
+from burger_api.loadtest import parse_mix, run_load_test
+from burger_api.models import MenuItem, Order
+from burger_api.utils import percentile
+
+USERNAME_PREFIX = 'loadtest-'
+
+
+class Command(BaseCommand):
+    help = ('Send concurrent mixed traffic (menu browsing, order posting, statistics) to the WSGI application and report '
+            'the throughput, latency percentiles and "database is locked" errors. Orders are really created, '
+            'they are removed at the end with the load test users unless --keep-orders is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('inprocess', 'server'), default='inprocess',
+                            help='Call the application directly, or through a local threaded WSGI server')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--worker-type', choices=('thread', 'process'), default='thread')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of traffic')
+        parser.add_argument('--mix', default='menu=70,order=20,statistics=10', help='Relative weights of the request kinds')
+        parser.add_argument('--customers', type=int, default=20, help='Number of customers the workers post orders as')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the random traffic')
+        parser.add_argument('--keep-orders', action='store_true', help='Keep the orders created by the load test')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['workers'] < 1 or options['customers'] < 1 or options['duration'] <= 0:
+            raise CommandError('--workers, --customers and --duration must be positive.')
+        menu_item_ids = list(MenuItem.objects.values_list('pk', flat=True))
+        if not menu_item_ids:
+            raise CommandError('There are no menu items to order, seed the database first (see seed_database).')
+        password = get_random_string(32)
+        customers = [self.make_user('%scustomer%d' % (USERNAME_PREFIX, i), password) for i in range(options['customers'])]
+        admin = self.make_user(USERNAME_PREFIX + 'admin', password, is_staff=True, is_superuser=True)
+        load_test_options = {
+            'mode': options['mode'],
+            'workers': options['workers'],
+            'worker_type': options['worker_type'],
+            'duration': options['duration'],
+            'mix': mix,
+            'menu_item_ids': menu_item_ids,
+            'customers': [customer.username for customer in customers],
+            'admin': admin.username,
+            'password': password,
+            'seed': options['seed'] if options['seed'] is not None else random.randrange(1000000),
+        }
+        # the failed requests are counted, not logged one by one
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            results, locked = run_load_test(get_internal_wsgi_application(), load_test_options)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        finally:
+            request_logger.setLevel(level)
+            users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+            if not options['keep_orders']:
+                for order in Order.objects.filter(owner__in=users):
+                    order.delete()
+            users.delete()
+        self.report(results, locked, options)
+
+    def make_user(self, username, password, **fields):
+        user, created = User.objects.get_or_create(username=username, defaults=fields)
+        user.set_password(password)
+        user.save()
+        return user
+
+    def report(self, results, locked, options):
+        duration = options['duration']
+        self.stdout.write('%d %s workers (%s) for %.0f s, mix %s' % (
+            options['workers'], options['worker_type'], options['mode'], duration, options['mix']))
+        self.stdout.write('%-12s %8s %9s %9s %9s %9s %8s %8s' % (
+            'kind', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'limited', 'errors'))
+        kinds = sorted(set(kind for kind, status, seconds in results))
+        for kind in kinds + ['total']:
+            selected = [(status, seconds) for result_kind, status, seconds in results if kind in ('total', result_kind)]
+            latencies = [seconds * 1000 for status, seconds in selected]
+            # throttled (429) or shed (503) requests are refused on purpose, they are not errors
+            limited = len([status for status, seconds in selected if status in (429, 503)])
+            errors = len([status for status, seconds in selected if not 200 <= status < 400]) - limited
+            self.stdout.write('%-12s %8d %9.1f %9.1f %9.1f %9.1f %8d %8d' % (
+                kind, len(selected), len(selected) / duration, percentile(latencies, 50),
+                percentile(latencies, 95), percentile(latencies, 99), limited, errors))
+        rate = 100.0 * locked / len(results) if results else 0
+        self.stdout.write('"database is locked" errors: %d (%.2f%% of the requests)' % (locked, rate))
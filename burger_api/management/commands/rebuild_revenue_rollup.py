@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from burger_api.rollups import rebuild_daily_revenue
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild the daily revenue rollup from the existing orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Number of orders read per query')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to rebuild the rollup on')
+
+    def handle(self, *args, **options):
+        orders, days = rebuild_daily_revenue(chunk_size=options['chunk_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d daily revenue rows from %d orders.' % (days, orders)))
@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from burger_api.seeding import seed_database
+
+
+class Command(BaseCommand):
+    help = ('Bulk insert synthetic customers, menu items and orders spread over the last days like real traffic, '
+            'then rebuild the rollups')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--menu-items', type=int, default=30)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--max-items-per-order', type=int, default=4)
+        parser.add_argument('--days', type=int, default=365, help='The orders are created during the last days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of orders inserted at once')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the random data, to seed the same data again')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to seed')
+
+    def handle(self, *args, **options):
+        for name in ('users', 'menu_items', 'orders'):
+            if options[name] < 0:
+                raise CommandError('--%s must not be negative.' % name.replace('_', '-'))
+        for name in ('max_items_per_order', 'days', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError('--%s must be at least 1.' % name.replace('_', '-'))
+        started = time.time()
+        try:
+            items = seed_database(
+                users=options['users'], menu_items=options['menu_items'], orders=options['orders'],
+                max_items_per_order=options['max_items_per_order'], days=options['days'],
+                batch_size=options['batch_size'], seed=options['seed'], using=options['database'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('Seeded %d users, %d menu items, %d orders and %d order items in %.1f s.' % (
+            options['users'], options['menu_items'], options['orders'], items, time.time() - started)))
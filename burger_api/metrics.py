@@ -0,0 +1,134 @@
+"""
+In-process request metrics: MetricsMiddleware records the wall time, database queries (count and time) and
+serializer time of every request in histograms per route, served in the Prometheus text format by MetricsView.
+The histograms are per process, each worker of a deployment serves its own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from .db import get_query_totals
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed values for each set of label values
+    """
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        # labels is a tuple of (name, value) pairs, callers hold the registry lock
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s histogram' % self.name]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = ','.join('%s="%s"' % (name, escape_label(value)) for name, value in labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label_text, format_bound(bound), bucket_count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label_text, count))
+            lines.append('%s_sum{%s} %r' % (self.name, label_text, float(total)))
+            lines.append('%s_count{%s} %d' % (self.name, label_text, count))
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+
+class Registry(object):
+    """
+    The request histograms of this process
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.request_duration = Histogram(
+                'burger_request_duration_seconds', 'Wall time of the requests', DURATION_BUCKETS)
+            self.db_queries = Histogram(
+                'burger_db_queries', 'Database queries made by a request', QUERY_COUNT_BUCKETS)
+            self.db_duration = Histogram(
+                'burger_db_duration_seconds', 'Time spent in database queries by a request', DURATION_BUCKETS)
+            self.serializer_duration = Histogram(
+                'burger_serializer_duration_seconds', 'Time spent serializing the response data of a request', DURATION_BUCKETS)
+
+    def record(self, labels, duration, queries, db_duration, serializer_duration):
+        with self.lock:
+            self.request_duration.observe(labels, duration)
+            self.db_queries.observe(labels, queries)
+            self.db_duration.observe(labels, db_duration)
+            self.serializer_duration.observe(labels, serializer_duration)
+
+    def render(self):
+        with self.lock:
+            histograms = (self.request_duration, self.db_queries, self.db_duration, self.serializer_duration)
+            return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+
+registry = Registry()
+
+_state = threading.local()
+
+
+@contextmanager
+def measure_serialization():
+    """
+    Add the time spent in the block to the serializer time of the current request (nested blocks count once)
+    """
+    depth = getattr(_state, 'serialization_depth', 0)
+    _state.serialization_depth = depth + 1
+    started = time.time()
+    try:
+        yield
+    finally:
+        _state.serialization_depth = depth
+        if depth == 0 and getattr(_state, 'serializer_duration', None) is not None:
+            _state.serializer_duration += time.time() - started
+
+
+class MetricsMiddleware(object):
+    """
+    Record the metrics of every request under the name of the route it resolved to (e.g. 'order-list').
+    The queries are counted by the cursors of the connections (see count_queries).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries_before, db_duration_before = get_query_totals()
+        _state.serializer_duration = 0
+        started = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.time() - started
+            serializer_duration = _state.serializer_duration
+            _state.serializer_duration = None
+            queries, db_duration = get_query_totals()
+            queries -= queries_before
+            db_duration -= db_duration_before
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None else 'unresolved'
+        registry.record((('route', route), ('method', request.method)), duration, queries, db_duration, serializer_duration)
+        return response
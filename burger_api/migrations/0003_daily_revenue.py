@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 09:20
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_daily_revenue(apps, schema_editor):
+    Order = apps.get_model('burger_api', 'Order')
+    DailyRevenue = apps.get_model('burger_api', 'DailyRevenue')
+    db_alias = schema_editor.connection.alias
+    days = defaultdict(lambda: [0, Decimal('0.00')])
+    for created, total_price in Order.objects.using(db_alias).values_list('created', 'total_price').iterator():
+        totals = days[timezone.localtime(created, timezone.utc).date()]
+        totals[0] += 1
+        totals[1] += total_price or 0
+    DailyRevenue.objects.using(db_alias).bulk_create(
+        [DailyRevenue(day=day, orders=orders, revenue=revenue) for day, (orders, revenue) in days.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('burger_api', '0002_auto_20161226_0150'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'ordering': ('day',),
+            },
+        ),
+        migrations.RunPython(backfill_daily_revenue, migrations.RunPython.noop),
+    ]
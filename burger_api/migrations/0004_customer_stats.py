@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 09:23
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+import django.db.models.deletion
+
+
+def backfill_customer_stats(apps, schema_editor):
+    Order = apps.get_model('burger_api', 'Order')
+    CustomerStats = apps.get_model('burger_api', 'CustomerStats')
+    db_alias = schema_editor.connection.alias
+    totals = Order.objects.using(db_alias).filter(owner__isnull=False).order_by().values('owner_id').annotate(
+        orders=Count('pk'), total_spent=Sum('total_price'), first_order=Min('created'), last_order=Max('created'),
+    )
+    CustomerStats.objects.using(db_alias).bulk_create([
+        CustomerStats(user_id=row['owner_id'], orders=row['orders'], total_spent=row['total_spent'] or 0,
+                      first_order=row['first_order'], last_order=row['last_order'])
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('burger_api', '0003_daily_revenue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='customer_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('orders', models.IntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('first_order', models.DateTimeField(blank=True, null=True)),
+                ('last_order', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_customer_stats, migrations.RunPython.noop),
+    ]
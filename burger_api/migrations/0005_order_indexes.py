@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 09:30
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('burger_api', '0004_customer_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('N', 'New'), ('P', 'Processing'), ('O', 'On the way'), ('D', 'Delivered')], db_index=True, default='N', max_length=1),
+        ),
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('owner', 'created')]),
+        ),
+    ]
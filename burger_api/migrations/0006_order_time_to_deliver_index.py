@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 10:15
+from __future__ import unicode_literals
+
+import datetime
+import django.core.validators
+from django.db import migrations, models
+from django.utils.timezone import utc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('burger_api', '0005_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='time_to_deliver',
+            field=models.DateTimeField(blank=True, db_index=True, validators=[django.core.validators.MinValueValidator(datetime.datetime(2026, 10, 18, 10, 15, 1, 14984, tzinfo=utc))]),
+        ),
+    ]
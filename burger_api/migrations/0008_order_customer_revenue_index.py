@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('burger_api', '0007_order_dispatch_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('owner', 'created'), ('status', 'time_to_deliver'), ('owner', 'created', 'total_price')]),
+        ),
+    ]
@@ -1,7 +1,31 @@
+from collections import namedtuple
+from decimal import Decimal
 from django.utils import timezone
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import F, Max, Min, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.core.validators import MinValueValidator
 
+# The fields of an order that the rollup tables are computed from
+OrderState = namedtuple('OrderState', ('created', 'owner_id', 'total_price'))
+
+
+@models.DateTimeField.register_lookup
+class Unindexed(models.Transform):
+    """
+    The field written so that SQLite does not search its own index with it (unary +), for the ranges covering most of
+    the table where another index is cheaper, e.g. created__unindexed__gte. SQLite picks the index of the range
+    when it has no statistics (ANALYZE). The plain field on the other databases.
+    """
+    lookup_name = 'unindexed'
+    
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.lhs)
+    
+    def as_sqlite(self, compiler, connection):
+        sql, params = compiler.compile(self.lhs)
+        return '+' + sql, params
+
 class MenuItem(models.Model):
     """
     MenuItem model, defines the availble menu items that can be ordered
@@ -29,10 +53,10 @@ class Order(models.Model):
         ('D', 'Delivered')
     )    
     
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     owner = models.ForeignKey('auth.User', related_name='orders', on_delete=models.SET_NULL, null=True, editable=False)
     address = models.CharField(max_length=250)
-    time_to_deliver = models.DateTimeField(blank=True, validators=[MinValueValidator(timezone.now())])
+    time_to_deliver = models.DateTimeField(blank=True, validators=[MinValueValidator(timezone.now())], db_index=True)
     time_delivered = models.DateTimeField(blank=True, null=True)
     status = models.CharField(default='N', choices=STATUS_CHOICES, max_length=1)
     total_price = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True)
@@ -40,8 +64,33 @@ class Order(models.Model):
     def is_delivered(self):
         return self.status == 'D'
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Order, cls).from_db(db, field_names, values)
+        # remember what was stored so the rollups can be updated with the difference on save/delete
+        if all(name in field_names for name in OrderState._fields):
+            instance._stored_state = instance.get_state()
+        # and whether it was in the dispatch queue
+        if 'status' in field_names:
+            instance._stored_status = instance.status
+        return instance
+    
+    def get_state(self):
+        # total_price may still be a string when it was assigned by hand
+        return OrderState(self.created, self.owner_id, self._meta.get_field('total_price').to_python(self.total_price))
+    
+    def save(self, *args, **kwargs):
+        # the rollups are updated by the post_save signal, keep them in the same transaction as the order
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super(Order, self).save(*args, **kwargs)
+    
     class Meta:
         ordering = ('created',)
+        # the active orders by delivery time (dispatch queue),
+        # the orders of a customer in a time range (order history), with their price so that the best customers
+        # are counted and summed from the index alone
+        index_together = (('status', 'time_to_deliver'), ('owner', 'created', 'total_price'))
 
 
 class OrderItem(models.Model):
@@ -57,3 +106,106 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         self.price = self.menu_item.price * self.quantity
         super(OrderItem, self).save(*args, **kwargs)
+
+
+class DailyRevenue(models.Model):
+    """
+    Number of orders and revenue of a day (UTC), updated in the same transaction as every order write
+    so the revenue reports read pre-aggregated rows instead of scanning the orders
+    """
+    day = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return str(self.day) + "    $" + str(self.revenue)
+    
+    @classmethod
+    def add(cls, day, orders, revenue, using=None):
+        """
+        Add (or subtract, using negative values) orders and revenue to a day
+        """
+        manager = cls.objects.using(using)
+        if manager.filter(day=day).update(orders=F('orders') + orders, revenue=F('revenue') + revenue):
+            return
+        try:
+            with transaction.atomic(using=using):
+                manager.create(day=day, orders=orders, revenue=revenue)
+        except IntegrityError:
+            # the day was created by a concurrent order
+            manager.filter(day=day).update(orders=F('orders') + orders, revenue=F('revenue') + revenue)
+    
+    class Meta:
+        ordering = ('day',)
+
+
+class CustomerStats(models.Model):
+    """
+    Number of orders, total spending and first/last order time of a customer,
+    updated in the same transaction as every order write
+    """
+    user = models.OneToOneField('auth.User', related_name='customer_stats', on_delete=models.CASCADE, primary_key=True)
+    orders = models.IntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    first_order = models.DateTimeField(blank=True, null=True)
+    last_order = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return str(self.user_id) + "    $" + str(self.total_spent)
+    
+    def average_spending(self):
+        if not self.orders:
+            return None
+        return (self.total_spent / self.orders).quantize(Decimal('0.01'))
+    
+    @classmethod
+    def add(cls, user_id, orders, spent, order_time=None, using=None):
+        """
+        Add (or subtract, using negative values) orders and spending to a customer,
+        order_time is the creation time of an added order
+        """
+        manager = cls.objects.using(using)
+        changes = {'orders': F('orders') + orders, 'total_spent': F('total_spent') + spent}
+        if order_time is not None:
+            order_time_value = Value(order_time, output_field=models.DateTimeField())
+            changes['first_order'] = Least(Coalesce('first_order', order_time_value), order_time_value)
+            changes['last_order'] = Greatest(Coalesce('last_order', order_time_value), order_time_value)
+        if manager.filter(user_id=user_id).update(**changes):
+            return
+        try:
+            with transaction.atomic(using=using):
+                manager.create(user_id=user_id, orders=orders, total_spent=spent, first_order=order_time, last_order=order_time)
+        except IntegrityError:
+            # the customer was created by a concurrent order
+            manager.filter(user_id=user_id).update(**changes)
+    
+    @classmethod
+    def refresh_order_times(cls, user_id, using=None):
+        """
+        Read the first/last order time of a customer again, needed when one of its orders is removed
+        """
+        times = Order.objects.using(using).filter(owner_id=user_id).aggregate(first=Min('created'), last=Max('created'))
+        cls.objects.using(using).filter(user_id=user_id).update(first_order=times['first'], last_order=times['last'])
+
+
+class TokenRevocation(models.Model):
+    """
+    Last time the tokens of a user were revoked, the tokens issued before are refused
+    """
+    user = models.OneToOneField('auth.User', related_name='token_revocation', on_delete=models.CASCADE, primary_key=True)
+    revoked = models.DateTimeField()
+    
+    def __str__(self):
+        return str(self.user_id) + "    " + str(self.revoked)
+
+
+class Version(models.Model):
+    """
+    Version of data kept by every process (e.g. the menu catalog), bumped on every change, with the one it replaced
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField()
+    previous = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return self.name + "    " + str(self.value)
@@ -0,0 +1,122 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StatisticsPagination(PageNumberPagination):
+    """
+    Page number pagination for the statistics, admins can ask for bigger pages using 'page_size'
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created, id): every page is a range query on the position of the
+    last (or first) row of the previous page, so deep pages cost the same as the first one.
+    The count of all the rows is only computed when asked for with 'count=true'.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('true', '1'):
+            self.count = queryset.count()
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            reverse = False
+            queryset = queryset.order_by('created', 'pk')
+        else:
+            created, pk, reverse = cursor
+            # the created__lte/created__gte bounds let the database start the range at the cursor in the created index
+            if reverse:
+                queryset = queryset.filter(Q(created__lt=created) | Q(pk__lt=pk), created__lte=created).order_by('-created', '-pk')
+            else:
+                queryset = queryset.filter(Q(created__gt=created) | Q(pk__gt=pk), created__gte=created).order_by('created', 'pk')
+        # one more row tells if there is a page after this one
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_previous = has_more
+            self.has_next = bool(page)
+        else:
+            self.has_previous = cursor is not None and bool(page)
+            self.has_next = has_more
+        self.reverse = reverse
+        self.page = page
+        return page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_paginated_response(self, data):
+        content = OrderedDict()
+        if self.count is not None:
+            content['count'] = self.count
+        content['next'] = self.get_next_link()
+        content['previous'] = self.get_previous_link()
+        content['results'] = data
+        return Response(content)
+
+    def get_next_link(self):
+        if not self.has_next:
+            if self.reverse and not self.page:
+                # nothing left before the cursor, continue from the first page
+                return remove_query_param(self.base_url, self.cursor_query_param)
+            return None
+        last = self.page[-1]
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(last.created, last.pk, False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        first = self.page[0]
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(first.created, first.pk, True))
+
+    def encode_cursor(self, created, pk, reverse):
+        position = '%s|%s|%d' % ('r' if reverse else 'n', created.isoformat(), pk)
+        return urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        Return the (created, id, reverse) position of the cursor or None for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            direction, created, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None or direction not in ('n', 'r'):
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk, direction == 'r'
+
+
+def use_keyset_pagination(request):
+    """
+    The keyset pagination is used when asked for with 'pagination=cursor', or to follow one of its cursors
+    """
+    return request.query_params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in request.query_params
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import permissions
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -13,5 +14,14 @@ class IsAllowedToOrder(permissions.BasePermission):
     Permission on the object access level
     """
     def has_object_permission(self, request, view, obj):
-        if (request.method == 'GET' and obj.owner == request.user) or (request.method == 'POST') or (request.user.is_superuser):
+        if (request.method == 'GET' and obj.owner_id == request.user.pk) or (request.method == 'POST') or (request.user.is_superuser):
             return True
+
+
+class IsAdminOrLocal(permissions.BasePermission):
+    """
+    Permission on the access level, allow admin users and the requests coming from BURGER_METRICS_ALLOWED_IPS
+    """
+    def has_permission(self, request, view):
+        allowed_ips = getattr(settings, 'BURGER_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+        return request.user.is_staff or request.META.get('REMOTE_ADDR') in allowed_ips
@@ -0,0 +1,45 @@
+import json
+from rest_framework import renderers
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    """
+    Render metrics already in the Prometheus text format, errors are rendered as plain text
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '%s\n' % data.get('detail', data)
+        return data.encode(self.charset)
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    """
+    Format of a streamed export (see burger_api.export), the exports are streamed by the view
+    and only the errors are rendered, as one line of JSON
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data) + '\n').encode(self.charset)
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class EventStreamRenderer(ExportRenderer):
+    """
+    Server-sent events streamed by the view (see burger_api.dispatch), only the errors are rendered
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
@@ -0,0 +1,169 @@
+"""
+Pre-aggregated tables computed from the orders, see DailyRevenue and CustomerStats
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+from .models import CustomerStats, DailyRevenue, Order
+
+
+def revenue_day(created):
+    """
+    Return the (UTC) day an order created at the given time is accounted to
+    """
+    return timezone.localtime(created, timezone.utc).date()
+
+
+def apply_order_change(previous, current, using=None):
+    """
+    Update the rollups with the difference between two states of an order,
+    previous is None for a new order and current is None for a deleted one
+    """
+    days = defaultdict(lambda: [0, Decimal('0.00')])
+    if previous is not None:
+        totals = days[revenue_day(previous.created)]
+        totals[0] -= 1
+        totals[1] -= previous.total_price or 0
+    if current is not None:
+        totals = days[revenue_day(current.created)]
+        totals[0] += 1
+        totals[1] += current.total_price or 0
+    for day, (orders, revenue) in days.items():
+        if orders or revenue:
+            DailyRevenue.add(day, orders, revenue, using=using)
+    apply_customer_change(previous, current, using=using)
+
+
+def apply_customer_change(previous, current, using=None):
+    previous_owner = previous.owner_id if previous is not None else None
+    current_owner = current.owner_id if current is not None else None
+    if previous_owner is not None and previous_owner == current_owner:
+        spent = (current.total_price or 0) - (previous.total_price or 0)
+        if spent:
+            CustomerStats.add(current_owner, 0, spent, using=using)
+        if current.created != previous.created:
+            CustomerStats.refresh_order_times(current_owner, using=using)
+        return
+    if previous_owner is not None:
+        CustomerStats.add(previous_owner, -1, -(previous.total_price or 0), using=using)
+        CustomerStats.refresh_order_times(previous_owner, using=using)
+    if current_owner is not None:
+        CustomerStats.add(current_owner, 1, current.total_price or 0, order_time=current.created, using=using)
+
+
+def rebuild_daily_revenue(chunk_size=5000, using=DEFAULT_DB_ALIAS):
+    """
+    Recompute DailyRevenue from the orders, reading them in chunks of chunk_size orders.
+    Return the number of orders read and days written.
+    """
+    days = defaultdict(lambda: [0, Decimal('0.00')])
+    orders = Order.objects.using(using).order_by('pk').values_list('pk', 'created', 'total_price')
+    count = 0
+    last_pk = 0
+    while True:
+        chunk = list(orders.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        for pk, created, total_price in chunk:
+            totals = days[revenue_day(created)]
+            totals[0] += 1
+            totals[1] += total_price or 0
+        count += len(chunk)
+        last_pk = chunk[-1][0]
+    with transaction.atomic(using=using):
+        DailyRevenue.objects.using(using).all().delete()
+        DailyRevenue.objects.using(using).bulk_create(
+            [DailyRevenue(day=day, orders=orders, revenue=revenue) for day, (orders, revenue) in sorted(days.items())],
+            batch_size=500,
+        )
+    return count, len(days)
+
+
+def rebuild_customer_stats(dry_run=False, using=DEFAULT_DB_ALIAS):
+    """
+    Recompute CustomerStats from the orders with one grouped query and compare it to what is stored.
+    Return the customers whose stored stats drifted as a list of (user id, stored, expected),
+    with stored/expected being (orders, total spent, first order, last order) or None when missing.
+    The stored stats are replaced unless dry_run is set.
+    """
+    expected = {}
+    totals = Order.objects.using(using).filter(owner__isnull=False).order_by().values('owner_id').annotate(
+        orders=Count('pk'), total_spent=Sum('total_price'), first_order=Min('created'), last_order=Max('created'),
+    )
+    for row in totals:
+        expected[row['owner_id']] = (row['orders'], row['total_spent'] or Decimal('0.00'), row['first_order'], row['last_order'])
+    stored = {}
+    for stats in CustomerStats.objects.using(using).all():
+        stored[stats.user_id] = (stats.orders, stats.total_spent, stats.first_order, stats.last_order)
+    drift = []
+    for user_id in sorted(set(expected) | set(stored)):
+        stored_stats = stored.get(user_id)
+        expected_stats = expected.get(user_id)
+        if stored_stats is not None and expected_stats is None and not stored_stats[0]:
+            continue # a customer whose orders were all removed
+        if stored_stats != expected_stats:
+            drift.append((user_id, stored_stats, expected_stats))
+    if not dry_run:
+        with transaction.atomic(using=using):
+            CustomerStats.objects.using(using).all().delete()
+            CustomerStats.objects.using(using).bulk_create([
+                CustomerStats(user_id=user_id, orders=orders, total_spent=total_spent, first_order=first_order, last_order=last_order)
+                for user_id, (orders, total_spent, first_order, last_order) in sorted(expected.items())
+            ], batch_size=500)
+    return drift
+
+
+def period_start(day, granularity):
+    """
+    Return the first day of the day/week (starting on Monday)/month the given day belongs to
+    """
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + datetime.timedelta(days=7)
+    if granularity == 'month':
+        return (start + datetime.timedelta(days=32)).replace(day=1)
+    return start + datetime.timedelta(days=1)
+
+
+def count_periods(start, end, granularity):
+    """
+    Return the number of days/weeks/months overlapping the start and end days
+    """
+    first = period_start(start, granularity)
+    last = period_start(end, granularity)
+    if granularity == 'month':
+        return (last.year - first.year) * 12 + last.month - first.month + 1
+    return (last - first).days // (7 if granularity == 'week' else 1) + 1
+
+
+def revenue_by_period(start, end, granularity, using=None):
+    """
+    Return the orders and revenue of every day/week/month overlapping the start and end days
+    as a list of (period start, orders, revenue), periods are always whole and the ones without orders
+    are included with zeros
+    """
+    first = period_start(start, granularity)
+    last = period_start(end, granularity)
+    totals = defaultdict(lambda: [0, Decimal('0.00')])
+    rows = DailyRevenue.objects.using(using).filter(day__gte=first, day__lt=next_period(last, granularity))
+    for day, orders, revenue in rows.values_list('day', 'orders', 'revenue'):
+        period = totals[period_start(day, granularity)]
+        period[0] += orders
+        period[1] += revenue
+    report = []
+    period = first
+    while period <= last:
+        orders, revenue = totals[period]
+        report.append((period, orders, revenue))
+        period = next_period(period, granularity)
+    return report
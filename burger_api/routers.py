@@ -0,0 +1,81 @@
+"""
+Routing of reads to the read-only database aliases listed in BURGER_READ_REPLICAS.
+Only the requests of the views using ReadReplicaMixin are routed, everything else stays on the primary.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+_state = threading.local()
+
+
+def get_read_replicas():
+    return list(getattr(settings, 'BURGER_READ_REPLICAS', ()))
+
+
+@contextmanager
+def read_replica():
+    """
+    Send the reads made in the block to one of the read replicas (picked at random), if any are configured
+    """
+    replicas = get_read_replicas()
+    previous = getattr(_state, 'alias', None)
+    _state.alias = random.choice(replicas) if replicas else None
+    try:
+        yield _state.alias
+    finally:
+        _state.alias = previous
+
+
+@contextmanager
+def primary():
+    """
+    Keep the reads made in the block on the primary, inside read_replica() too
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = None
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+class ReadReplicaRouter(object):
+    """
+    Route the reads made inside read_replica() to the chosen replica. Writes, reads inside a transaction of
+    the primary (they may need what was just written) and reads of related objects all stay where they are.
+    """
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'alias', None)
+        if alias is None or 'instance' in hints or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+
+class ReadReplicaMixin(object):
+    """
+    Serve the safe requests of a view from a read replica
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if not self.reads_from_replica(request):
+            return super(ReadReplicaMixin, self).dispatch(request, *args, **kwargs)
+        with read_replica():
+            return super(ReadReplicaMixin, self).dispatch(request, *args, **kwargs)
+
+    def perform_authentication(self, request):
+        # a replica lagging behind a login, a logout or a revoked token would answer for another user
+        with primary():
+            super(ReadReplicaMixin, self).perform_authentication(request)
+
+    def reads_from_replica(self, request):
+        return request.method in SAFE_METHODS
@@ -0,0 +1,136 @@
+"""
+In-process search index of the menu items for type-ahead: every word of the names and descriptions is indexed in a
+sorted list, so the words starting with what was typed are found with a binary search instead of scanning the table.
+Each process builds its index on its first search, the MenuItem signals apply the changes made by the process and
+any other change of the catalog version (e.g. a change made by another process) rebuilds it.
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from .caching import get_catalog_version
+from .models import MenuItem
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# weight of a word found in the name or in the description of an item, doubled when the word is typed in full
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def get_words(text):
+    return WORD.findall(text.lower()) if text else []
+
+
+class MenuSearchIndex(object):
+    """
+    Words of the menu items: item id -> item, word -> {item id: weight} and the sorted list of the words
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.version = None
+        self.items = {}
+        self.postings = {}
+        self.words = []
+
+    def build(self):
+        version = get_catalog_version()
+        items = list(MenuItem.objects.all())
+        with self.lock:
+            self.items = {}
+            self.postings = {}
+            self.words = []
+            for item in items:
+                self.words.extend(self._add(item))
+            self.words.sort()
+            self.version = version
+
+    def ensure_current(self):
+        """
+        Build the index on first use, rebuild it when the catalog changed in another process
+        """
+        if self.version != get_catalog_version():
+            with self.build_lock:
+                if self.version != get_catalog_version():
+                    self.build()
+
+    def apply_change(self, item, deleted, previous_version, version):
+        """
+        Apply the change of a menu item that moved the catalog from previous_version to version. An index that was not
+        up to date with previous_version is left as it is, it is rebuilt on the next search. The index keeps the item,
+        it must not be changed afterwards.
+        """
+        with self.lock:
+            if self.version is None or self.version != previous_version:
+                return
+            self._remove(item.pk)
+            if not deleted:
+                for word in self._add(item):
+                    insort(self.words, word)
+            self.version = version
+
+    def _add(self, item):
+        # return the words new to the index, the callers add them to self.words
+        self.items[item.pk] = item
+        weights = {}
+        for weight, text in ((DESCRIPTION_WEIGHT, item.description), (NAME_WEIGHT, item.name)):
+            for word in get_words(text):
+                weights[word] = weight
+        new_words = []
+        for word, weight in weights.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                new_words.append(word)
+            postings[item.pk] = weight
+        return new_words
+
+    def _remove(self, item_id):
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return
+        for word in set(get_words(item.name) + get_words(item.description)):
+            postings = self.postings[word]
+            postings.pop(item_id, None)
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def search(self, query, limit):
+        """
+        Return the menu items having words starting with every word of the query, best matches first:
+        by score (words of the name before words of the description, whole words before prefixes), then the items
+        whose name starts with the query, then the shortest names
+        """
+        terms = get_words(query)
+        if not terms:
+            return []
+        self.ensure_current()
+        with self.lock:
+            scores = None
+            for term in terms:
+                # the score of an item for a term is the one of its best word starting with the term
+                term_scores = {}
+                for index in range(bisect_left(self.words, term), len(self.words)):
+                    word = self.words[index]
+                    if not word.startswith(term):
+                        break
+                    factor = 2 if word == term else 1
+                    for item_id, weight in self.postings[word].items():
+                        if term_scores.get(item_id, 0) < weight * factor:
+                            term_scores[item_id] = weight * factor
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = dict((item_id, score + term_scores[item_id]) for item_id, score in scores.items() if item_id in term_scores)
+                if not scores:
+                    return []
+            query = query.strip().lower()
+            items = self.items
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda entry: (
+                -entry[1], not items[entry[0]].name.lower().startswith(query), len(items[entry[0]].name), entry[0]))
+            return [items[item_id] for item_id, score in ranked]
+
+
+search_index = MenuSearchIndex()
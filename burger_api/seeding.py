@@ -0,0 +1,203 @@
+"""
+Bulk synthetic data for benchmarks: customers, menu items and orders with their items, spread over time
+like real traffic (lunch and dinner peaks, busier weekends, a few customers ordering much more than the others)
+"""
+import bisect
+import datetime
+import random
+from contextlib import contextmanager
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .caching import bump_catalog_version
+from .dispatch import bump_dispatch_version
+from .models import MenuItem, Order, OrderItem
+from .rollups import rebuild_customer_stats, rebuild_daily_revenue
+
+# relative number of orders per hour of the day
+HOUR_WEIGHTS = (1, 0, 0, 0, 0, 0, 1, 2, 3, 3, 4, 8, 14, 12, 6, 4, 4, 6, 10, 13, 11, 7, 4, 2)
+# relative number of orders per day of the week, Monday first
+WEEKDAY_WEIGHTS = (10, 10, 10, 11, 14, 16, 13)
+
+ORDER_COLUMNS = ('id', 'created', 'owner_id', 'address', 'time_to_deliver', 'time_delivered', 'status', 'total_price')
+ORDER_ITEM_COLUMNS = ('id', 'order_id', 'menu_item_id', 'quantity', 'price')
+
+
+@contextmanager
+def explicit_creation_times():
+    """
+    Let the seeded rows keep the creation time they were given instead of the insertion time
+    """
+    fields = [MenuItem._meta.get_field('created'), Order._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back(using=DEFAULT_DB_ALIAS):
+    """
+    Run the block in a transaction that is rolled back at the end, to seed data for a benchmark without keeping it
+    """
+    try:
+        with transaction.atomic(using=using):
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+@contextmanager
+def seeded(using=DEFAULT_DB_ALIAS, **options):
+    """
+    Run the block with the data of seed_database(**options) committed, so that the versions, the caches and the
+    snapshots work as they do in production (they are all off inside a transaction), then delete every user, menu item
+    and order added since (by the seeding or in the block)
+    """
+    first = dict((model, next_pk(model, using)) for model in (User, MenuItem, Order))
+    try:
+        seed_database(using=using, **options)
+        # the rows were inserted in bulk, without the signals bumping the versions
+        bump_catalog_version()
+        bump_dispatch_version()
+        yield
+    finally:
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        with transaction.atomic(using=using):
+            # far too many orders to delete one by one with their signals, the rollups are rebuilt instead
+            with connection.cursor() as cursor:
+                for model, column, pk in ((OrderItem, 'order_id', first[Order]), (Order, 'id', first[Order])):
+                    cursor.execute('DELETE FROM %s WHERE %s >= %%s' % (quote_name(model._meta.db_table), quote_name(column)), [pk])
+            MenuItem.objects.using(using).filter(pk__gte=first[MenuItem]).delete()
+            User.objects.using(using).filter(pk__gte=first[User]).delete()
+            rebuild_daily_revenue(using=using)
+            rebuild_customer_stats(using=using)
+        bump_dispatch_version()
+
+
+def next_pk(model, using):
+    # bulk_create doesn't return the primary keys on every backend, so the seeded rows get explicit ones
+    return (model.objects.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class WeightedChoice(object):
+    """
+    Pick values at random, each with a chance proportional to its weight
+    """
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def pick(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+HOURS = WeightedChoice(range(24), HOUR_WEIGHTS)
+
+
+def random_order_time(rng, start, days):
+    # days are drawn uniformly and kept according to their weekday weight
+    while True:
+        day = start + datetime.timedelta(days=rng.randrange(days))
+        if rng.random() * max(WEEKDAY_WEIGHTS) < WEEKDAY_WEIGHTS[day.weekday()]:
+            break
+    return day + datetime.timedelta(hours=HOURS.pick(rng), seconds=rng.randrange(3600), microseconds=rng.randrange(1000000))
+
+
+def adapt_datetime(connection, value):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def insert_rows(connection, model, columns, rows):
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote_name(model._meta.db_table), ', '.join(quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def seed_database(users=100, menu_items=20, orders=1000, max_items_per_order=4, days=365, batch_size=1000,
+                  seed=None, using=DEFAULT_DB_ALIAS):
+    """
+    Insert the given number of customers, menu items and orders (with 1 to max_items_per_order items each)
+    created during the last days, then rebuild the rollups. Return the number of order items inserted.
+    """
+    if orders and not (users and menu_items):
+        raise ValueError('Orders need at least one customer and one menu item.')
+    rng = random.Random(seed)
+    now = timezone.now()
+    start = (now - datetime.timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    with transaction.atomic(using=using), explicit_creation_times():
+        user_pk = next_pk(User, using)
+        password = make_password(None)
+        User.objects.using(using).bulk_create([
+            User(pk=user_pk + i, username='customer%d' % (user_pk + i), password=password, date_joined=start)
+            for i in range(users)
+        ])
+        # a few customers order much more than the others
+        customers = WeightedChoice(range(user_pk, user_pk + users), [rng.paretovariate(1.5) for i in range(users)])
+
+        menu_pk = next_pk(MenuItem, using)
+        menu_prices = {}
+        for i in range(menu_items):
+            menu_prices[menu_pk + i] = Decimal(rng.randrange(200, 1000)) / 100
+        MenuItem.objects.using(using).bulk_create([
+            MenuItem(pk=pk, name='Menu item %d' % pk, description='Seeded menu item', price=price, created=start)
+            for pk, price in sorted(menu_prices.items())
+        ])
+        menu_pks = sorted(menu_prices)
+
+        # orders and their items are inserted with plain executemany, far cheaper than building model instances
+        connection = connections[using]
+        order_pk = next_pk(Order, using)
+        item_pk = next_pk(OrderItem, using)
+        total_items = 0
+        for batch_start in range(0, orders, batch_size):
+            order_rows = []
+            item_rows = []
+            for pk in range(order_pk + batch_start, order_pk + min(batch_start + batch_size, orders)):
+                created = random_order_time(rng, start, days)
+                total_price = Decimal('0.00')
+                for menu_item in rng.sample(menu_pks, rng.randint(1, min(max_items_per_order, len(menu_pks)))):
+                    quantity = rng.randint(1, 2)
+                    price = menu_prices[menu_item] * quantity
+                    item_rows.append((item_pk + total_items, pk, menu_item, quantity, str(price)))
+                    total_price += price
+                    total_items += 1
+                time_to_deliver = created + datetime.timedelta(minutes=rng.randint(30, 90))
+                delivered = time_to_deliver < now
+                time_to_deliver = adapt_datetime(connection, time_to_deliver)
+                order_rows.append((
+                    pk, adapt_datetime(connection, created), customers.pick(rng), 'Seeded address %d' % pk, time_to_deliver,
+                    time_to_deliver if delivered else None, 'D' if delivered else rng.choice('NPO'), str(total_price),
+                ))
+            insert_rows(connection, Order, ORDER_COLUMNS, order_rows)
+            insert_rows(connection, OrderItem, ORDER_ITEM_COLUMNS, item_rows)
+        # let the database sequences continue after the explicit primary keys
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, MenuItem, Order, OrderItem])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+        rebuild_daily_revenue(using=using)
+        rebuild_customer_stats(using=using)
+    return total_items
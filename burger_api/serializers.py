@@ -1,61 +1,365 @@
+from collections import OrderedDict, defaultdict, namedtuple
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.query import ValuesListIterable
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
+from .catalog import menu_catalog
+from .metrics import measure_serialization
 from .models import MenuItem, Order, OrderItem
 from decimal import Decimal
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class TimedSerializerMixin(object):
+    """
+    Count the time spent building the data as serializer time in the request metrics
+    """
+    @property
+    def data(self):
+        with measure_serialization():
+            return super(TimedSerializerMixin, self).data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+def check_fields(fields, available):
+    """
+    Raise a validation error of the 'fields' parameter when one of the fields is not available
+    """
+    for name in fields:
+        if name not in available:
+            raise ValidationError({'fields': ['"%s" is not a valid field, expected some of: %s.' % (name, ', '.join(available))]})
+
+
+def get_nested_expand(expand, name):
+    """
+    Return the expansions of the nested serializer of the field name ('order_items.menu_item' gives 'menu_item')
+    """
+    prefix = name + '.'
+    return [value[len(prefix):] for value in expand or () if value.startswith(prefix)]
+
+
+class DynamicFieldsMixin(object):
+    """
+    Let the views trim a serializer to the 'fields' asked for and replace the related fields listed in 'expand'
+    by the data of the related objects (see expandable_fields). 'order_items.menu_item' expands the menu_item
+    field of the nested order_items serializer.
+    """
+    # field name: function returning the expanded field
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super(DynamicFieldsMixin, self).__init__(*args, **kwargs)
+        if expand:
+            self.expand_fields(expand)
+        if fields is not None:
+            check_fields(fields, list(self.fields))
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def expand_fields(self, expand):
+        nested = OrderedDict()
+        for name in expand:
+            name, _, nested_name = name.partition('.')
+            if nested_name:
+                nested.setdefault(name, []).append(nested_name)
+            elif name in self.expandable_fields and name in self.fields:
+                self.fields[name] = self.expandable_fields[name]()
+            else:
+                self.fail_expand(name)
+        for name, names in nested.items():
+            field = self.fields.get(name)
+            if not isinstance(getattr(field, 'child', field), DynamicFieldsMixin) and name in self.expandable_fields:
+                # expanding a field of the related objects expands the field itself
+                field = self.expandable_fields[name]()
+            serializer = getattr(field, 'child', field)
+            if not isinstance(serializer, DynamicFieldsMixin):
+                self.fail_expand(name)
+            many = isinstance(field, serializers.ListSerializer)
+            self.fields[name] = serializer.__class__(many=many, read_only=True, expand=names)
+
+    def fail_expand(self, name):
+        choices = ', '.join(sorted(self.expandable_fields)) or 'none'
+        raise ValidationError({'expand': ['"%s" can not be expanded, expected some of: %s.' % (name, choices)]})
+
+    @classmethod
+    def setup_queryset(cls, queryset, fields=None, expand=None):
+        """
+        Return the queryset loading what the selected fields and expansions need,
+        by default only the columns of the selected fields
+        """
+        if fields is None:
+            return queryset
+        columns = set(field.name for field in queryset.model._meta.concrete_fields)
+        return queryset.only('pk', *[name for name in fields if name in columns])
+
+
+class UserSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Serializes the expanded owner of an order
+    """
+    class Meta:
+        model = User
+        fields = ('url', 'id', 'username')
+
+
+class UserSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     """
     Serializes User model
     """
     # Serialize the orders requested by this user
     orders = serializers.HyperlinkedRelatedField(many=True, view_name='order-detail', read_only=True)
+    expandable_fields = {
+        'orders': lambda: OrderSerializer(many=True, read_only=True),
+    }
 
     class Meta:
         model = User
         fields = ('url', 'id', 'username', 'orders')
+        list_serializer_class = TimedListSerializer
+
+    @classmethod
+    def setup_queryset(cls, queryset, fields=None, expand=None):
+        queryset = super(UserSerializer, cls).setup_queryset(queryset, fields, expand)
+        expand = expand or ()
+        if (fields is None or 'orders' in fields) and ('orders' in expand or get_nested_expand(expand, 'orders')):
+            # the orders of the users with their items, in one query each
+            orders = OrderSerializer.setup_queryset(Order.objects.all(), None, get_nested_expand(expand, 'orders'))
+            queryset = queryset.prefetch_related(Prefetch('orders', queryset=orders))
+        return queryset
+
+
+class CustomerRankingSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    """
+    Serializes a User annotated with its number of orders and revenue (see StatisticsViewSet.best_customer)
+    """
+    number_of_orders = serializers.IntegerField(read_only=True)
+    revenue = serializers.DecimalField(max_digits=None, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('url', 'id', 'username', 'number_of_orders', 'revenue')
+        list_serializer_class = TimedListSerializer
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializes MenuItem model
     """
     class Meta:
         model = MenuItem
         fields = ('id', 'url', 'name', 'description', 'price')
+        list_serializer_class = TimedListSerializer
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class MenuItemField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key of the menu item of an order item, looked up in the menu items that
+    the order serializer fetched at once for all the items (see OrderSerializer.to_internal_value)
+    """
+    def to_internal_value(self, data):
+        menu_items = self.context.get('menu_items')
+        if menu_items is None:
+            return super(MenuItemField, self).to_internal_value(data)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in menu_items:
+            self.fail('does_not_exist', pk_value=data)
+        return menu_items[pk]
+
+
+class OrderItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializes OrderItem model
     """
+    menu_item = MenuItemField(queryset=MenuItem.objects.all())
+    expandable_fields = {
+        'menu_item': lambda: MenuItemSerializer(read_only=True),
+    }
+    
     class Meta:
         model = OrderItem
         fields = ('menu_item', 'quantity', 'price', 'order')
+        # both are set when the order is created
+        read_only_fields = ('price', 'order')
         
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializes Order model
     """
     
     # Serialize the items included in this order
     order_items = OrderItemSerializer(many=True)
+    expandable_fields = {
+        'owner': lambda: UserSummarySerializer(read_only=True),
+    }
     class Meta:
         model = Order
         fields = ('url', 'id', 'owner', 'order_items', 'total_price', 'address', 'time_to_deliver', 'time_delivered', 'status')
+        list_serializer_class = TimedListSerializer
+    
+    @classmethod
+    def setup_queryset(cls, queryset, fields=None, expand=None):
+        """
+        The items are only fetched when they are serialized (with their menu items when expanded, in the same query),
+        the owners are joined when expanded. The creation time is always loaded, the listings are ordered by it.
+        """
+        columns = None if fields is None else list(fields) + ['created']
+        queryset = super(OrderSerializer, cls).setup_queryset(queryset, columns, expand)
+        if fields is None or 'order_items' in fields:
+            items = OrderItem.objects.all()
+            if 'menu_item' in get_nested_expand(expand, 'order_items'):
+                items = items.select_related('menu_item')
+            queryset = queryset.prefetch_related(Prefetch('order_items', queryset=items))
+        if (fields is None or 'owner' in fields) and 'owner' in (expand or ()):
+            queryset = queryset.select_related('owner')
+        return queryset
+    
+    def to_internal_value(self, data):
+        # fetch the menu items of all the order items with one query, unless it was already done for a batch of orders
+        if 'menu_items' not in self.context:
+            self.context['menu_items'] = fetch_menu_items([data])
+        return super(OrderSerializer, self).to_internal_value(data)
     
     # this is needed in order to create order items and associate them with the order
     def create(self, validated_data):
         items_data = validated_data.pop('order_items')
-        order = Order.objects.create(**validated_data) # create the order first
-        # create order items and assciate them with the order
+        # price the items in memory, the same way OrderItem.save does
+        order_items = []
+        total_price = Decimal('0.00')
         for item in items_data:
-            OrderItem.objects.create(order=order, **item)
-        # compute order total price and save it
-        order.total_price = Decimal(0.0)
-        for item in OrderItem.objects.filter(order=order):
-            order.total_price += item.price
-        order.save()
+            quantity = item.get('quantity', 1)
+            price = item['menu_item'].price * quantity
+            order_items.append(OrderItem(menu_item=item['menu_item'], quantity=quantity, price=price))
+            total_price += price
+        # write the order with its total once, then all its items at once
+        with transaction.atomic():
+            order = Order.objects.create(total_price=total_price, **validated_data)
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
         return order
+
+
+def fetch_menu_items(orders_data):
+    """
+    Return the menu items referenced by the items of the given (not validated) orders data by id, taken from the
+    catalog snapshot, or read with their prices only inside a transaction. Invalid ids are skipped, they are reported
+    by the validation.
+    """
+    ids = set()
+    for data in orders_data:
+        items = data.get('order_items') if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            try:
+                ids.add(int(item['menu_item']))
+            except (KeyError, TypeError, ValueError):
+                pass
+    if not ids:
+        return {}
+    snapshot = menu_catalog.get()
+    if snapshot is not None:
+        return dict((pk, snapshot.by_id[pk]) for pk in ids if pk in snapshot.by_id)
+    return MenuItem.objects.only('id', 'price').in_bulk(list(ids))
+
+
+# the order columns read by the lean listings, named like the model attributes so the paginators can read them
+OrderRow = namedtuple('OrderRow', ('pk', 'owner_id', 'total_price', 'address', 'time_to_deliver', 'time_delivered', 'status', 'created'))
+
+
+class OrderRowIterable(ValuesListIterable):
+    """
+    Yield the rows of a values_list() queryset of the OrderRow columns as OrderRow tuples
+    """
+    def __iter__(self):
+        for row in super(OrderRowIterable, self).__iter__():
+            yield OrderRow._make(row)
+
+
+def lean_order_rows(queryset):
+    """
+    Turn a queryset of orders into a queryset of OrderRow tuples for LeanOrderSerializer
+    """
+    queryset = queryset.prefetch_related(None).values_list(*OrderRow._fields)
+    queryset._iterable_class = OrderRowIterable
+    return queryset
+
+
+def format_datetime(value):
+    # the same as serializers.DateTimeField with the default ISO 8601 format
+    if not value:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_decimal(value):
+    # the same as serializers.DecimalField, the database already returns the field's decimal places
+    if value is None:
+        return None
+    return '{0:f}'.format(value)
+
+
+class LeanOrderSerializer(object):
+    """
+    Read-only serializer of order listings giving the same data as OrderSerializer, built from OrderRow tuples
+    and the flat rows of their items (one query) instead of the serializer fields. The data only holds
+    strings, numbers and None, which the json module encodes without calling back into Python.
+    """
+    url_placeholder = '00000'
+
+    def __init__(self, rows, request, fields=None):
+        self.rows = rows
+        if fields is not None:
+            check_fields(fields, OrderSerializer.Meta.fields)
+        # the same order of the fields as OrderSerializer
+        self.fields = None if fields is None else [name for name in OrderSerializer.Meta.fields if name in fields]
+        # the url of every order is the url of a placeholder order with its id in place of the placeholder
+        url = reverse('order-detail', kwargs={'pk': self.url_placeholder}, request=request)
+        self.url_prefix, self.url_suffix = url.rsplit(self.url_placeholder, 1)
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return self.serialize()
+
+    def serialize(self):
+        rows = list(self.rows)
+        items = defaultdict(list)
+        if rows and (self.fields is None or 'order_items' in self.fields):
+            item_rows = OrderItem.objects.filter(order_id__in=[row.pk for row in rows]).order_by('pk').values_list(
+                'order_id', 'menu_item_id', 'quantity', 'price')
+            for order_id, menu_item_id, quantity, price in item_rows:
+                items[order_id].append(OrderedDict((
+                    ('menu_item', menu_item_id), ('quantity', quantity), ('price', format_decimal(price)), ('order', order_id),
+                )))
+        url_prefix = self.url_prefix
+        url_suffix = self.url_suffix
+        orders = [OrderedDict((
+            ('url', '%s%d%s' % (url_prefix, row.pk, url_suffix)),
+            ('id', row.pk),
+            ('owner', row.owner_id),
+            ('order_items', items[row.pk]),
+            ('total_price', format_decimal(row.total_price)),
+            ('address', row.address),
+            ('time_to_deliver', format_datetime(row.time_to_deliver)),
+            ('time_delivered', format_datetime(row.time_delivered)),
+            ('status', row.status),
+        )) for row in rows]
+        if self.fields is not None:
+            orders = [OrderedDict((name, order[name]) for name in self.fields) for order in orders]
+        return orders
@@ -0,0 +1,67 @@
+import copy
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .authentication import user_cache
+from .caching import bump_catalog_version
+from .catalog import menu_catalog
+from .dispatch import ACTIVE_STATUSES, dispatch_changed
+from .models import MenuItem, Order, OrderState
+from .rollups import apply_order_change
+from .search import search_index
+
+
+@receiver(pre_save, sender=Order)
+def read_stored_order_state(sender, instance, raw, using, **kwargs):
+    # orders loaded with deferred fields (or built by hand) don't know what is stored, read it before it is overwritten
+    if raw or instance.pk is None or hasattr(instance, '_stored_state'):
+        return
+    stored = Order.objects.using(using).filter(pk=instance.pk).values_list(*OrderState._fields).first()
+    instance._stored_state = OrderState(*stored) if stored else None
+
+
+@receiver(post_save, sender=Order)
+def update_rollups_on_order_save(sender, instance, created, raw, using, **kwargs):
+    if raw: # loaded from a fixture, the rollups are rebuilt separately
+        return
+    current = instance.get_state()
+    apply_order_change(None if created else instance._stored_state, current, using=using)
+    instance._stored_state = current
+
+
+@receiver(post_delete, sender=Order)
+def update_rollups_on_order_delete(sender, instance, using, **kwargs):
+    apply_order_change(getattr(instance, '_stored_state', None) or instance.get_state(), None, using=using)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def update_dispatch_version(sender, instance, using, **kwargs):
+    # only the orders that are or were in the queue change it (an order of unknown stored status may have been)
+    was_active = getattr(instance, '_stored_status', 'N') in ACTIVE_STATUSES and not kwargs.get('created')
+    if was_active or instance.status in ACTIVE_STATUSES:
+        dispatch_changed(using)
+    instance._stored_status = instance.status
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def update_catalog_version(sender, instance, using, **kwargs):
+    # a copy, the instance may still change before the commit
+    item = copy.copy(instance)
+    deleted = kwargs['signal'] is post_delete
+
+    # bump once committed, so nothing read before the commit gets cached under the new version
+    def catalog_changed():
+        previous, version = bump_catalog_version()
+        search_index.apply_change(item, deleted, previous, version)
+        menu_catalog.apply_change(item, deleted, previous, version)
+    transaction.on_commit(catalog_changed, using=using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_token_user(sender, instance, **kwargs):
+    # the next token request of the user reads it again (other processes read it again after a while)
+    user_cache.evict(instance.pk)
@@ -1,11 +1,41 @@
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.urls import reverse
-from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate, APIClient
+from rest_framework.test import APITestCase, APITransactionTestCase, APIRequestFactory, force_authenticate, APIClient
 from rest_framework import status
 from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import got_request_exception
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from decimal import Decimal
+from unittest import skipIf
+from django.utils import six
+from django.utils.six.moves.urllib.parse import quote
+from django.utils.http import http_date
+import csv
+import json
+import threading
+import time
 from .views import UserViewSet, StatisticsViewSet, MenuItemViewSet, OrderViewSet
-from .models import MenuItem, Order
+from .models import CustomerStats, DailyRevenue, MenuItem, Order, OrderItem, Version
+from .authentication import user_cache
+from .caching import bump_catalog_version, catalog_version, get_catalog_version, get_statistics_key, refresh_statistics
+from .catalog import menu_catalog
+from .db import configure_sqlite_connection
+from . import dispatch
+from .dispatch import bump_dispatch_version, dispatch_version
+from .loadtest import locked_errors, parse_mix
+from .metrics import Histogram, registry
+from .rollups import rebuild_customer_stats
+from .routers import ReadReplicaRouter, read_replica
+from .seeding import seed_database
+from .serializers import OrderSerializer
+from .throttling import load_shedder, parse_rate
 
 factory = APIRequestFactory(enforce_csrf_checks=True)
 
@@ -16,8 +46,8 @@ def make_super_user():
     user.save()
     return user
 
-def make_normal_user():
-    user = User.objects.create_user('NormalUser', password='password')
+def make_normal_user(username='NormalUser'):
+    user = User.objects.create_user(username, password='password')
     user.save()
     return user
     
@@ -26,6 +56,24 @@ def create_menu_item(name, desc, price):
     menu_item.save()
     return menu_item
 
+def create_order(owner, total_price, created=None):
+    order = Order.objects.create(owner=owner, address='Ramallah', time_to_deliver=timezone.now() + timedelta(days=1), total_price=total_price)
+    if created:
+        # created is set automatically on insert, move it afterwards
+        order.created = created
+        order.save()
+    return order
+
+def create_order_items(order, menu_items):
+    for menu_item in menu_items:
+        OrderItem.objects.create(order=order, menu_item=menu_item, quantity=2)
+
+def count_queries(view, request, **kwargs):
+    with CaptureQueriesContext(connection) as queries:
+        response = view(request, **kwargs)
+        response.render()
+    return response, len(queries)
+
 class UserViewTests(APITestCase):
     def test_public_retrieve_user_orders(self):
         user = AnonymousUser()
@@ -48,7 +96,30 @@ class UserViewTests(APITestCase):
         response = UserViewSet.as_view({'get': 'orders'})(request, pk=1)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_user_orders_queries(self):
+        super_user = make_super_user()
+        user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', Decimal('1.00')) for i in range(3)]
+        view = UserViewSet.as_view({'get': 'orders'})
+        query_counts = []
+        for orders in (1, 20):
+            while Order.objects.filter(owner=user).count() < orders:
+                create_order_items(create_order(user, '6.00'), menu_items)
+            request = factory.get(reverse('user-orders', args=(user.pk,)))
+            force_authenticate(request, user=super_user)
+            response, queries = count_queries(view, request, pk=user.pk)
+            self.assertEqual(len(response.data), orders)
+            self.assertEqual(len(response.data[0]['order_items']), 3)
+            query_counts.append(queries)
+        # the user, its orders and their items
+        self.assertLessEqual(max(query_counts), 3)
+        self.assertEqual(query_counts[0], query_counts[1])
+
 class MenuItemViewTests(APITestCase):
+    def setUp(self):
+        # the menu responses are cached per catalog version
+        cache.clear()
+
     def test_public_access_menu_items(self):
         user = AnonymousUser()
         menu_item = create_menu_item('test_item', '', '10.00')
@@ -97,6 +168,642 @@ class MenuItemViewTests(APITestCase):
         response = MenuItemViewSet.as_view({'post': 'create'})(request)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+class MenuItemCacheTests(APITransactionTestCase):
+    # the catalog version is bumped once the menu item writes are committed
+    def setUp(self):
+        cache.clear()
+
+    def test_menu_items_etag(self):
+        menu_item = create_menu_item('test_item', '', '10.00')
+        # a catalog version of the current second has no Last-Modified yet, a later change could have the same one
+        response = self.client.get('/burger/menuItems/')
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get('/burger/menuItems/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        Version.objects.filter(name='catalog').update(value=int((time.time() - 5) * 1000000))
+        catalog_version.clear()
+        response = self.client.get('/burger/menuItems/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/menuItems/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/menuItems/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # the detail has its own etag
+        response = self.client.get('/burger/menuItems/%d/' % menu_item.pk, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        # any menu change gives a new etag
+        create_menu_item('test_item2', '', '12.00')
+        response = self.client.get('/burger/menuItems/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_menu_items_cached_per_version(self):
+        menu_item = create_menu_item('test_item', '', '10.00')
+        response = self.client.get('/burger/menuItems/')
+        self.assertEqual(response.data['count'], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/menuItems/')
+        self.assertEqual(response.data['results'][0]['name'], 'test_item')
+        self.client.get('/burger/menuItems/%d/' % menu_item.pk)
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/menuItems/%d/' % menu_item.pk)
+        self.assertEqual(list(response.data.keys()), ['id', 'url', 'name', 'description', 'price'])
+        menu_item.price = '11.00'
+        menu_item.save()
+        response = self.client.get('/burger/menuItems/%d/' % menu_item.pk)
+        self.assertEqual(response.data['price'], '11.00')
+        menu_item.delete()
+        response = self.client.get('/burger/menuItems/')
+        self.assertEqual(response.data['count'], 0)
+
+class MenuSearchTests(APITransactionTestCase):
+    # the index is updated once the menu item writes are committed
+    def setUp(self):
+        cache.clear()
+        create_menu_item('Cheese Burger', 'Beef, cheddar', '8.00')
+        create_menu_item('Chicken Burger', 'Chicken, cheese', '7.50')
+        create_menu_item('Veggie Wrap', 'Cheese and lettuce', '6.00')
+        create_menu_item('Cheesecake', '', '4.00')
+
+    def search(self, query):
+        response = self.client.get('/burger/menuItems/search/?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_ranking(self):
+        self.assertEqual(self.search('q=chee'), ['Cheesecake', 'Cheese Burger', 'Veggie Wrap', 'Chicken Burger'])
+        self.assertEqual(self.search('q=Cheese'), ['Cheese Burger', 'Cheesecake', 'Veggie Wrap', 'Chicken Burger'])
+        self.assertEqual(self.search('q=chi+bur'), ['Chicken Burger'])
+        self.assertEqual(self.search('q=burger+lettuce'), [])
+        self.assertEqual(self.search('q=chee&limit=2'), ['Cheesecake', 'Cheese Burger'])
+        self.assertEqual(self.search('q=+,'), [])
+        self.assertEqual(self.client.get('/burger/menuItems/search/?q=a&limit=0').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/burger/menuItems/search/?q=wrap&fields=name,price')
+        self.assertEqual(response.data, [{'name': 'Veggie Wrap', 'price': '6.00'}])
+
+    def test_index_updates(self):
+        self.search('q=burger')
+        with self.assertNumQueries(0):
+            self.search('q=burger')
+        item = create_menu_item('Double Burger', '', '10.00')
+        # applied from the signals, without reading the menu again
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('q=burger'), ['Cheese Burger', 'Double Burger', 'Chicken Burger'])
+        item.name = 'Double Stack'
+        item.save()
+        self.assertEqual(self.search('q=double'), ['Double Stack'])
+        self.assertEqual(self.search('q=burger'), ['Cheese Burger', 'Chicken Burger'])
+        item.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('q=double'), [])
+        MenuItem.objects.filter(name='Cheesecake').delete()
+        self.assertEqual(self.search('q=cheesec'), [])
+
+    def test_changes_of_other_processes(self):
+        self.assertEqual(self.search('q=wrap'), ['Veggie Wrap'])
+        # a change made by another process only shows as a new catalog version
+        MenuItem.objects.filter(name='Veggie Wrap').update(name='Falafel Wrap')
+        bump_catalog_version()
+        self.assertEqual(self.search('q=wrap'), ['Falafel Wrap'])
+
+class MenuCatalogTests(APITransactionTestCase):
+    # the snapshot is not used inside a transaction and its changes are applied once committed
+    def setUp(self):
+        cache.clear()
+        self.burger = create_menu_item('Burger', '', '8.00')
+        self.fries = create_menu_item('Fries', '', '3.00')
+
+    def menu_queries(self, queries):
+        return [query['sql'] for query in queries.captured_queries if 'burger_api_menuitem' in query['sql']]
+
+    def test_menu_reads(self):
+        response = self.client.get('/burger/menuItems/')
+        self.assertEqual([item['name'] for item in response.data['results']], ['Burger', 'Fries'])
+        # other urls are not cached yet, they are served from the snapshot
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/menuItems/?page_size=1&fields=name,price')
+            self.assertEqual(response.data['results'][0], {'name': 'Burger', 'price': '8.00'})
+            response = self.client.get('/burger/menuItems/%d/' % self.fries.pk)
+            self.assertEqual(response.data['name'], 'Fries')
+            self.assertEqual(self.client.get('/burger/menuItems/0/').status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.get('/burger/menuItems/a/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_pricing(self):
+        self.client.force_authenticate(make_normal_user())
+        data = {'address': 'Ramallah', 'time_to_deliver': (timezone.now() + timedelta(days=1)).isoformat(),
+                'order_items': [{'menu_item': self.burger.pk, 'quantity': 2}, {'menu_item': self.fries.pk}]}
+        menu_catalog.get()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/burger/orders/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], '19.00')
+        self.assertEqual(self.menu_queries(queries), [])
+        data['order_items'] = [{'menu_item': 0}]
+        response = self.client.post('/burger/orders/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # the price given as a string is applied as a decimal, without reading the menu again
+        self.burger.price = '9.50'
+        self.burger.save()
+        data['order_items'] = [{'menu_item': self.burger.pk, 'quantity': 2}]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/burger/orders/', data, format='json')
+        self.assertEqual(response.data['total_price'], '19.00')
+        self.assertEqual(self.menu_queries(queries), [])
+        self.assertEqual(OrderItem.objects.get(order_id=response.data['id']).price, Decimal('19.00'))
+
+    def test_catalog_version(self):
+        version = get_catalog_version()
+        previous, bumped = bump_catalog_version()
+        self.assertEqual(previous, version)
+        self.assertGreater(bumped, version)
+        # bumped by another process meanwhile, the previous version is the one in the database
+        Version.objects.filter(name='catalog').update(value=F('value') + 1)
+        self.assertEqual(bump_catalog_version()[0], bumped + 1)
+
+    def test_snapshot_changes(self):
+        snapshot = menu_catalog.get()
+        self.assertIs(menu_catalog.get(), snapshot)
+        self.burger.delete()
+        pizza = create_menu_item('Pizza', '', '12.00')
+        # swapped, the previous snapshot is left as it was
+        self.assertEqual([item.name for item in menu_catalog.get().items], ['Fries', 'Pizza'])
+        self.assertEqual([item.name for item in snapshot.items], ['Burger', 'Fries'])
+        # a change made by another process only shows as a new catalog version in the database,
+        # read again after BURGER_VERSION_CHECK_INTERVAL
+        MenuItem.objects.filter(pk=pizza.pk).update(price='13.00')
+        Version.objects.filter(name='catalog').update(value=F('value') + 1)
+        self.assertEqual(menu_catalog.get().by_id[pizza.pk].price, Decimal('12.00'))
+        with self.settings(BURGER_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(menu_catalog.get().by_id[pizza.pk].price, Decimal('13.00'))
+        MenuItem.objects.filter(pk=pizza.pk).update(price='14.00')
+        bump_catalog_version()
+        self.assertEqual(menu_catalog.get().by_id[pizza.pk].price, Decimal('14.00'))
+        with transaction.atomic():
+            self.assertIsNone(menu_catalog.get())
+
+class DispatchQueueTests(APITransactionTestCase):
+    # the dispatch version is bumped once the order writes are committed
+    def setUp(self):
+        cache.clear()
+        self.staff = make_super_user()
+        now = timezone.now()
+        self.orders = {}
+        for name, order_status, hours in (('a', 'N', 3), ('b', 'P', 1), ('c', 'O', 2), ('d', 'D', 1), ('e', 'N', 2)):
+            self.orders[name] = Order.objects.create(owner=self.staff, address=name, status=order_status,
+                                                     time_to_deliver=now + timedelta(hours=hours), total_price='10.00')
+        self.client.force_authenticate(self.staff)
+
+    def addresses(self, data):
+        return [order['address'] for order in data['orders']]
+
+    def test_dispatch_queue(self):
+        response = self.client.get('/burger/orders/dispatch/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.addresses(response.data), ['b', 'e', 'a'])
+        self.assertEqual(set(response.data['orders'][0].keys()), set(OrderSerializer.Meta.fields))
+        version = response.data['version']
+        self.assertEqual(response['ETag'], '"%s"' % version)
+        # read once per version
+        with self.assertNumQueries(0):
+            response = self.client.get('/burger/orders/dispatch/', HTTP_IF_NONE_MATCH='"%s"' % version)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            response = self.client.get('/burger/orders/dispatch/')
+            self.assertEqual(self.addresses(response.data), ['b', 'e', 'a'])
+        order = self.orders['b']
+        order.status = 'O'
+        order.save()
+        response = self.client.get('/burger/orders/dispatch/?version=%s' % version)
+        self.assertEqual(self.addresses(response.data), ['e', 'a'])
+        self.assertGreater(response.data['version'], version)
+        self.assertEqual(self.client.get('/burger/orders/dispatch/?wait=31').status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(make_normal_user())
+        self.assertEqual(self.client.get('/burger/orders/dispatch/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/burger/orders/dispatch/events/').status_code, status.HTTP_403_FORBIDDEN)
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The thread making the change can not reach the in-memory test database')
+    def test_long_poll(self):
+        version = self.client.get('/burger/orders/dispatch/').data['version']
+        with self.settings(BURGER_DISPATCH_POLL_INTERVAL=0.1):
+            started = time.time()
+            response = self.client.get('/burger/orders/dispatch/?version=%s&wait=1' % version)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertGreaterEqual(time.time() - started, 1)
+            # a change made meanwhile answers right away
+            threading.Timer(0.2, bump_dispatch_version).start()
+            started = time.time()
+            response = self.client.get('/burger/orders/dispatch/?version=%s&wait=10' % version)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLess(time.time() - started, 5)
+            self.assertGreater(response.data['version'], version)
+
+    def test_change_of_another_process(self):
+        version = self.client.get('/burger/orders/dispatch/').data['version']
+        # another process changed an order, this one did not bump the version
+        Order.objects.filter(pk=self.orders['b'].pk).update(status='O')
+        Version.objects.filter(name='dispatch').update(value=F('value') + 1)
+        with self.settings(BURGER_DISPATCH_POLL_INTERVAL=0.1, BURGER_VERSION_CHECK_INTERVAL=0.2):
+            started = time.time()
+            response = self.client.get('/burger/orders/dispatch/?version=%s&wait=10' % version)
+            self.assertLess(time.time() - started, 5)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], version + 1)
+        self.assertEqual(self.addresses(response.data), ['e', 'a'])
+
+    def version_bumps(self, queries):
+        return [query for query in queries if query['sql'].startswith('UPDATE') and 'burger_api_version' in query['sql']]
+
+    def test_bumped_once_per_transaction(self):
+        menu_item = create_menu_item('test_item', '', '10.00')
+        data = {'address': 'Ramallah', 'time_to_deliver': (timezone.now() + timedelta(days=1)).isoformat(),
+                'order_items': [{'menu_item': menu_item.pk}]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/burger/orders/batch/', [data] * 10, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.version_bumps(queries)), 1)
+        # the orders out of the queue stay out of it
+        order = Order.objects.get(pk=self.orders['d'].pk)
+        order.address = 'f'
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        self.assertEqual(self.version_bumps(queries), [])
+        order.status = 'N'
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        self.assertEqual(len(self.version_bumps(queries)), 1)
+
+    def test_bump_failure(self):
+        version = self.client.get('/burger/orders/dispatch/').data['version']
+        errors = []
+        def bump():
+            raise OperationalError('database is locked')
+        original_bump, original_exception = dispatch_version.bump, dispatch.logger.exception
+        dispatch_version.bump, dispatch.logger.exception = bump, errors.append
+        try:
+            response = self.client.patch('/burger/orders/%s/' % self.orders['b'].pk, {'status': 'O'}, format='json')
+        finally:
+            dispatch_version.bump, dispatch.logger.exception = original_bump, original_exception
+        # the order is saved, the screens get it with the next change
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(Order.objects.get(pk=self.orders['b'].pk).status, 'O')
+        self.assertEqual(self.client.get('/burger/orders/dispatch/').data['version'], version)
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The screen threads can not reach the in-memory test database')
+    def test_long_polls_not_shed(self):
+        version = self.client.get('/burger/orders/dispatch/').data['version']
+        menu_item = create_menu_item('test_item', '', '10.00')
+        responses = []
+
+        def poll():
+            client = APIClient()
+            client.force_authenticate(self.staff)
+            try:
+                responses.append(client.get('/burger/orders/dispatch/?version=%s&wait=2' % version).status_code)
+            finally:
+                connections.close_all()
+        limits = {'orders': {'max_in_flight': 1, 'max_query_time': 10.0, 'retry_after': 2}}
+        with self.settings(BURGER_LOAD_SHEDDING=limits, BURGER_DISPATCH_POLL_INTERVAL=0.1):
+            screens = [threading.Thread(target=poll) for i in range(3)]
+            for screen in screens:
+                screen.start()
+            time.sleep(0.5)
+            # more screens waiting than max_in_flight, the orders still go through
+            self.client.force_authenticate(make_normal_user())
+            data = {'address': 'Ramallah', 'time_to_deliver': (timezone.now() + timedelta(days=1)).isoformat(),
+                    'order_items': [{'menu_item': menu_item.pk}]}
+            self.assertEqual(self.client.post('/burger/orders/', data, format='json').status_code, status.HTTP_201_CREATED)
+            for screen in screens:
+                screen.join()
+        # the new order woke the screens up
+        self.assertEqual(responses, [status.HTTP_200_OK] * 3)
+        self.assertEqual(load_shedder.in_flight, 0)
+
+    def read_events(self, **headers):
+        response = self.client.get('/burger/orders/dispatch/events/', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode('utf-8').split('\n\n')
+        self.assertEqual(events[0], 'retry: 1000')
+        self.assertEqual(events[-1], '')
+        return events[1:-1]
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The thread making the change can not reach the in-memory test database')
+    def test_events(self):
+        with self.settings(BURGER_DISPATCH_STREAM_DURATION=1, BURGER_DISPATCH_KEEPALIVE=0.4, BURGER_DISPATCH_POLL_INTERVAL=0.1):
+            events = self.read_events()
+            self.assertEqual(set(events[1:]), set([': keepalive']))
+            lines = events[0].split('\n')
+            self.assertEqual(lines[1], 'event: queue')
+            data = json.loads(lines[2][len('data: '):])
+            self.assertEqual(lines[0], 'id: %s' % data['version'])
+            self.assertEqual(self.addresses(data), ['b', 'e', 'a'])
+            # reconnected, only the changes are sent
+            threading.Timer(0.2, bump_dispatch_version).start()
+            events = self.read_events(HTTP_LAST_EVENT_ID=str(data['version']))
+            lines = events[0].split('\n')
+            self.assertGreater(int(lines[0][len('id: '):]), data['version'])
+            self.assertEqual(set(events[1:]), set([': keepalive']))
+
+class ReadReplicaTests(APITransactionTestCase):
+    # reads inside a transaction stay on the primary, so these tests run outside of one
+    def setUp(self):
+        cache.clear()
+
+    def read_aliases(self, path, user=None):
+        # the databases the reads of a view are routed to, None for the primary (sessions are read by a middleware)
+        aliases = []
+        original = ReadReplicaRouter.db_for_read
+        def db_for_read(router, model, **hints):
+            alias = original(router, model, **hints)
+            if model is not Session:
+                aliases.append(alias)
+            return alias
+        ReadReplicaRouter.db_for_read = db_for_read
+        try:
+            self.client.force_authenticate(user)
+            response = self.client.get(path)
+        finally:
+            ReadReplicaRouter.db_for_read = original
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return set(aliases)
+
+    def test_router(self):
+        router = ReadReplicaRouter()
+        with self.settings(BURGER_READ_REPLICAS=['replica']):
+            self.assertIsNone(router.db_for_read(MenuItem))
+            with read_replica():
+                self.assertEqual(router.db_for_read(MenuItem), 'replica')
+                # related objects are read where the instance was, transactions stay on the primary
+                self.assertIsNone(router.db_for_read(MenuItem, instance=MenuItem()))
+                with transaction.atomic():
+                    self.assertIsNone(router.db_for_read(MenuItem))
+                self.assertEqual(router.db_for_write(MenuItem), 'default')
+            self.assertIsNone(router.db_for_read(MenuItem))
+        with self.settings(BURGER_READ_REPLICAS=[]), read_replica():
+            self.assertIsNone(router.db_for_read(MenuItem))
+
+    def test_routed_views(self):
+        superuser = make_super_user()
+        create_order(superuser, '10.00')
+        create_menu_item('test_item', '', '10.00')
+        with self.settings(BURGER_READ_REPLICAS=['default']):
+            self.assertEqual(self.read_aliases('/burger/statistics/best_customer/', superuser), set(['default']))
+            self.assertEqual(self.read_aliases('/burger/orders/', superuser), set([None]))
+            # the menu was just changed, the replicas may not have it yet
+            self.assertEqual(self.read_aliases('/burger/menuItems/'), set([None]))
+            bump_catalog_version()
+            with self.settings(BURGER_REPLICA_LAG=-1):
+                self.assertEqual(self.read_aliases('/burger/menuItems/'), set(['default']))
+
+    def test_session_read_from_primary(self):
+        superuser = make_super_user()
+        self.client.login(username=superuser.username, password='password')
+        reads = []
+        original = ReadReplicaRouter.db_for_read
+        def db_for_read(router, model, **hints):
+            alias = original(router, model, **hints)
+            reads.append((model, alias))
+            return alias
+        ReadReplicaRouter.db_for_read = db_for_read
+        try:
+            with self.settings(BURGER_READ_REPLICAS=['default']):
+                response = self.client.get('/burger/statistics/best_customer/')
+        finally:
+            ReadReplicaRouter.db_for_read = original
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the session and its user on the primary, the statistics on the replica
+        self.assertEqual(reads[:2], [(Session, None), (User, None)])
+        self.assertEqual(set(alias for model, alias in reads[2:]), set(['default']))
+
+class DatabaseProfileTests(APITransactionTestCase):
+    @skipIf(connection.vendor != 'sqlite', 'SQLite connections only')
+    def test_sqlite_pragmas(self):
+        # run on the connection of the tests when it was opened
+        self.assertEqual(connection.connection.execute('PRAGMA synchronous').fetchone()[0], 1) # normal
+        with self.settings(BURGER_SQLITE_PRAGMAS=(('cache_size', -4000),)):
+            configure_sqlite_connection(None, connection)
+        self.assertEqual(connection.connection.execute('PRAGMA cache_size').fetchone()[0], -4000)
+
+    def test_health_check(self):
+        database = connections[DEFAULT_DB_ALIAS]
+        closed = []
+        conn_max_age = database.settings_dict['CONN_MAX_AGE']
+        database.settings_dict['CONN_MAX_AGE'] = 60
+        database.ensure_connection()
+        # a persistent connection that stopped working
+        database.is_usable = lambda: False
+        database.close = lambda: closed.append(True)
+        try:
+            with self.settings(BURGER_DB_HEALTH_CHECKS=False):
+                self.client.get('/burger/menuItems/')
+            self.assertEqual(closed, [])
+            self.client.get('/burger/menuItems/')
+            self.assertEqual(closed, [True])
+        finally:
+            del database.is_usable
+            del database.close
+            database.settings_dict['CONN_MAX_AGE'] = conn_max_age
+
+class LoadTestTests(APITransactionTestCase):
+    # the workers use their own database connections, they only see committed data
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('menu=70, order=20,statistics=10'), {'menu': 70, 'order': 20, 'statistics': 10})
+        for mix in ('menu', 'menu=1,payment=1', 'menu=0'):
+            self.assertRaises(ValueError, parse_mix, mix)
+
+    def test_locked_errors(self):
+        count = locked_errors.count
+        for error in (OperationalError('database is locked'), OperationalError('database table is locked: x'), ValueError('other')):
+            try:
+                raise error
+            except Exception:
+                got_request_exception.send(sender=None, request=None)
+        self.assertEqual(locked_errors.count, count + 2)
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The workers can not reach the in-memory test database')
+    def test_load_test(self):
+        create_menu_item('test_item', '', Decimal('10.00'))
+        out = StringIO()
+        # a single worker never waits for a lock
+        call_command('load_test', duration=0.5, workers=1, customers=1, seed=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        total = [line.split() for line in lines if line.startswith('total')][0]
+        self.assertGreater(int(total[1]), 0)
+        self.assertEqual(total[-1], '0') # no errors
+        self.assertIn('"database is locked" errors: 0', out.getvalue())
+        # the load test users and their orders are removed
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+def run_asgi(application, path, method='GET', body=b'', headers=(), query_string=b'', disconnect=False):
+    """
+    Send a request to an ASGI application from a new event loop, return the status, the headers and the body.
+    With disconnect the client leaves once it got the first chunk of the body.
+    """
+    import asyncio
+    loop = asyncio.new_event_loop()
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+             'query_string': query_string, 'headers': list(headers), 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    messages = []
+    waiting = []
+
+    def done():
+        future = loop.create_future()
+        future.set_result(None)
+        return future
+
+    def receive():
+        future = loop.create_future()
+        if waiting or any(message['type'] == 'http.request' for message in messages):
+            # the whole body was sent, like a server the next message is the client leaving
+            waiting.append(future)
+        else:
+            messages.append({'type': 'http.request'})
+            future.set_result({'type': 'http.request', 'body': body, 'more_body': False})
+        return future
+
+    def send(message):
+        messages.append(message)
+        if disconnect and message.get('body'):
+            for future in waiting:
+                if not future.done():
+                    future.set_result({'type': 'http.disconnect'})
+        return done()
+
+    try:
+        loop.run_until_complete(application(scope, receive, send))
+    finally:
+        loop.close()
+    messages = [message for message in messages if message['type'] != 'http.request']
+    start = messages[0]
+    return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in messages[1:])
+
+@skipIf(six.PY2, 'The ASGI application runs on Python 3 only')
+class ASGITests(APITransactionTestCase):
+    # the requests are processed in the threads of the pools, they only see committed data
+    def setUp(self):
+        cache.clear()
+
+    def make_handler(self, wsgi_application):
+        from burger_shop.asgi import ASGIHandler
+        handler = ASGIHandler(wsgi_application)
+        self.addCleanup(handler.report_executor.shutdown)
+        self.addCleanup(handler.stream_executor.shutdown)
+        self.addCleanup(handler.executor.shutdown)
+        return handler
+
+    def test_executors(self):
+        handler = self.make_handler(None)
+        self.assertIs(handler.get_executor('/burger/statistics/best_customer/'), handler.report_executor)
+        self.assertIs(handler.get_executor('/burger/orders/export/'), handler.report_executor)
+        self.assertIs(handler.get_executor('/burger/menuItems/'), handler.executor)
+        self.assertIs(handler.get_executor('/burger/orders/1/'), handler.executor)
+        self.assertIs(handler.get_executor('/burger/orders/dispatch/events/'), handler.stream_executor)
+
+    def test_environ(self):
+        environ = {}
+
+        def wsgi_application(request_environ, start_response):
+            environ.update(request_environ)
+            environ['body'] = request_environ['wsgi.input'].read()
+            start_response('201 Created', [('Content-Type', 'text/plain')])
+            return [b'created', b'']
+
+        status, headers, body = run_asgi(
+            self.make_handler(wsgi_application), '/burger/menuItems/caf\u00e9/', 'POST', b'{"a": 1}',
+            [(b'content-type', b'application/json'), (b'content-length', b'8'), (b'x-tag', b'a'), (b'x-tag', b'b'),
+             (b'cookie', b'sessionid=1'), (b'cookie', b'csrftoken=2')], b'q=1')
+        self.assertEqual((status, headers, body), (201, {b'content-type': b'text/plain'}, b'created'))
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/burger/menuItems/caf\u00c3\u00a9/') # utf-8 bytes decoded as latin-1
+        self.assertEqual(environ['QUERY_STRING'], 'q=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['CONTENT_LENGTH'], '8')
+        self.assertEqual(environ['HTTP_X_TAG'], 'a,b')
+        # HTTP/2 clients send a cookie header per cookie
+        self.assertEqual(environ['HTTP_COOKIE'], 'sessionid=1; csrftoken=2')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEqual(environ['body'], b'{"a": 1}')
+
+    def test_reports_do_not_block_other_requests(self):
+        import threading
+        release = threading.Event()
+
+        def wsgi_application(environ, start_response):
+            if environ['PATH_INFO'].startswith('/burger/statistics/'):
+                release.wait(5)
+            start_response('200 OK', [])
+            return [environ['PATH_INFO'].encode('ascii')]
+
+        handler = self.make_handler(wsgi_application)
+        reports = [threading.Thread(target=run_asgi, args=(handler, '/burger/statistics/average_spending/'))
+                   for i in range(handler.report_executor._max_workers + 2)]
+        for report in reports:
+            report.start()
+        try:
+            # every report thread is busy, the menu is still served
+            self.assertEqual(run_asgi(handler, '/burger/menuItems/'), (200, {}, b'/burger/menuItems/'))
+            self.assertTrue(all(report.is_alive() for report in reports))
+        finally:
+            release.set()
+            for report in reports:
+                report.join()
+
+    def test_disconnect_closes_stream(self):
+        closed = []
+
+        def stream():
+            try:
+                for i in range(100):
+                    time.sleep(0.02)
+                    yield b'chunk'
+            finally:
+                closed.append(True)
+
+        def wsgi_application(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/event-stream')])
+            return stream()
+
+        handler = self.make_handler(wsgi_application)
+        started = time.time()
+        status, headers, body = run_asgi(handler, '/burger/orders/dispatch/events/', disconnect=True)
+        # stopped at the first chunks rather than streamed to the end
+        self.assertLess(time.time() - started, 1)
+        self.assertLess(len(body), len(b'chunk') * 5)
+        self.assertEqual(closed, [True])
+        self.assertEqual(run_asgi(handler, '/burger/orders/dispatch/events/')[2], b'chunk' * 100)
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The pool threads can not reach the in-memory test database')
+    def test_application(self):
+        from burger_shop.asgi import application
+        create_menu_item('test_item', 'test_desc', Decimal('10.00'))
+        status, headers, body = run_asgi(application, '/burger/menuItems/', headers=[(b'accept', b'application/json')])
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual([item['name'] for item in json.loads(body.decode('utf-8'))['results']], ['test_item'])
+        make_normal_user()
+        status, headers, body = run_asgi(application, '/burger/token/', 'POST', b'{"username": "NormalUser", "password": "password"}',
+                                         [(b'content-type', b'application/json')])
+        self.assertEqual(status, 200)
+        token = json.loads(body.decode('utf-8'))['token']
+        status, headers, body = run_asgi(application, '/burger/orders/', headers=[(b'authorization', b'Bearer ' + token.encode('ascii'))])
+        self.assertEqual(status, 200)
+
 class OrderViewTests(APITestCase):
     def test_public_retrieve_orders(self):
         user = AnonymousUser()
@@ -274,7 +981,862 @@ class OrderViewTests(APITestCase):
         response = client.get('/burger/orders/' + str(order_id3) + '/', format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_make_order_prices_items(self):
+        user = make_normal_user()
+        menu_item1 = create_menu_item('item1', 'item1 desc', '17.00')
+        menu_item2 = create_menu_item('item2', 'item2 desc', '15.50')
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/burger/orders/', {
+            'address': 'Ramallah',
+            'time_to_deliver': str(timezone.now() + timedelta(days=1)),
+            'order_items': [
+                {'menu_item': menu_item1.pk, 'quantity': 2},
+                {'menu_item': menu_item2.pk, 'quantity': 1, 'price': '0.01'},
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], '49.50')
+        self.assertEqual([item['price'] for item in response.data['order_items']], ['34.00', '15.50'])
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.total_price, Decimal('49.50'))
+        self.assertEqual(sorted(order.order_items.values_list('price', flat=True)), [Decimal('15.50'), Decimal('34.00')])
+
+    def test_make_order_constant_queries(self):
+        user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', '1.00') for i in range(10)]
+        self.client.force_authenticate(user=user)
+        query_counts = []
+        # the first order of the day also creates the day and customer rollup rows
+        for items in (menu_items[:1], menu_items[:1], menu_items):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/burger/orders/', {
+                    'address': 'Ramallah',
+                    'time_to_deliver': str(timezone.now() + timedelta(days=1)),
+                    'order_items': [{'menu_item': menu_item.pk, 'quantity': 1} for menu_item in items]
+                }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data['order_items']), len(items))
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[1], query_counts[2])
+
+    def test_order_list_and_retrieve_queries(self):
+        super_user = make_super_user()
+        user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', Decimal('1.00')) for i in range(3)]
+        list_view = OrderViewSet.as_view({'get': 'list'})
+        retrieve_view = OrderViewSet.as_view({'get': 'retrieve'})
+        query_counts = {super_user.pk: [], user.pk: []}
+        for orders in (1, 10):
+            while Order.objects.filter(owner=user).count() < orders:
+                create_order_items(create_order(user, '6.00'), menu_items)
+            for viewer in (super_user, user):
+                request = factory.get('/burger/orders/')
+                force_authenticate(request, user=viewer)
+                response, queries = count_queries(list_view, request)
+                self.assertEqual(len(response.data['results']), orders)
+                self.assertEqual(len(response.data['results'][-1]['order_items']), 3)
+                # the count, the page of orders and their items
+                self.assertLessEqual(queries, 3)
+                query_counts[viewer.pk].append(queries)
+                order = Order.objects.filter(owner=user).last()
+                request = factory.get('/burger/orders/%d/' % order.pk)
+                force_authenticate(request, user=viewer)
+                response, queries = count_queries(retrieve_view, request, pk=order.pk)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.data['order_items']), 3)
+                # the order and its items
+                self.assertLessEqual(queries, 2)
+        for counts in query_counts.values():
+            self.assertEqual(counts[0], counts[1])
+
+    def test_order_list_cursor_pagination(self):
+        super_user = make_super_user()
+        start = datetime(2016, 1, 1, 0, 0, 0, 0, timezone.utc)
+        for i in range(25):
+            # pairs of orders created at the same time
+            create_order(super_user, '1.00', created=start + timedelta(hours=i // 2))
+        expected = list(Order.objects.order_by('created', 'pk').values_list('pk', flat=True))
+        self.client.force_authenticate(user=super_user)
+        response = self.client.get('/burger/orders/', {'pagination': 'cursor', 'page_size': '10'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        pages = [[order['id'] for order in response.data['results']]]
+        query_counts = []
+        while response.data['next']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            query_counts.append(len(queries))
+            pages.append([order['id'] for order in response.data['results']])
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+        # the orders of the page and their items
+        self.assertEqual(query_counts, [2, 2])
+        # and back
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([order['id'] for order in response.data['results']], pages[1])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([order['id'] for order in response.data['results']], pages[0])
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get('/burger/orders/', {'pagination': 'cursor', 'count': 'true'})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get('/burger/orders/', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_pagination_deep_page(self):
+        super_user = make_super_user()
+        start = datetime(2016, 1, 1, 0, 0, 0, 0, timezone.utc)
+        for i in range(30):
+            # runs of orders created at the same time spanning several pages, the later runs have the lower ids
+            create_order(super_user, '1.00', created=start - timedelta(hours=i // 7))
+        expected = list(Order.objects.order_by('created', 'pk').values_list('pk', flat=True))
+        self.client.force_authenticate(user=super_user)
+        response = self.client.get('/burger/orders/', {'pagination': 'cursor', 'page_size': '3'})
+        pages = [[order['id'] for order in response.data['results']]]
+        # a wrong range can go round in circles
+        while response.data['next'] and len(pages) <= 10:
+            response = self.client.get(response.data['next'])
+            pages.append([order['id'] for order in response.data['results']])
+        self.assertEqual(sum(pages, []), expected)
+        for page in reversed(pages[:-1]):
+            response = self.client.get(response.data['previous'])
+            self.assertEqual([order['id'] for order in response.data['results']], page)
+        self.assertIsNone(response.data['previous'])
+
+    def test_user_orders_cursor_pagination(self):
+        super_user = make_super_user()
+        user = make_normal_user()
+        for i in range(3):
+            create_order(user, '1.00')
+        self.client.force_authenticate(user=super_user)
+        response = self.client.get(reverse('user-orders', args=(user.pk,)), {'pagination': 'cursor', 'page_size': '2'})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_make_order_batch(self):
+        user = make_normal_user()
+        menu_item1 = create_menu_item('item1', 'item1 desc', '17.00')
+        menu_item2 = create_menu_item('item2', 'item2 desc', '15.50')
+        delivery_date = str(timezone.now() + timedelta(days=1))
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/burger/orders/batch/', [
+            {'address': 'Ramallah', 'time_to_deliver': delivery_date, 'order_items': [{'menu_item': menu_item1.pk, 'quantity': 2}]},
+            {'address': 'Ramallah', 'time_to_deliver': delivery_date, 'order_items': [{'menu_item': 999, 'quantity': 1}]},
+            {'address': 'Nablus', 'time_to_deliver': delivery_date, 'order_items': [
+                {'menu_item': menu_item1.pk, 'quantity': 1}, {'menu_item': menu_item2.pk, 'quantity': 1},
+            ]},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data], [201, 400, 201])
+        self.assertIn('order_items', response.data[1]['errors'])
+        self.assertEqual(response.data[0]['order']['total_price'], '34.00')
+        self.assertEqual(response.data[2]['order']['total_price'], '32.50')
+        self.assertEqual(len(response.data[2]['order']['order_items']), 2)
+        self.assertEqual(Order.objects.filter(owner=user).count(), 2)
+        self.assertEqual(CustomerStats.objects.get(user=user).total_spent, Decimal('66.50'))
+
+    def test_make_order_batch_reads_menu_once(self):
+        user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', '1.00') for i in range(5)]
+        self.client.force_authenticate(user=user)
+        orders = [{
+            'address': 'Ramallah',
+            'time_to_deliver': str(timezone.now() + timedelta(days=1)),
+            'order_items': [{'menu_item': menu_item.pk, 'quantity': 1} for menu_item in menu_items[i % 5:]],
+        } for i in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/burger/orders/batch/', orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 20)
+        menu_queries = [query for query in queries if query['sql'].startswith('SELECT') and 'burger_api_menuitem' in query['sql']]
+        self.assertEqual(len(menu_queries), 1)
+        item_queries = [query for query in queries if query['sql'].startswith('SELECT') and 'burger_api_orderitem' in query['sql']]
+        self.assertEqual(len(item_queries), 1)
+
+    def test_make_order_batch_invalid(self):
+        user = make_normal_user()
+        response = self.client.post('/burger/orders/batch/', [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/burger/orders/batch/', {'address': 'Ramallah'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(BURGER_ORDER_BATCH_MAX_SIZE=1):
+            response = self.client.post('/burger/orders/batch/', [{}, {}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/burger/orders/batch/', [{}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0]['status'], 400)
+
+class OrderFilterTests(APITestCase):
+    def setUp(self):
+        self.superuser = make_super_user()
+        self.user = make_normal_user()
+        self.other = make_normal_user('Other')
+        now = timezone.now()
+        self.orders = []
+        for i in range(12):
+            order = create_order(self.user if i % 2 else self.other, '10.00', created=now - timedelta(days=i))
+            order.time_to_deliver = now + timedelta(hours=i)
+            order.status = 'DNPO'[i % 4]
+            order.save()
+            self.orders.append(order)
+        self.now = now
+
+    def get_ids(self, query, user=None):
+        self.client.force_authenticate(user or self.superuser)
+        response = self.client.get('/burger/orders/?page_size=100&' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(order['id'] for order in response.data['results'])
+
+    def expected(self, select):
+        return sorted(order.pk for i, order in enumerate(self.orders) if select(i))
+
+    def test_status(self):
+        self.assertEqual(self.get_ids('status=D'), self.expected(lambda i: i % 4 == 0))
+        self.assertEqual(self.get_ids('status=N,P'), self.expected(lambda i: i % 4 in (1, 2)))
+        self.assertEqual(self.get_ids('status=N,P', self.user), self.expected(lambda i: i % 4 == 1))
+
+    def test_ranges(self):
+        start = (self.now - timedelta(days=5, hours=1)).isoformat()
+        self.assertEqual(self.get_ids('from=%s' % quote(start)), self.expected(lambda i: i <= 5))
+        end = (self.now - timedelta(days=2, hours=1)).isoformat()
+        self.assertEqual(self.get_ids('from=%s&to=%s' % (quote(start), quote(end))), self.expected(lambda i: 3 <= i <= 5))
+        start = (self.now + timedelta(hours=3)).isoformat()
+        end = (self.now + timedelta(hours=6)).isoformat()
+        self.assertEqual(self.get_ids('deliver_from=%s&deliver_to=%s' % (quote(start), quote(end))), self.expected(lambda i: 3 <= i < 6))
+        self.assertEqual(self.get_ids('deliver_from=%s&status=D' % quote(start), self.user), [])
+        response = self.client.get('/burger/orders/?deliver_from=2020-01-02&deliver_to=2020-01-01')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/burger/orders/?from=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for query in ('to=9999-12-31', 'from=0001-01-01', 'deliver_to=9999-12-31', 'deliver_from=0001-01-01'):
+            response = self.client.get('/burger/orders/?' + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_owner(self):
+        self.assertEqual(self.get_ids('owner=%d' % self.user.pk), self.expected(lambda i: i % 2))
+        self.assertEqual(self.get_ids('owner=%d&status=P' % self.other.pk), self.expected(lambda i: i % 4 == 2))
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/burger/orders/?owner=%d' % self.other.pk)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cursor_pagination(self):
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get('/burger/orders/?pagination=cursor&page_size=2&status=D,N')
+        ids = [order['id'] for order in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(order['id'] for order in response.data['results'])
+        self.assertEqual(sorted(ids), self.expected(lambda i: i % 4 in (0, 1)))
+
+class LeanOrderListingTests(APITestCase):
+    # the lean listings must give exactly the same responses as OrderSerializer
+    def setUp(self):
+        self.superuser = make_super_user()
+        self.user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', Decimal(price)) for i, price in enumerate(('5.00', '7.25', '12.50'))]
+        now = timezone.now()
+        for i in range(14):
+            order = create_order(self.user if i % 3 else self.superuser, '0.00', created=now - timedelta(hours=i))
+            create_order_items(order, menu_items[:i % 3 + 1])
+            order.total_price = sum(item.price for item in order.order_items.all())
+            if i % 2:
+                order.time_delivered = now - timedelta(minutes=i, microseconds=i)
+            order.save()
+        # an order of a removed customer, with no items
+        create_order(make_normal_user('Removed'), '0.00').owner.delete()
+
+    def assert_same_response(self, path, user):
+        self.client.force_authenticate(user)
+        with self.settings(BURGER_LEAN_ORDER_LISTINGS=False):
+            expected = self.client.get(path)
+        with self.settings(BURGER_LEAN_ORDER_LISTINGS=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        return response, len(queries)
+
+    def test_order_list(self):
+        response, queries = self.assert_same_response('/burger/orders/', self.superuser)
+        self.assertEqual(response.data['count'], 15)
+        self.assertEqual(queries, 3) # count, orders, items
+        self.assert_same_response(response.data['next'], self.superuser)
+        self.assert_same_response('/burger/orders/', self.user)
+        # the last page has the order without owner nor items
+        response, queries = self.assert_same_response('/burger/orders/?page=2', self.superuser)
+        self.assertEqual(response.data['results'][-1]['owner'], None)
+
+    def test_order_list_cursor(self):
+        response, queries = self.assert_same_response('/burger/orders/?pagination=cursor&page_size=4', self.user)
+        self.assertEqual(queries, 2)
+        response, queries = self.assert_same_response(response.data['next'], self.user)
+        self.assert_same_response(response.data['previous'], self.user)
+
+    def test_user_orders(self):
+        path = '/burger/user/%d/orders/' % self.user.pk
+        response, queries = self.assert_same_response(path, self.superuser)
+        self.assertEqual(len(response.data), 9)
+        response, queries = self.assert_same_response(path + '?pagination=cursor&page_size=5', self.superuser)
+        self.assert_same_response(response.data['next'], self.superuser)
+
+    def test_order_list_fields(self):
+        response, queries = self.assert_same_response('/burger/orders/?fields=id,status,total_price', self.superuser)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'total_price', 'status'])
+        self.assertEqual(queries, 2) # count, orders
+        response, queries = self.assert_same_response('/burger/orders/?fields=url,order_items', self.user)
+        self.assertEqual(queries, 3)
+        response = self.client.get('/burger/orders/?fields=id,price')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.superuser = make_super_user()
+        self.user = make_normal_user()
+        self.menu_items = [create_menu_item('item%d' % i, 'description', Decimal('5.00')) for i in range(3)]
+        for i in range(5):
+            create_order_items(create_order(self.user, '10.00'), self.menu_items[:i % 3 + 1])
+        self.client.force_authenticate(self.superuser)
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, len(queries)
+
+    def test_order_fields(self):
+        response, queries = self.get('/burger/orders/')
+        self.assertEqual(queries, 3) # count, orders, items
+        response, queries = self.get('/burger/orders/?fields=id,status,time_to_deliver')
+        self.assertEqual(queries, 2) # the items are not fetched
+        for order in response.data['results']:
+            self.assertEqual(list(order), ['id', 'time_to_deliver', 'status'])
+        order = Order.objects.first()
+        response, queries = self.get('/burger/orders/%d/?fields=url,order_items' % order.pk)
+        self.assertEqual(list(response.data), ['url', 'order_items'])
+        self.assertEqual(len(response.data['order_items']), 1)
+
+    def test_order_expand(self):
+        response, queries = self.get('/burger/orders/?expand=owner,order_items.menu_item')
+        self.assertEqual(queries, 3) # count, orders with their owners, items with their menu items
+        order = response.data['results'][0]
+        self.assertEqual(order['owner']['username'], 'NormalUser')
+        self.assertEqual(order['owner']['id'], self.user.pk)
+        self.assertEqual(order['order_items'][0]['menu_item']['name'], 'item0')
+        self.assertEqual(order['order_items'][0]['menu_item']['price'], '5.00')
+        # only the selected fields are expanded
+        response, queries = self.get('/burger/orders/?fields=id,owner&expand=owner,order_items.menu_item')
+        self.assertEqual(queries, 2)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'owner'])
+
+    def test_invalid_selection(self):
+        for path in ('/burger/orders/?fields=id,price', '/burger/orders/?expand=address', '/burger/orders/?expand=owner.orders',
+                     '/burger/menuItems/?fields=cost', '/burger/menuItems/?expand=name', '/burger/user/%d/?expand=username' % self.user.pk):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, path)
+
+    def test_create_ignores_selection(self):
+        # the selection only applies to reads
+        data = {'address': 'Nablus', 'time_to_deliver': timezone.now() + timedelta(days=1),
+                'order_items': [{'menu_item': self.menu_items[0].pk, 'quantity': 1}]}
+        response = self.client.post('/burger/orders/?fields=id&expand=owner', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['owner'], self.superuser.pk)
+        self.assertEqual(len(response.data['order_items']), 1)
+
+    def test_menu_fields(self):
+        response, queries = self.get('/burger/menuItems/?fields=id,name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'id': self.menu_items[0].pk, 'name': 'item0'})
+        response, queries = self.get('/burger/menuItems/%d/?fields=price' % self.menu_items[1].pk)
+        self.assertEqual(response.data, {'price': '5.00'})
+
+    def test_user_fields(self):
+        path = '/burger/user/%d/' % self.user.pk
+        response, queries = self.get(path + '?fields=id,username')
+        self.assertEqual(response.data, [{'id': self.user.pk, 'username': 'NormalUser'}])
+        self.assertEqual(queries, 1) # the orders are not read
+        response, queries = self.get(path + '?expand=orders.order_items.menu_item')
+        self.assertEqual(queries, 3) # user, orders, items with their menu items
+        orders = response.data[0]['orders']
+        self.assertEqual(len(orders), 5)
+        self.assertEqual(orders[0]['order_items'][0]['menu_item']['name'], 'item0')
+        response, queries = self.get(path + 'orders/?fields=id,order_items')
+        self.assertEqual(queries, 3) # user, orders, items
+        self.assertEqual(list(response.data[0]), ['id', 'order_items'])
+        response, queries = self.get(path + 'orders/?fields=id&expand=owner')
+        self.assertEqual(queries, 2)
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        registry.clear()
+
+    def get_sample(self, content, sample):
+        for line in content.decode('utf-8').splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.split(' ')[-1])
+        self.fail('%s not found' % sample)
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test', (0.1, 1))
+        histogram.observe((('route', 'order-list'),), 0.5)
+        histogram.observe((('route', 'order-list'),), 2)
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="order-list",le="0.1"} 0',
+            'test_seconds_bucket{route="order-list",le="1"} 1',
+            'test_seconds_bucket{route="order-list",le="+Inf"} 2',
+            'test_seconds_sum{route="order-list"} 2.5',
+            'test_seconds_count{route="order-list"} 2',
+        ])
+
+    def test_request_metrics(self):
+        user = make_normal_user()
+        create_order(user, '10.00')
+        self.client.force_authenticate(user)
+        logged = len(connection.queries_log)
+        for i in range(2):
+            self.assertEqual(self.client.get('/burger/orders/').status_code, status.HTTP_200_OK)
+        # counted without the query log of the debug cursor
+        self.assertEqual(len(connection.queries_log), logged)
+        self.assertFalse(connection.force_debug_cursor)
+        self.client.force_authenticate(None)
+        response = self.client.get('/burger/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        labels = '{route="order-list",method="GET"}'
+        self.assertEqual(self.get_sample(response.content, 'burger_request_duration_seconds_count' + labels), 2)
+        # count, page and items of each request
+        self.assertEqual(self.get_sample(response.content, 'burger_db_queries_sum' + labels), 6)
+        self.assertGreater(self.get_sample(response.content, 'burger_serializer_duration_seconds_sum' + labels), 0)
+
+    def test_metrics_access(self):
+        remote = {'REMOTE_ADDR': '203.0.113.5'}
+        self.assertEqual(self.client.get('/burger/metrics/', **remote).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(make_normal_user())
+        self.assertEqual(self.client.get('/burger/metrics/', **remote).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(make_super_user())
+        self.assertEqual(self.client.get('/burger/metrics/', **remote).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/burger/metrics/').status_code, status.HTTP_200_OK)
+        self.client.get('/burger/missing/')
+        response = self.client.get('/burger/metrics/')
+        self.assertEqual(self.get_sample(response.content, 'burger_request_duration_seconds_count{route="unresolved",method="GET"}'), 1)
+
+class OrderExportTests(APITestCase):
+    def setUp(self):
+        self.superuser = make_super_user()
+        self.user = make_normal_user()
+        menu_items = [create_menu_item('item%d' % i, '', Decimal(price)) for i, price in enumerate(('5.00', '7.25'))]
+        now = timezone.now()
+        self.orders = []
+        for i in range(5):
+            order = create_order(self.user, '0.00', created=now - timedelta(days=5 - i))
+            create_order_items(order, menu_items[:i % 3])
+            order.status = 'ND'[i % 2]
+            order.address = u'Ramallah \u0631\u0627\u0645 \u0627\u0644\u0644\u0647, "center"'
+            order.save()
+            self.orders.append(order)
+        self.client.force_authenticate(self.superuser)
+
+    def export(self, query=''):
+        response = self.client.get('/burger/orders/export/' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_ndjson(self):
+        response = self.client.get('/burger/orders/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([line['id'] for line in lines], [order.pk for order in self.orders])
+        self.assertEqual(lines[2]['address'], self.orders[2].address)
+        self.assertEqual([(item['menu_item'], item['quantity'], item['price']) for item in lines[2]['order_items']],
+                         [(item.menu_item_id, 2, '%.2f' % item.price) for item in self.orders[2].order_items.all()])
+        self.assertEqual(lines[0]['created'], self.orders[0].created.isoformat().replace('+00:00', 'Z'))
+
+    def test_export_csv(self):
+        response = self.client.get('/burger/orders/export/?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        content = b''.join(response.streaming_content)
+        if six.PY2:
+            rows = [[value.decode('utf-8') for value in row] for row in csv.reader(content.splitlines())]
+        else:
+            rows = list(csv.reader(content.decode('utf-8').splitlines()))
+        self.assertEqual(rows[0][:3], ['order_id', 'created', 'owner'])
+        # one line per item, one line for the orders without items
+        self.assertEqual(len(rows), 1 + 1 + 1 + 2 + 1 + 1)
+        self.assertEqual(rows[1][0], str(self.orders[0].pk))
+        self.assertEqual(rows[1][-3:], ['', '', ''])
+        self.assertEqual(rows[2][4], self.orders[1].address)
+
+    def test_export_filters(self):
+        lines = self.export('?status=D').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.orders[1].pk, self.orders[3].pk])
+        start = self.orders[2].created.date().isoformat()
+        lines = self.export('?from=%s&to=%s' % (start, start)).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.orders[2].pk])
+        self.assertEqual(self.client.get('/burger/orders/export/?status=X').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/burger/orders/export/?from=2020-01-02&to=2020-01-01').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/burger/orders/export/?deliver_to=9999-12-31').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/burger/orders/export/?from=0001-01-01').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_chunks(self):
+        with self.settings(BURGER_EXPORT_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            lines = self.export().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [order.pk for order in self.orders])
+        # orders and items of each chunk of 2
+        self.assertEqual(len([query for query in queries if 'burger_api_order' in query['sql']]), 6)
+
+    def test_export_admin_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/burger/orders/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+class TokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = make_normal_user()
+        self.menu_item = create_menu_item('item', '', Decimal('5.00'))
+        create_order_items(create_order(self.user, '10.00'), [self.menu_item])
+        self.client = APIClient(enforce_csrf_checks=True)
+
+    def get_token(self, username='NormalUser', password='password'):
+        response = self.client.post('/burger/token/', {'username': username, 'password': password}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['token']
+
+    def get(self, path, token):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_AUTHORIZATION='Bearer ' + token)
+        return response, [query['sql'] for query in queries]
+
+    def test_obtain_token(self):
+        response = self.client.post('/burger/token/', {'username': 'NormalUser', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/burger/token/', {'username': 'NormalUser'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/burger/token/', {'username': 'NormalUser', 'password': 'password'}, format='json')
+        self.assertEqual(response.data['expires_in'], 7 * 24 * 60 * 60)
+
+    def test_no_authentication_queries(self):
+        token = self.get_token()
+        response, queries = self.get('/burger/orders/', token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        # the user is read once, then neither the users nor the sessions are
+        response, queries = self.get('/burger/orders/', token)
+        self.assertEqual(len(queries), 3) # count, orders, items
+        self.assertFalse([sql for sql in queries if 'auth_user' in sql or 'django_session' in sql])
+        self.get('/burger/menuItems/', token)
+        response, queries = self.get('/burger/menuItems/', token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, [])
+
+    def test_post_without_csrf(self):
+        token = self.get_token()
+        data = {'address': 'Ramallah', 'time_to_deliver': timezone.now() + timedelta(days=1),
+                'order_items': [{'menu_item': self.menu_item.pk, 'quantity': 1}]}
+        response = self.client.post('/burger/orders/', data, format='json', HTTP_AUTHORIZATION='Bearer ' + token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['owner'], self.user.pk)
+
+    def test_invalid_tokens(self):
+        token = self.get_token()
+        for value in ('Bearer ' + token[:-1], 'Bearer', 'Bearer %s extra' % token):
+            response = self.client.get('/burger/orders/', HTTP_AUTHORIZATION=value)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, value)
+        with self.settings(BURGER_TOKEN_MAX_AGE=-1):
+            response, queries = self.get('/burger/orders/', token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revocation(self):
+        token = self.get_token()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_200_OK)
+        response = self.client.delete('/burger/token/', HTTP_AUTHORIZATION='Bearer ' + token)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_403_FORBIDDEN)
+        # a new token works
+        self.assertEqual(self.get('/burger/orders/', self.get_token())[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete('/burger/token/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revocation_stored(self):
+        token = self.get_token()
+        self.client.delete('/burger/token/', HTTP_AUTHORIZATION='Bearer ' + token)
+        # the revocation is in the database, not in the caches
+        cache.clear()
+        user_cache.clear()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_403_FORBIDDEN)
+        token = self.get_token()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_200_OK)
+        # a password change refuses the tokens issued before
+        self.user.set_password('new password')
+        self.user.save()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_403_FORBIDDEN)
+        token = self.get_token(password='new password')
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_200_OK)
+
+    def test_user_changes(self):
+        superuser = make_super_user()
+        token = self.get_token('SuperUser')
+        self.assertEqual(self.get('/burger/orders/', token)[0].data['count'], 1)
+        # the token was issued to an admin, it can't be used once the user is not one anymore
+        superuser.is_superuser = False
+        superuser.save()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_403_FORBIDDEN)
+        token = self.get_token()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('/burger/orders/', token)[0].status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_user_cache(self):
+        users = [make_normal_user('user%d' % i) for i in range(3)]
+        with self.settings(BURGER_TOKEN_USER_CACHE_SIZE=2):
+            for user in users:
+                user_cache.get(user.pk)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(user_cache.get(users[2].pk), users[2])
+                self.assertEqual(user_cache.get(users[1].pk), users[1])
+            self.assertEqual(len(queries), 0)
+            # the least recently used was dropped
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(user_cache.get(users[0].pk), users[0])
+            self.assertEqual(len(queries), 1)
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_normal_user()
+        self.admin = make_super_user()
+        self.menu_item = create_menu_item('test_item', '', '10.00')
+
+    def tearDown(self):
+        load_shedder.query_time = 0.0
+
+    def post_order(self, user):
+        self.client.force_authenticate(user)
+        data = {'address': 'Ramallah', 'time_to_deliver': (timezone.now() + timedelta(days=1)).isoformat(),
+                'order_items': [{'menu_item': self.menu_item.pk}]}
+        return self.client.post('/burger/orders/', data, format='json')
+
+    def get_statistics(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/burger/statistics/average_spending/')
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/minute'), (10, 60))
+        self.assertEqual(parse_rate('5/s'), (5, 1))
+        for rate in ('10', 'a/minute', '10/week', None):
+            self.assertRaises(ValueError, parse_rate, rate)
+
+    def test_user_throttle(self):
+        with self.settings(BURGER_USER_THROTTLE_RATES={'order-create': '2/minute'}):
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            response = self.post_order(self.user)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '30')
+            # the other users and routes have their own buckets
+            self.assertEqual(self.post_order(self.admin).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.client.get('/burger/orders/').status_code, status.HTTP_200_OK)
+            # a token is back after half a minute
+            key = 'burger_api:throttle:order-create:user:%s' % self.user.pk
+            tokens, updated = cache.get(key)
+            cache.set(key, (tokens, updated - 30))
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_batch_throttle(self):
+        self.client.force_authenticate(self.user)
+        data = {'address': 'Ramallah', 'time_to_deliver': (timezone.now() + timedelta(days=1)).isoformat(),
+                'order_items': [{'menu_item': self.menu_item.pk}]}
+        with self.settings(BURGER_USER_THROTTLE_RATES={'order-create': '4/minute'}):
+            self.assertEqual(self.client.post('/burger/orders/batch/', [data] * 3, format='json').status_code,
+                             status.HTTP_201_CREATED)
+            # a token per order, one left
+            response = self.client.post('/burger/orders/batch/', [data] * 2, format='json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '15')
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            # a batch bigger than the bucket goes through with a full bucket, and pays for its orders afterwards
+            cache.clear()
+            self.assertEqual(self.client.post('/burger/orders/batch/', [data] * 6, format='json').status_code,
+                             status.HTTP_201_CREATED)
+            response = self.post_order(self.user)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '45')
+
+    def test_route_throttle(self):
+        other_admin = User.objects.create_user('OtherAdmin', password='password', is_superuser=True, is_staff=True)
+        with self.settings(BURGER_ROUTE_THROTTLE_RATES={'statistics': '1/second'}):
+            self.assertEqual(self.get_statistics(self.admin).status_code, status.HTTP_200_OK)
+            response = self.get_statistics(other_admin)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+
+    def test_load_shedding(self):
+        limits = {
+            'statistics': {'max_in_flight': 1, 'max_query_time': 0.5, 'retry_after': 30},
+            'orders': {'max_in_flight': 1, 'max_query_time': 1.0, 'retry_after': 2},
+        }
+        with self.settings(BURGER_LOAD_SHEDDING=limits):
+            self.assertEqual(self.get_statistics(self.admin).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            # slow queries: the statistics are shed first
+            load_shedder.query_time = 0.8
+            load_shedder.updated = time.time()
+            response = self.get_statistics(self.admin)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertEqual(self.post_order(self.user).status_code, status.HTTP_201_CREATED)
+            load_shedder.query_time = 2.0
+            load_shedder.updated = time.time()
+            response = self.post_order(self.user)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '2')
+            self.assertEqual(json.loads(response.content.decode('utf-8')), {'detail': 'The server is busy, try again later.'})
+            # the shed requests don't count, the average goes back down with time
+            self.assertEqual(load_shedder.query_time, 2.0)
+            self.assertAlmostEqual(load_shedder.get_query_time(load_shedder.updated + 5), 1.0)
+            # the other requests are never shed
+            self.assertEqual(self.client.get('/burger/orders/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/burger/menuItems/').status_code, status.HTTP_200_OK)
+            # too many requests in progress
+            load_shedder.query_time = 0.0
+            load_shedder.in_flight += 1
+            try:
+                self.assertEqual(self.post_order(self.user).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            finally:
+                load_shedder.in_flight -= 1
+            self.assertEqual(load_shedder.in_flight, 0)
+
+class StatisticsCacheTests(APITestCase):
+    path = '/burger/statistics/best_customer/?criteria=revenue'
+
+    def setUp(self):
+        cache.clear()
+        self.superuser = make_super_user()
+        self.customer = make_normal_user()
+        create_order(self.customer, '10.00')
+        self.client.force_authenticate(self.superuser)
+
+    def make_stale(self):
+        key = get_statistics_key(factory.get(self.path))
+        entry = cache.get(key)
+        entry['created'] -= 10 * 60
+        cache.set(key, entry)
+        return key
+
+    def test_cache(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response['Age'], '0')
+        self.assertEqual(response.data[0]['id'], self.customer.pk)
+        create_order(make_normal_user('BigSpender'), '50.00')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.path)
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(response.data[0]['id'], self.customer.pk)
+        self.assertEqual(len([query for query in queries if 'burger_api_order' in query['sql']]), 0)
+        # other parameters are cached apart
+        response = self.client.get('/burger/statistics/best_customer/?criteria=number')
+        self.assertEqual(response['X-Cache'], 'miss')
+        # admins can ask for fresh data
+        response = self.client.get(self.path, HTTP_CACHE_CONTROL='no-cache')
+        self.assertEqual(response['X-Cache'], 'refresh')
+        self.assertEqual(response.data[0]['username'], 'BigSpender')
+        self.assertEqual(self.client.get(self.path)['X-Cache'], 'hit')
+
+    def test_stale_while_revalidate(self):
+        self.client.get(self.path)
+        create_order(make_normal_user('BigSpender'), '50.00')
+        self.make_stale()
+        with self.settings(BURGER_STATISTICS_BACKGROUND_REFRESH=False):
+            response = self.client.get(self.path)
+        # the stale data is served, the refreshed data is there for the next request
+        self.assertEqual(response['X-Cache'], 'stale')
+        self.assertEqual(int(response['Age']), 10 * 60)
+        self.assertEqual(response.data[0]['id'], self.customer.pk)
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(response.data[0]['username'], 'BigSpender')
+
+    def test_single_refresh(self):
+        self.client.get(self.path)
+        create_order(make_normal_user('BigSpender'), '50.00')
+        key = self.make_stale()
+        # another request is already refreshing the data
+        cache.add(key + ':refreshing', True)
+        with self.settings(BURGER_STATISTICS_BACKGROUND_REFRESH=False):
+            for i in range(2):
+                response = self.client.get(self.path)
+                self.assertEqual(response['X-Cache'], 'stale')
+                self.assertEqual(response.data[0]['id'], self.customer.pk)
+
+    def test_lock_released_on_failure(self):
+        self.client.get(self.path)
+        key = self.make_stale()
+
+        def fail(view, request):
+            raise OperationalError('database is locked')
+        with self.settings(BURGER_STATISTICS_BACKGROUND_REFRESH=False):
+            with self.assertRaises(OperationalError):
+                refresh_statistics(fail, None, factory.get(self.path), key)
+        # the next stale read refreshes the data
+        self.assertIsNone(cache.get(key + ':refreshing'))
+        with self.settings(BURGER_STATISTICS_BACKGROUND_REFRESH=False):
+            self.assertEqual(self.client.get(self.path)['X-Cache'], 'stale')
+        self.assertEqual(self.client.get(self.path)['X-Cache'], 'hit')
+
+    def test_errors_not_cached(self):
+        response = self.client.get('/burger/statistics/revenue_report/?granularity=year')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(cache.get(get_statistics_key(factory.get('/burger/statistics/revenue_report/?granularity=year'))))
+        self.client.force_authenticate(self.customer)
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class StatisticsRefreshTests(APITransactionTestCase):
+    # the background refresh reads the orders in its own thread, they must be committed
+    path = StatisticsCacheTests.path
+
+    def setUp(self):
+        cache.clear()
+        self.customer = make_normal_user()
+        create_order(self.customer, '10.00')
+        self.client.force_authenticate(make_super_user())
+
+    @skipIf(connection.vendor == 'sqlite' and not connection.features.can_share_in_memory_db,
+            'The refresh thread can not reach the in-memory test database')
+    def test_background_refresh(self):
+        self.client.get(self.path)
+        create_order(make_normal_user('BigSpender'), '50.00')
+        key = get_statistics_key(factory.get(self.path))
+        entry = cache.get(key)
+        entry['created'] -= 10 * 60
+        cache.set(key, entry)
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Cache'], 'stale')
+        self.assertEqual(int(response['Age']), 10 * 60)
+        self.assertEqual(response.data[0]['id'], self.customer.pk)
+        # the refresh thread replaces the entry, then releases its lock
+        deadline = time.time() + 10
+        while cache.get(key + ':refreshing') and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(cache.get(key + ':refreshing'))
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertLess(int(response['Age']), 10)
+        self.assertEqual(response.data[0]['username'], 'BigSpender')
+
 class StatisticsViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_best_customer(self):
         menu_item1 = create_menu_item('item cheap', '', '5.00')
         menu_item2 = create_menu_item('item expensive', '', '20.65')
@@ -335,3 +1897,276 @@ class StatisticsViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data[0]['id'], normal_user.pk)
         client.logout()
+
+    def test_best_customer_ranking(self):
+        super_user = make_super_user()
+        users = [make_normal_user('user%d' % i) for i in range(3)]
+        create_order(users[0], '10.00')
+        create_order(users[0], '10.00')
+        create_order(users[0], '10.00')
+        create_order(users[1], '50.00')
+        create_order(users[2], '15.00')
+        create_order(users[2], '15.00')
+        request = factory.get('/burger/statistics/best_customer/', {'criteria': 'revenue', 'top': '3'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([customer['id'] for customer in response.data], [users[1].pk, users[0].pk, users[2].pk])
+        self.assertEqual(response.data[0]['revenue'], '50.00')
+        self.assertEqual(response.data[0]['number_of_orders'], 1)
+        request = factory.get('/burger/statistics/best_customer/', {'criteria': 'number', 'top': '2'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+        self.assertEqual([customer['id'] for customer in response.data], [users[0].pk, users[2].pk])
+        self.assertEqual(response.data[0]['number_of_orders'], 3)
+        self.assertEqual(response.data[0]['revenue'], '30.00')
+
+    def test_best_customer_window(self):
+        super_user = make_super_user()
+        old_customer = make_normal_user('old_customer')
+        new_customer = make_normal_user('new_customer')
+        now = timezone.now()
+        create_order(old_customer, '20.00', created=now - timedelta(days=400))
+        create_order(old_customer, '20.00', created=now - timedelta(days=400))
+        create_order(new_customer, '5.00')
+        # the default window is the last year
+        request = factory.get('/burger/statistics/best_customer/')
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+        self.assertEqual([customer['id'] for customer in response.data], [new_customer.pk])
+        window_end = (now - timedelta(days=399)).date().isoformat()
+        request = factory.get('/burger/statistics/best_customer/', {'from': '2000-01-01', 'to': window_end, 'top': '5'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+        self.assertEqual([customer['id'] for customer in response.data], [old_customer.pk])
+        self.assertEqual(response.data[0]['number_of_orders'], 2)
+
+    @skipIf(connection.vendor != 'sqlite', 'SQLite only')
+    def test_best_customer_index(self):
+        super_user = make_super_user()
+        create_order(make_normal_user(), '10.00')
+        request = factory.get('/burger/statistics/best_customer/')
+        force_authenticate(request, user=super_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+        self.assertEqual(len(response.data), 1)
+        # the window is read per customer from the (owner, created, total_price) index, SQLite does not range over
+        # the created index for it
+        sql = [query['sql'] for query in queries if 'burger_api_order' in query['sql']][0]
+        self.assertIn('+"burger_api_order"."created" >=', sql)
+        self.assertEqual(Order.objects.filter(created__unindexed__lt=timezone.now()).count(), 1)
+
+    def test_best_customer_constant_queries(self):
+        super_user = make_super_user()
+        for i in range(10):
+            create_order(make_normal_user('user%d' % i), '10.00')
+        for criteria in ('number', 'revenue'):
+            request = factory.get('/burger/statistics/best_customer/', {'criteria': criteria, 'top': '10'})
+            force_authenticate(request, user=super_user)
+            with self.assertNumQueries(1):
+                response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+                self.assertEqual(len(response.data), 10)
+
+    def test_best_customer_invalid_parameters(self):
+        super_user = make_super_user()
+        for params in ({'criteria': 'age'}, {'top': 'all'}, {'top': '0'}, {'from': 'yesterday'},
+                       # out of the range of the datetimes once moved to the end of the day or to UTC
+                       {'to': '9999-12-31'}, {'from': '0001-01-01'}):
+            request = factory.get('/burger/statistics/best_customer/', params)
+            force_authenticate(request, user=super_user)
+            response = StatisticsViewSet.as_view({'get': 'best_customer'})(request)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_monthly_revenue_report(self):
+        super_user = make_super_user()
+        create_order(super_user, '10.00', created=datetime(2015, 1, 31, 12, 0, 0, 0, timezone.utc))
+        create_order(super_user, '12.50', created=datetime(2015, 1, 1, 0, 0, 0, 0, timezone.utc))
+        create_order(super_user, '7.25', created=datetime(2015, 3, 10, 8, 0, 0, 0, timezone.utc))
+        create_order(super_user, '99.00', created=datetime(2016, 1, 1, 0, 0, 0, 0, timezone.utc))
+        request = factory.get('/burger/statistics/monthly_revenue_report/', {'year': '2015'})
+        force_authenticate(request, user=super_user)
+        with self.assertNumQueries(1):
+            response = StatisticsViewSet.as_view({'get': 'monthly_revenue_report'})(request)
+        self.assertEqual(response.data['year'], 2015)
+        self.assertEqual(len(response.data['report']), 12)
+        self.assertEqual(response.data['report'][0], {'month': 'January', 'revenue': Decimal('22.50')})
+        self.assertEqual(response.data['report'][1], {'month': 'February', 'revenue': Decimal('0.00')})
+        self.assertEqual(response.data['report'][2], {'month': 'March', 'revenue': Decimal('7.25')})
+
+    def test_weekly_revenue_report(self):
+        super_user = make_super_user()
+        # 2015-03-02 is a Monday
+        create_order(super_user, '10.00', created=datetime(2015, 3, 2, 12, 0, 0, 0, timezone.utc))
+        create_order(super_user, '5.00', created=datetime(2015, 3, 8, 12, 0, 0, 0, timezone.utc))
+        create_order(super_user, '1.00', created=datetime(2015, 3, 9, 12, 0, 0, 0, timezone.utc))
+        request = factory.get('/burger/statistics/revenue_report/', {'granularity': 'week', 'from': '2015-03-04', 'to': '2015-03-20'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'revenue_report'})(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = [(period.isoformat(), orders, revenue) for period, orders, revenue in
+                  ((row['period'], row['orders'], row['revenue']) for row in response.data['report'])]
+        self.assertEqual(report, [
+            ('2015-03-02', 2, Decimal('15.00')),
+            ('2015-03-09', 1, Decimal('1.00')),
+            ('2015-03-16', 0, Decimal('0.00')),
+        ])
+
+    def test_revenue_report_bounds(self):
+        super_user = make_super_user()
+        for action, params in (('monthly_revenue_report', {'year': '10000'}), ('monthly_revenue_report', {'year': '0'}),
+                               ('monthly_revenue_report', {'year': 'abc'}),
+                               ('revenue_report', {'from': '0001-01-01'}), ('revenue_report', {'to': '9999-12-31'}),
+                               ('revenue_report', {'granularity': 'day', 'from': '2010-01-01', 'to': '2015-01-01'})):
+            request = factory.get('/burger/statistics/%s/' % action, params)
+            force_authenticate(request, user=super_user)
+            response = StatisticsViewSet.as_view({'get': action})(request)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        request = factory.get('/burger/statistics/revenue_report/', {'granularity': 'month', 'from': '2010-01-01', 'to': '2015-01-01'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'revenue_report'})(request)
+        self.assertEqual(len(response.data['report']), 61)
+        request = factory.get('/burger/statistics/monthly_revenue_report/', {'year': '1800'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'monthly_revenue_report'})(request)
+        self.assertEqual(response.data['report'][0], {'month': 'January', 'revenue': Decimal('0.00')})
+
+    def test_daily_revenue_follows_orders(self):
+        user = make_normal_user()
+        day = datetime(2015, 6, 1, 12, 0, 0, 0, timezone.utc)
+        order = create_order(user, '10.00', created=day)
+        create_order(user, '4.00', created=day)
+        rollup = DailyRevenue.objects.get(day=day.date())
+        self.assertEqual((rollup.orders, rollup.revenue), (2, Decimal('14.00')))
+        # updates and deletes through a freshly loaded order
+        order = Order.objects.get(pk=order.pk)
+        order.total_price = Decimal('20.00')
+        order.save()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.orders, rollup.revenue), (2, Decimal('24.00')))
+        Order.objects.get(pk=order.pk).delete()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.orders, rollup.revenue), (1, Decimal('4.00')))
+
+    def test_rebuild_revenue_rollup(self):
+        user = make_normal_user()
+        create_order(user, '10.00', created=datetime(2015, 6, 1, 12, 0, 0, 0, timezone.utc))
+        create_order(user, '4.00', created=datetime(2015, 6, 1, 13, 0, 0, 0, timezone.utc))
+        create_order(user, '3.00', created=datetime(2015, 6, 2, 13, 0, 0, 0, timezone.utc))
+        DailyRevenue.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_revenue_rollup', chunk_size=2, stdout=out)
+        self.assertIn('Rebuilt 2 daily revenue rows from 3 orders', out.getvalue())
+        self.assertEqual(list(DailyRevenue.objects.values_list('day', 'orders', 'revenue')), [
+            (datetime(2015, 6, 1).date(), 2, Decimal('14.00')),
+            (datetime(2015, 6, 2).date(), 1, Decimal('3.00')),
+        ])
+
+    def test_rebuild_revenue_rollup_many_days(self):
+        # more days than one insert batch
+        user = make_normal_user()
+        start = datetime(2015, 1, 1, 12, 0, 0, 0, timezone.utc)
+        Order.objects.bulk_create([Order(owner=user, address='Ramallah', time_to_deliver=start, total_price='1.00')
+                                   for i in range(600)])
+        for i, pk in enumerate(Order.objects.order_by('pk').values_list('pk', flat=True)):
+            Order.objects.filter(pk=pk).update(created=start + timedelta(days=i))
+        call_command('rebuild_revenue_rollup', stdout=StringIO())
+        self.assertEqual(DailyRevenue.objects.count(), 600)
+        self.assertEqual(DailyRevenue.objects.aggregate(revenue=Sum('revenue'))['revenue'], Decimal('600.00'))
+
+    def test_average_spending(self):
+        super_user = make_super_user()
+        users = [make_normal_user('user%d' % i) for i in range(3)]
+        create_order(users[0], '10.00')
+        create_order(users[0], '15.00')
+        create_order(users[2], '7.50')
+        request = factory.get('/burger/statistics/average_spending/')
+        force_authenticate(request, user=super_user)
+        with self.assertNumQueries(2):
+            response = StatisticsViewSet.as_view({'get': 'average_spending'})(request)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['results'], [
+            {'user': 'user0', 'average spending': Decimal('12.50')},
+            {'user': 'user2', 'average spending': Decimal('7.50')},
+        ])
+        request = factory.get('/burger/statistics/average_spending/', {'page_size': '1', 'page': '2'})
+        force_authenticate(request, user=super_user)
+        response = StatisticsViewSet.as_view({'get': 'average_spending'})(request)
+        self.assertEqual(response.data['results'], [{'user': 'user2', 'average spending': Decimal('7.50')}])
+
+    def test_customer_stats_follow_orders(self):
+        user = make_normal_user()
+        first = create_order(user, '10.00', created=datetime(2015, 6, 1, 12, 0, 0, 0, timezone.utc))
+        last = create_order(user, '4.00', created=datetime(2015, 6, 3, 12, 0, 0, 0, timezone.utc))
+        stats = CustomerStats.objects.get(user=user)
+        self.assertEqual((stats.orders, stats.total_spent), (2, Decimal('14.00')))
+        self.assertEqual((stats.first_order, stats.last_order), (first.created, last.created))
+        order = Order.objects.get(pk=last.pk)
+        order.total_price = Decimal('6.00')
+        order.save()
+        Order.objects.get(pk=first.pk).delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.orders, stats.total_spent), (1, Decimal('6.00')))
+        self.assertEqual((stats.first_order, stats.last_order), (last.created, last.created))
+        self.assertEqual(stats.average_spending(), Decimal('6.00'))
+
+    def test_check_customer_stats(self):
+        users = [make_normal_user('user%d' % i) for i in range(2)]
+        create_order(users[0], '10.00')
+        create_order(users[1], '4.00')
+        out = StringIO()
+        call_command('check_customer_stats', stdout=out)
+        self.assertIn('No drift found', out.getvalue())
+        CustomerStats.objects.filter(user=users[0]).update(orders=5)
+        CustomerStats.objects.filter(user=users[1]).delete()
+        out = StringIO()
+        call_command('check_customer_stats', dry_run=True, stdout=out)
+        self.assertIn('2 customers drifted.', out.getvalue())
+        self.assertFalse(CustomerStats.objects.filter(user=users[1]).exists())
+        out = StringIO()
+        call_command('check_customer_stats', stdout=out)
+        self.assertIn('2 customers drifted and were rebuilt', out.getvalue())
+        self.assertEqual(CustomerStats.objects.get(user=users[0]).orders, 1)
+        self.assertEqual(CustomerStats.objects.get(user=users[1]).total_spent, Decimal('4.00'))
+
+    def test_rebuild_many_customer_stats(self):
+        # more customers than one insert batch
+        User.objects.bulk_create([User(username='user%d' % i) for i in range(600)])
+        now = timezone.now()
+        Order.objects.bulk_create([Order(owner=user, address='Ramallah', time_to_deliver=now, total_price='2.00')
+                                   for user in User.objects.all()])
+        self.assertEqual(len(rebuild_customer_stats()), 600)
+        self.assertEqual(CustomerStats.objects.filter(orders=1, total_spent=Decimal('2.00')).count(), 600)
+        self.assertEqual(rebuild_customer_stats(dry_run=True), [])
+
+    def test_seed_database(self):
+        items = seed_database(users=5, menu_items=3, orders=40, seed=1)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertEqual(OrderItem.objects.count(), items)
+        self.assertEqual(rebuild_customer_stats(dry_run=True), [])
+        self.assertEqual(sum(DailyRevenue.objects.values_list('orders', flat=True)), 40)
+        for order in Order.objects.prefetch_related('order_items'):
+            self.assertEqual(order.total_price, sum(item.price for item in order.order_items.all()))
+        # the sequences continue after the seeded rows
+        self.assertEqual(create_order(User.objects.first(), '1.00').pk, 41)
+
+    def test_seed_database_command(self):
+        out = StringIO()
+        call_command('seed_database', users=4, menu_items=3, orders=25, seed=2, stdout=out)
+        self.assertIn('Seeded 4 users, 3 menu items, 25 orders', out.getvalue())
+        self.assertEqual(CustomerStats.objects.aggregate(orders=Sum('orders'))['orders'], 25)
+
+    def test_benchmark_endpoints(self):
+        out = StringIO()
+        call_command('benchmark_endpoints', sizes='20', requests=2, stdout=out, stderr=StringIO())
+        results = json.loads(out.getvalue())
+        endpoints = results['sizes'][0]['endpoints']
+        self.assertIn('statistics-best-customer', endpoints)
+        for name, endpoint in endpoints.items():
+            expected = status.HTTP_201_CREATED if endpoint['method'] == 'post' else status.HTTP_200_OK
+            for timings in (endpoint['cold'], endpoint['warm']):
+                self.assertEqual(timings['status'], expected, name)
+                self.assertLessEqual(timings['p50_ms'], timings['p99_ms'])
+        # the seeded data and the orders of the benchmark are deleted
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(MenuItem.objects.exists())
@@ -0,0 +1,210 @@
+"""
+Protection of the expensive routes during bursts (e.g. the lunch rush): token bucket throttles per user and per route
+answering 429 to the clients over their rate, and LoadSheddingMiddleware answering 503 while the process is overloaded,
+the statistics before the order writes. Both send a Retry-After.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+from .db import get_query_totals
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# the average query time follows the recent requests, and goes back to 0 while no request finishes (e.g. all shed)
+QUERY_TIME_WEIGHT = 0.2
+QUERY_TIME_HALF_LIFE = 5.0
+
+
+def parse_rate(rate):
+    """
+    Return the number of requests and the period in seconds of a rate such as '10/minute' or '5/s'
+    """
+    try:
+        requests, period = rate.split('/')
+        return int(requests), RATE_PERIODS[period[0]]
+    except (AttributeError, IndexError, KeyError, ValueError):
+        raise ValueError('Invalid throttle rate %r, expected requests/period (second, minute, hour or day).' % (rate,))
+
+
+def get_throttle_scope(view):
+    """
+    Return the throttle scope of the current action of a viewset (throttle_scopes) or of a view (throttle_scope)
+    """
+    scopes = getattr(view, 'throttle_scopes', None)
+    if scopes is not None:
+        return scopes.get(getattr(view, 'action', None))
+    return getattr(view, 'throttle_scope', None)
+
+
+def get_throttle_cost(request, view):
+    """
+    Return the number of tokens a request takes: the view's get_throttle_cost(request) when it has one, else one
+    """
+    get_cost = getattr(view, 'get_throttle_cost', None)
+    return get_cost(request) if get_cost is not None else 1
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle the requests of a scope with token buckets: a bucket of the rate 'N/period' holds up to N tokens and is
+    refilled with N tokens per period, every request takes one (or its cost, see get_throttle_cost). Bursts of N requests
+    go through, then N per period. A request costing more than N goes through with a full bucket and leaves it in debt.
+    The buckets are kept in the cache BURGER_THROTTLE_CACHE: a local memory cache limits each process, a shared cache
+    (e.g. memcached) limits all of them, approximately since a bucket is not read and written atomically across processes.
+    """
+    rates_setting = None
+    lock = threading.Lock()
+
+    def get_bucket(self, request):
+        raise NotImplementedError('.get_bucket() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = get_throttle_scope(view)
+        rate = getattr(settings, self.rates_setting, {}).get(scope) if scope else None
+        if rate is None:
+            return True
+        capacity, period = parse_rate(rate)
+        cache = caches[getattr(settings, 'BURGER_THROTTLE_CACHE', 'default')]
+        key = 'burger_api:throttle:%s:%s' % (scope, self.get_bucket(request))
+        now = time.time()
+        cost = get_throttle_cost(request, view)
+        needed = min(cost, capacity)
+        with self.lock:
+            tokens, updated = cache.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * capacity / float(period))
+            allowed = tokens >= needed
+            if allowed:
+                tokens -= cost
+            else:
+                self.wait_seconds = (needed - tokens) * period / float(capacity)
+            # a bucket left alone for a period is full again, the same as a missing one
+            cache.set(key, (tokens, now), period)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    A bucket per user (per address for the anonymous users) for each scope of BURGER_USER_THROTTLE_RATES
+    """
+    rates_setting = 'BURGER_USER_THROTTLE_RATES'
+
+    def get_bucket(self, request):
+        if request.user and request.user.is_authenticated:
+            return 'user:%s' % request.user.pk
+        return 'address:%s' % self.get_ident(request)
+
+
+class RouteTokenBucketThrottle(TokenBucketThrottle):
+    """
+    A bucket shared by all the clients for each scope of BURGER_ROUTE_THROTTLE_RATES
+    """
+    rates_setting = 'BURGER_ROUTE_THROTTLE_RATES'
+
+    def get_bucket(self, request):
+        return 'all'
+
+
+class LoadShedder(object):
+    """
+    The requests in progress in this process and the moving average of the query time of the recent requests
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.query_time = 0.0
+        self.updated = time.time()
+
+    def get_query_time(self, now=None):
+        now = time.time() if now is None else now
+        return self.query_time * 0.5 ** ((now - self.updated) / QUERY_TIME_HALF_LIFE)
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    @contextmanager
+    def waiting(self):
+        """
+        Leave out a request in progress while it waits for something else than the database (e.g. a long poll),
+        so that the waiting screens do not shed the other requests
+        """
+        with self.lock:
+            self.in_flight -= 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight += 1
+
+    def finish(self, queries=0, query_time=0):
+        """
+        End a request, with the number of queries it made and their time when it was processed (not shed)
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if queries:
+                now = time.time()
+                self.query_time = self.get_query_time(now) * (1 - QUERY_TIME_WEIGHT) + query_time / queries * QUERY_TIME_WEIGHT
+                self.updated = now
+
+    def is_overloaded(self, max_in_flight, max_query_time):
+        with self.lock:
+            return self.in_flight > max_in_flight or self.get_query_time() > max_query_time
+
+
+load_shedder = LoadShedder()
+
+
+def get_shedding_class(request):
+    """
+    Return the class of a resolved request in BURGER_LOAD_SHEDDING: 'statistics', 'orders' for the order writes,
+    None for the requests that are never shed
+    """
+    route = request.resolver_match.view_name
+    if route.startswith('statistics-'):
+        return 'statistics'
+    if route.startswith('order-') and request.method == 'POST':
+        return 'orders'
+    return None
+
+
+class LoadSheddingMiddleware(object):
+    """
+    Answer the requests of a shedding class (see get_shedding_class) with a 503 and a Retry-After right away while
+    the requests in progress in the process, or the average query time of the recent requests (which includes
+    the waits for the SQLite write lock), cross the limits of the class in BURGER_LOAD_SHEDDING. The statistics have
+    lower limits than the orders, they are shed first. The queries are counted by the cursors of the connections
+    (see count_queries).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        load_shedder.start()
+        queries_before, query_time_before = get_query_totals()
+        queries = 0
+        query_time = 0
+        try:
+            return self.get_response(request)
+        finally:
+            if not getattr(request, 'load_shed', False):
+                queries, query_time = get_query_totals()
+                queries -= queries_before
+                query_time -= query_time_before
+            load_shedder.finish(queries, query_time)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limits = getattr(settings, 'BURGER_LOAD_SHEDDING', {}).get(get_shedding_class(request))
+        if limits is None or not load_shedder.is_overloaded(limits['max_in_flight'], limits['max_query_time']):
+            return None
+        request.load_shed = True
+        response = JsonResponse({'detail': 'The server is busy, try again later.'}, status=503)
+        response['Retry-After'] = '%d' % limits['retry_after']
+        return response
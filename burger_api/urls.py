@@ -8,7 +8,7 @@ from rest_framework.schemas import get_schema_view
 router = DefaultRouter()
 router.register(r'orders', views.OrderViewSet)
 router.register(r'user', views.UserViewSet)
-router.register(r'statistics', views.StatisticsViewSet)
+router.register(r'statistics', views.StatisticsViewSet, base_name='statistics')
 router.register(r'menuItems', views.MenuItemViewSet)
 
 schema_view = get_schema_view(title='Burger API')
@@ -17,6 +17,8 @@ schema_view = get_schema_view(title='Burger API')
 # Additionally, include the login URLs for the browsable API.
 urlpatterns = [
     url('^schema/$', schema_view),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='metrics'),
+    url(r'^token/$', views.TokenView.as_view(), name='token'),
     url(r'^', include(router.urls)),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -0,0 +1,120 @@
+import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def get_choice_param(request, name, choices, default):
+    """
+    Read a query parameter that must be one of the given choices
+    """
+    value = request.query_params.get(name) or default
+    if value not in choices:
+        raise ValidationError({name: ['"%s" is not a valid choice, expected one of: %s.' % (value, ', '.join(sorted(choices)))]})
+    return value
+
+
+def get_choices_param(request, name, choices):
+    """
+    Read a query parameter holding a comma separated list of choices, return them as a list (empty when missing)
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return []
+    values = value.split(',')
+    for choice in values:
+        if choice not in choices:
+            raise ValidationError({name: ['"%s" is not a valid choice, expected one of: %s.' % (choice, ', '.join(sorted(choices)))]})
+    return values
+
+
+def get_list_param(request, name):
+    """
+    Read a query parameter holding a comma separated list of names, return them as a list (None when missing)
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def get_int_param(request, name, default, min_value=None, max_value=None):
+    """
+    Read an integer query parameter, optionally bounded by min_value/max_value
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: ['A valid integer is required.']})
+    if min_value is not None and value < min_value:
+        raise ValidationError({name: ['Ensure this value is greater than or equal to %d.' % min_value]})
+    if max_value is not None and value > max_value:
+        raise ValidationError({name: ['Ensure this value is less than or equal to %d.' % max_value]})
+    return value
+
+
+def get_date_param(request, name, default=None):
+    """
+    Read a date query parameter
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: ['Enter a valid date (YYYY-MM-DD).']})
+    return parsed
+
+
+def get_datetime_param(request, name, default=None, end_of_day=False):
+    """
+    Read a date or datetime query parameter as an aware datetime.
+    A plain date means the start of that day, or the start of the following day when end_of_day is set,
+    so it can be used as an exclusive upper bound that still includes the whole day.
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is not None:
+                if end_of_day:
+                    day += datetime.timedelta(days=1)
+                parsed = datetime.datetime.combine(day, datetime.time.min)
+        if parsed is not None:
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            # the queries compare in UTC, the first and last days of the calendar may not have a UTC time
+            parsed.astimezone(timezone.utc)
+    except (ValueError, OverflowError):
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: ['Enter a valid date (YYYY-MM-DD) or datetime (YYYY-MM-DDThh:mm[:ss][+HH:MM]).']})
+    return parsed
+
+
+def one_year_before(moment):
+    """
+    Return the same moment one year earlier (Feb 29 falls back to Feb 28)
+    """
+    try:
+        return moment.replace(year=moment.year - 1)
+    except ValueError:
+        return moment.replace(year=moment.year - 1, day=28)
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of the values
+    """
+    values = sorted(values)
+    rank = max(int(-(-len(values) * percent // 100)), 1)
+    return values[rank - 1]
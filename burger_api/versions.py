@@ -0,0 +1,84 @@
+"""
+Versions of the data that every process keeps (the menu catalog, the dispatch queue), stored in the database so that all the processes
+agree on them. A process reads a version again at most every BURGER_VERSION_CHECK_INTERVAL seconds, so the changes
+of the other processes are seen within that time, and the changes it commits itself right away.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from .models import Version
+
+
+def new_version():
+    # versions are timestamps in microseconds, so a version lost with its row never goes back to one already handed out
+    return int(time.time() * 1000000)
+
+
+class SharedVersion(object):
+    """
+    A Version row and the value this process last read or bumped
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.value = None
+        self.checked = 0
+        self.reading = False
+
+    def get(self):
+        """
+        Return the current version, read from the database when the value of the process is older than
+        BURGER_VERSION_CHECK_INTERVAL seconds (by one thread, the others keep the value meanwhile)
+        """
+        interval = getattr(settings, 'BURGER_VERSION_CHECK_INTERVAL', 1)
+        with self.lock:
+            if self.value is not None and (self.reading or time.time() - self.checked < interval):
+                return self.value
+            self.reading = True
+        try:
+            checked = time.time()
+            value = self.read()
+        finally:
+            with self.lock:
+                self.reading = False
+        return self.update(value, checked)
+
+    def read(self):
+        manager = Version.objects.using(router.db_for_write(Version))
+        value = manager.filter(name=self.name).values_list('value', flat=True).first()
+        if value is None:
+            value = manager.get_or_create(name=self.name, defaults={'value': new_version()})[0].value
+        return value
+
+    def update(self, value, checked):
+        with self.lock:
+            # a bump of this process committed while the value was read is newer
+            if self.value is None or value >= self.value or checked >= self.checked:
+                self.value = value
+                self.checked = checked
+            return self.value
+
+    def bump(self):
+        """
+        Mark the data as changed, called once a change is committed. Return the previous and the new version.
+        """
+        using = router.db_for_write(Version)
+        manager = Version.objects.using(using)
+        changes = {'previous': F('value'), 'value': Greatest(F('value') + 1, Value(new_version(), output_field=models.BigIntegerField()))}
+        checked = time.time()
+        # the previous version is the one this update replaced, even with concurrent bumps
+        with transaction.atomic(using=using):
+            if not manager.filter(name=self.name).update(**changes):
+                manager.get_or_create(name=self.name, defaults={'value': new_version()})
+                manager.filter(name=self.name).update(**changes)
+            previous, version = manager.filter(name=self.name).values_list('previous', 'value').get()
+        self.update(version, checked)
+        return previous, version
+
+    def clear(self):
+        with self.lock:
+            self.value = None
+            self.checked = 0
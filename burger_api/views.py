@@ -1,17 +1,77 @@
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.db.models import Count, Sum
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+import calendar
 import datetime
-from decimal import Decimal
-from .models import MenuItem, Order
-from .serializers import MenuItemSerializer, OrderSerializer, UserSerializer
-from .permissions import IsAdminOrReadOnly, IsAllowedToOrder
-from rest_framework import permissions, renderers, viewsets
+import time
+from .authentication import get_token_max_age, issue_token, revoke_tokens
+from .caching import CatalogCacheMixin, cached_statistics, get_catalog_version
+from .catalog import menu_catalog
+from .dispatch import dispatch_queue, get_dispatch_version, iter_events
+from .export import export_csv, export_ndjson
+from .filters import OrderFilter
+from .models import CustomerStats, MenuItem, Order
+from .pagination import KeysetPagination, StatisticsPagination, use_keyset_pagination
+from .serializers import (CustomerRankingSerializer, LeanOrderSerializer, MenuItemSerializer, OrderSerializer, UserSerializer,
+                          fetch_menu_items, lean_order_rows)
+from .metrics import registry
+from .permissions import IsAdminOrLocal, IsAdminOrReadOnly, IsAllowedToOrder
+from .renderers import CSVRenderer, EventStreamRenderer, NDJSONRenderer, PrometheusRenderer
+from .rollups import count_periods, revenue_by_period
+from .routers import ReadReplicaMixin
+from .search import search_index
+from .throttling import load_shedder
+from .utils import (get_choice_param, get_date_param, get_datetime_param, get_int_param, get_list_param,
+                    one_year_before)
+from rest_framework import permissions, renderers, status, viewsets
 from rest_framework.decorators import list_route, detail_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.request import Request
 from rest_framework.renderers import JSONRenderer
 
+def use_lean_listings():
+    """
+    The order listings are serialized with LeanOrderSerializer when BURGER_LEAN_ORDER_LISTINGS is set
+    """
+    return getattr(settings, 'BURGER_LEAN_ORDER_LISTINGS', False)
+
+def get_order_listing_serializer(orders, request, fields=None, expand=None):
+    if use_lean_listings() and not expand:
+        return LeanOrderSerializer(orders, request, fields)
+    return OrderSerializer(orders, many=True, context={'request': request}, fields=fields, expand=expand)
+
+def get_field_selection(request):
+    """
+    Return the 'fields' and 'expand' query parameters of a read request (see DynamicFieldsMixin), None when missing
+    """
+    if request.method not in permissions.SAFE_METHODS:
+        return None, None
+    return get_list_param(request, 'fields'), get_list_param(request, 'expand')
+
+class SparseFieldsMixin(object):
+    """
+    Serialize only the fields selected by the 'fields' parameter of read requests, with the related fields listed in
+    'expand' expanded, and load only what they need (see the setup_queryset of the serializer)
+    """
+    def get_queryset(self):
+        fields, expand = get_field_selection(self.request)
+        queryset = super(SparseFieldsMixin, self).get_queryset()
+        return self.get_serializer_class().setup_queryset(queryset, fields, expand)
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = get_field_selection(self.request)
+        kwargs.setdefault('fields', fields)
+        kwargs.setdefault('expand', expand)
+        return super(SparseFieldsMixin, self).get_serializer(*args, **kwargs)
+
 class UserViewSet(viewsets.ViewSet):
     """
     Used to retrieve user's orders by the admin (the user can retrieve his own orders using '/burger/orders/')
@@ -21,141 +81,343 @@ class UserViewSet(viewsets.ViewSet):
     permission_classes=(permissions.IsAdminUser,)
     
     def retrieve(self, request, pk=None):
-        serializer = self.serializer_class(User.objects.filter(pk=pk), many=True, context={'request': request})
+        fields, expand = get_field_selection(request)
+        queryset = self.serializer_class.setup_queryset(User.objects.filter(pk=pk), fields, expand)
+        serializer = self.serializer_class(queryset, many=True, context={'request': request}, fields=fields, expand=expand)
         return Response(serializer.data)
     
     @detail_route(methods=['get'], permission_classes=(permissions.IsAdminUser,))
     def orders(self, request, pk=None):
         queryset = User.objects.all()
         user = get_object_or_404(queryset, pk=pk)
-        queryset = Order.objects.filter(owner=user)
-        serializer = OrderSerializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+        fields, expand = get_field_selection(request)
+        queryset = OrderSerializer.setup_queryset(Order.objects.filter(owner=user), fields, expand)
+        if use_lean_listings() and not expand:
+            queryset = lean_order_rows(queryset)
+        if use_keyset_pagination(request):
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            return paginator.get_paginated_response(get_order_listing_serializer(page, request, fields, expand).data)
+        return Response(get_order_listing_serializer(queryset, request, fields, expand).data)
         
-class StatisticsViewSet(viewsets.ViewSet):
+class StatisticsViewSet(ReadReplicaMixin, viewsets.ViewSet):
     """
-    Used to retrieve different statistics (admin use only)
+    Used to retrieve different statistics (admin use only), read from the read replicas
+    and cached for BURGER_STATISTICS_CACHE_TTL seconds (see cached_statistics), throttled per user and overall
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes=(permissions.IsAdminUser,)
+    throttle_scope = 'statistics'
+    # ordering applied to the annotated customers for each criteria, ties are broken by the other criteria
+    customer_rankings = {
+        'number': ('-number_of_orders', '-revenue', 'pk'),
+        'revenue': ('-revenue', '-number_of_orders', 'pk'),
+    }
+    max_top_customers = 100
+    # the reports stay within the years that datetime can represent with the periods around them, and are bounded
+    report_years = (datetime.MINYEAR + 1, datetime.MAXYEAR - 1)
+    max_report_periods = 1000
+    revenue_granularities = ('day', 'week', 'month')
     
     @list_route(methods=['get'])
+    @cached_statistics
     def best_customer(self, request):
         """
-        Return information about best customer in a year based on the criteria selected:
-        1. 'number': the most ordering customer
-        2. 'revenue': the most paying customer
+        Return the best customers ranked by the criteria selected:
+        1. 'number': the most ordering customers
+        2. 'revenue': the most paying customers
+        Optional parameters: 'top' (number of customers to return, default 1),
+        'from' and 'to' (date or datetime window, default is the last year)
         """
-        criteria = 'number' # the default criteria
-        if request.query_params and request.query_params['criteria']:
-            criteria = request.query_params['criteria']
+        criteria = get_choice_param(request, 'criteria', self.customer_rankings, 'number')
+        top = get_int_param(request, 'top', 1, min_value=1, max_value=self.max_top_customers)
         now = timezone.now()
-        year_ago = datetime.datetime(now.year - 1, now.month, now.day, now.hour, now.minute, now.second, now.microsecond, now.tzinfo)
-        best_user_criterias = {
-            'number': self.get_most_ordering_customer,
-            'revenue': self.get_most_paying_customer
-        }
-        best_user_id = best_user_criterias[criteria](year_ago, now)            
-        best_user = User.objects.filter(pk=best_user_id)
-        serializer = self.serializer_class(best_user, many=True, context={'request': request})
-        print serializer.data
+        start = get_datetime_param(request, 'from', one_year_before(now))
+        end = get_datetime_param(request, 'to', now, end_of_day=True)
+        # one grouped query: count and sum the orders of every customer in the window, then rank them, from the
+        # (owner, created, total_price) index per customer rather than the rows of the window found by the created index
+        customers = User.objects.filter(orders__created__unindexed__gte=start, orders__created__unindexed__lt=end).annotate(
+            number_of_orders=Count('orders'),
+            revenue=Sum('orders__total_price'),
+        ).order_by(*self.customer_rankings[criteria])[:top]
+        serializer = CustomerRankingSerializer(customers, many=True, context={'request': request})
         return Response(serializer.data)
     
     @list_route(methods=['get'], renderer_classes = (JSONRenderer, ))
+    @cached_statistics
     def average_spending(self, request):
         """
-        Return the average spending per customer
+        Return the average spending per customer, paginated
         """
-        users = User.objects.all()
+        stats = CustomerStats.objects.filter(orders__gt=0).select_related('user').order_by('user_id')
+        paginator = StatisticsPagination()
+        page = paginator.paginate_queryset(stats, request, view=self)
         content = []
-        for user in users:
-            total_spending = Decimal('0.0')
-            user_orders = Order.objects.filter(owner=user)
-            if user_orders and user_orders.count:
-                for order in user_orders:
-                    total_spending += order.total_price
-                average_spending = total_spending / len(user_orders)
-                content.append({'user': user.username, 'average spending': average_spending})
-        return Response(content)
+        for customer in page:
+            content.append({'user': customer.user.username, 'average spending': customer.average_spending()})
+        return paginator.get_paginated_response(content)
     
     @list_route(methods=['get'], renderer_classes = (JSONRenderer, ))
+    @cached_statistics
     def monthly_revenue_report(self, request):
         """
         Return the monthly revenue in a year
         """
-        now = timezone.now()
         # read year from parameter, default is current year
-        year = now.year
-        if request.query_params and request.query_params['year']:
-            try:
-                year = int(request.query_params['year'])
-            except:
-                year = now.year
+        year = get_int_param(request, 'year', timezone.now().year, min_value=self.report_years[0], max_value=self.report_years[1])
         months = []
         content = {}
         content['year'] = year
-        for i in range(0, 12):
-            current_month = i + 1
-            start_date = datetime.datetime(year, current_month, 1, 0, 0, 0, 0, now.tzinfo)
-            end_date = datetime.datetime(year if current_month < 12 else (year + 1), (current_month % 12) + 1, 1, 0, 0, 0, 0, now.tzinfo)
-            orders = Order.objects.filter(created__range = [start_date, end_date])
-            month_revenue = Decimal('0.0')
-            for order in orders:
-                month_revenue += order.total_price
-            months.append({'month': start_date.strftime("%B"), 'revenue': month_revenue})
+        for month_start, orders, revenue in revenue_by_period(datetime.date(year, 1, 1), datetime.date(year, 12, 31), 'month'):
+            # strftime does not take the years before 1900 on Python 2
+            months.append({'month': calendar.month_name[month_start.month], 'revenue': revenue})
         content['report'] = months
         return Response(content)
     
-    def get_most_ordering_customer(self, year_ago, now):
-        best_user_id = -1
-        highest_num_of_orders = 0
-        for user in User.objects.all():
-            num_of_orders = len(Order.objects.filter(owner=user, created__range=[year_ago, now]))
-            if num_of_orders > highest_num_of_orders:
-                highest_num_of_orders = num_of_orders
-                best_user_id = user.id
-        return best_user_id
-    
-    def get_most_paying_customer(self, year_ago, now):
-        best_user_id = -1
-        highest_revenue = Decimal('0.0')
-        for user in User.objects.all():
-            user_orders = Order.objects.filter(owner=user, created__range=[year_ago, now])
-            user_revenue = Decimal('0.0')
-            for order in user_orders:
-                user_revenue += order.total_price
-            if user_revenue > highest_revenue:
-                highest_revenue = user_revenue
-                best_user_id = user.id
-        return best_user_id
-
-class MenuItemViewSet(viewsets.ModelViewSet):
-    """
-    Allow public access to retrieve MenuItem/s
+    @list_route(methods=['get'], renderer_classes = (JSONRenderer, ))
+    @cached_statistics
+    def revenue_report(self, request):
+        """
+        Return the number of orders and revenue per 'granularity' (day, week or month)
+        between the 'from' and 'to' dates, the default is the current year by month
+        """
+        granularity = get_choice_param(request, 'granularity', self.revenue_granularities, 'month')
+        today = timezone.now().date()
+        start = get_date_param(request, 'from', datetime.date(today.year, 1, 1))
+        end = get_date_param(request, 'to', datetime.date(today.year, 12, 31))
+        for name, day in (('from', start), ('to', end)):
+            if not self.report_years[0] <= day.year <= self.report_years[1]:
+                raise ValidationError({name: ['Enter a date between the years %d and %d.' % self.report_years]})
+        if start > end:
+            raise ValidationError({'from': ['The start date must be before the end date.']})
+        if count_periods(start, end, granularity) > self.max_report_periods:
+            raise ValidationError({'to': ['The report can have at most %d periods.' % self.max_report_periods]})
+        report = []
+        for period, orders, revenue in revenue_by_period(start, end, granularity):
+            report.append({'period': period, 'orders': orders, 'revenue': revenue})
+        return Response({'granularity': granularity, 'from': start, 'to': end, 'report': report})
+
+class MenuItemViewSet(ReadReplicaMixin, CatalogCacheMixin, SparseFieldsMixin, viewsets.ModelViewSet):
+    """
+    Allow public access to retrieve MenuItem/s (from the catalog snapshot, cached per catalog version, with ETag/Last-Modified,
+    read from the read replicas)
     Allow admin access only to create a MenuItem
     """
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
-class OrderViewSet(viewsets.ModelViewSet):
+    def get_snapshot(self):
+        # the snapshot only serves the reads, the writes and their responses use the database
+        if self.action not in ('list', 'retrieve'):
+            return None
+        return menu_catalog.get()
+
+    def get_queryset(self):
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return super(MenuItemViewSet, self).get_queryset()
+        return snapshot.items
+
+    def get_object(self):
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return super(MenuItemViewSet, self).get_object()
+        try:
+            item = snapshot.by_id[int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])]
+        except (KeyError, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, item)
+        return item
+
+    def reads_from_replica(self, request):
+        # right after a menu change the replicas may still serve the old menu, which would be cached for the new version
+        lag = getattr(settings, 'BURGER_REPLICA_LAG', 5)
+        return super(MenuItemViewSet, self).reads_from_replica(request) and time.time() - get_catalog_version() / 1000000.0 > lag
+
+    @list_route(methods=['get'])
+    def search(self, request):
+        """
+        Type-ahead search of the menu items: the words of 'q' are matched against the beginning of the words of their
+        names and descriptions, the best 'limit' matches (default 10) are returned (see MenuSearchIndex)
+        """
+        limit = get_int_param(request, 'limit', 10, min_value=1, max_value=50)
+        items = search_index.search(request.query_params.get('q', ''), limit)
+        return Response(self.get_serializer(items, many=True).data)
+
+class OrderViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     Allow access to orders only by authinticated users
+    Listing uses page numbers, or a cursor with 'pagination=cursor' (see KeysetPagination),
+    and can be filtered by creation and delivery time, status and owner (see OrderFilter)
     """
+    # the items of all the orders of a page are fetched with one query (see OrderSerializer.setup_queryset)
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = (permissions.IsAuthenticated, IsAllowedToOrder,)
+    filter_backends = (OrderFilter,)
+    # see BURGER_USER_THROTTLE_RATES and BURGER_ROUTE_THROTTLE_RATES
+    throttle_scopes = {'create': 'order-create', 'batch': 'order-create'}
+    
+    def get_throttle_cost(self, request):
+        # a batch takes a token per order, as many as its orders sent one by one
+        if self.action == 'batch' and isinstance(request.data, list):
+            return max(len(request.data), 1)
+        return 1
     
     def perform_create(self, serializer):
         # set the owner before saving
         serializer.save(owner=self.request.user)
     
+    @list_route(methods=['post'])
+    def batch(self, request):
+        """
+        Create a list of orders at once: they are validated together (the menu items of the whole batch are read once)
+        and the valid ones are written in one transaction.
+        Return the result of each order, in the same order: its status with the created order or the validation errors
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of orders.']})
+        max_size = getattr(settings, 'BURGER_ORDER_BATCH_MAX_SIZE', 500)
+        if len(request.data) > max_size:
+            raise ValidationError({'non_field_errors': ['A batch can have at most %d orders.' % max_size]})
+        context = self.get_serializer_context()
+        context['menu_items'] = fetch_menu_items(request.data)
+        serializers = [self.get_serializer_class()(data=data, context=context) for data in request.data]
+        valid = [serializer for serializer in serializers if serializer.is_valid()]
+        with transaction.atomic():
+            for serializer in valid:
+                self.perform_create(serializer)
+        # read the items of all the created orders at once for the response
+        orders = Order.objects.filter(pk__in=[serializer.instance.pk for serializer in valid]).prefetch_related('order_items')
+        created = dict((order['id'], order) for order in self.get_serializer(orders, many=True).data)
+        results = []
+        for serializer in serializers:
+            if serializer.instance is None:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+            else:
+                results.append({'status': status.HTTP_201_CREATED, 'order': created[serializer.instance.pk]})
+        if len(valid) == len(serializers):
+            response_status = status.HTTP_201_CREATED
+        elif valid:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=response_status)
+    
+    def list(self, request, *args, **kwargs):
+        fields, expand = get_field_selection(request)
+        if not use_lean_listings() or expand:
+            return super(OrderViewSet, self).list(request, *args, **kwargs)
+        queryset = lean_order_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(LeanOrderSerializer(page, request, fields).data)
+        return Response(LeanOrderSerializer(queryset, request, fields).data)
+    
+    @list_route(methods=['get'], permission_classes=(permissions.IsAdminUser,), renderer_classes=(NDJSONRenderer, CSVRenderer))
+    def export(self, request):
+        """
+        Stream all the orders with their items as NDJSON (default) or CSV ('format=csv'), for admins.
+        They can be filtered like the listing (see OrderFilter)
+        """
+        queryset = self.filter_queryset(Order.objects.all())
+        chunk_size = getattr(settings, 'BURGER_EXPORT_CHUNK_SIZE', 2000)
+        if request.accepted_renderer.format == 'csv':
+            content = export_csv(queryset, request, chunk_size)
+        else:
+            content = export_ndjson(queryset, request, chunk_size)
+        response = StreamingHttpResponse(content, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="orders.%s"' % request.accepted_renderer.format
+        return response
+    
+    @list_route(methods=['get'], url_path='dispatch', permission_classes=(permissions.IsAdminUser,))
+    def dispatch_list(self, request):
+        """
+        The dispatch queue of the kitchen and the delivery drivers (staff only): the active orders (new or being
+        processed) by delivery time, with the dispatch version. When the known version is sent ('version' or
+        If-None-Match) the response is a 304 until the queue changes, 'wait' waits up to that many seconds for a change
+        (long poll, at most BURGER_DISPATCH_MAX_WAIT)
+        """
+        wait = get_int_param(request, 'wait', 0, min_value=0, max_value=getattr(settings, 'BURGER_DISPATCH_MAX_WAIT', 30))
+        known = get_int_param(request, 'version', None)
+        if known is None:
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            known = int(etags[0]) if len(etags) == 1 and etags[0].isdigit() else None
+        if known is not None and wait:
+            with load_shedder.waiting():
+                version = dispatch_queue.wait_for_change(known, wait)
+        else:
+            version = get_dispatch_version()
+        if version == known:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({'version': version, 'orders': dispatch_queue.get_data(version, request)})
+        response['ETag'] = quote_etag(str(version))
+        return response
+    
+    @list_route(methods=['get'], url_path='dispatch/events', permission_classes=(permissions.IsAdminUser,),
+                renderer_classes=(EventStreamRenderer,))
+    def dispatch_events(self, request):
+        """
+        The dispatch queue as server-sent events (staff only): the queue right away and after every change, for
+        BURGER_DISPATCH_STREAM_DURATION seconds, then the EventSource reconnects with its Last-Event-ID (see iter_events)
+        """
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+        version = int(last_event_id) if last_event_id.isdigit() else None
+        duration = getattr(settings, 'BURGER_DISPATCH_STREAM_DURATION', 5 * 60)
+        response = StreamingHttpResponse(iter_events(request, version, duration), content_type=EventStreamRenderer.media_type)
+        response['Cache-Control'] = 'no-cache'
+        # nginx would buffer the events otherwise
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @property
+    def paginator(self):
+        # 'pagination=cursor' switches from the default page numbers to the keyset pagination
+        if not hasattr(self, '_paginator') and use_keyset_pagination(self.request):
+            self._paginator = KeysetPagination()
+        return super(OrderViewSet, self).paginator
+    
     def get_queryset(self):
+        queryset = super(OrderViewSet, self).get_queryset()
         # admin can retrieve all the orders
         if self.request.user.is_superuser:
-            return Order.objects.all()
+            return queryset
         else: # normal user retrieve only his orders
-            return Order.objects.filter(owner=self.request.user)
-    
+            return queryset.filter(owner=self.request.user)
+
+class MetricsView(APIView):
+    """
+    The request metrics of this process in the Prometheus text format (admin or local access only)
+    """
+    permission_classes = (IsAdminOrLocal,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(registry.render())
+
+class TokenView(APIView):
+    """
+    POST a 'username' and 'password' to get a signed token, sent as 'Authorization: Bearer <token>' (see SignedTokenAuthentication).
+    DELETE revokes all the tokens of the authenticated user.
+    """
+    def get_permissions(self):
+        if self.request.method == 'DELETE':
+            return [permissions.IsAuthenticated()]
+        return [permissions.AllowAny()]
+
+    def post(self, request):
+        username = request.data.get('username')
+        password = request.data.get('password')
+        if not username or not password:
+            raise ValidationError({'non_field_errors': ['A username and a password are required.']})
+        user = authenticate(username=username, password=password)
+        if user is None or not user.is_active:
+            raise ValidationError({'non_field_errors': ['Unable to log in with the provided credentials.']})
+        return Response({'token': issue_token(user), 'expires_in': get_token_max_age()})
 
+    def delete(self, request):
+        revoke_tokens(request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,172 @@
+"""
+ASGI config for burger_shop project (Python 3 only).
+
+It exposes the ASGI callable as a module-level variable named ``application``, for any ASGI 3 server, e.g.
+uvicorn burger_shop.asgi:application
+
+Django 1.10 only runs WSGI views, so the application runs them in thread pools from the event loop of the server:
+waiting connections only cost the event loop, and the database work of a request runs in a pool thread, which keeps
+its persistent database connection. The statistics reports and the exports (BURGER_ASGI_REPORT_PATHS) have a pool
+of their own (BURGER_ASGI_REPORT_THREADS), so that many slow reports queue up among themselves instead of taking
+the threads (BURGER_ASGI_THREADS) of the cheap menu and order requests. The dispatch screens, which wait for changes,
+have a large pool (BURGER_ASGI_STREAM_THREADS) for the same reason.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "burger_shop.settings")
+
+wsgi_application = get_wsgi_application()
+
+
+class ASGIHandler(object):
+    """
+    Serve the HTTP requests of an ASGI server with a WSGI application run in thread pools
+    """
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BURGER_ASGI_THREADS', 16), thread_name_prefix='asgi')
+        self.report_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BURGER_ASGI_REPORT_THREADS', 4), thread_name_prefix='asgi-report')
+        self.stream_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BURGER_ASGI_STREAM_THREADS', 256), thread_name_prefix='asgi-stream')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type %s.' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                self.report_executor.shutdown()
+                self.stream_executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def get_executor(self, path):
+        if path.startswith(tuple(getattr(settings, 'BURGER_ASGI_REPORT_PATHS', ()))):
+            return self.report_executor
+        if path.startswith(tuple(getattr(settings, 'BURGER_ASGI_STREAM_PATHS', ()))):
+            return self.stream_executor
+        return self.executor
+
+    async def http(self, scope, receive, send):
+        body = BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        length = body.tell()
+        body.seek(0)
+        environ = self.get_environ(scope, body)
+        # the server has read the whole body (e.g. chunked or HTTP/2 requests have no Content-Length)
+        environ['CONTENT_LENGTH'] = str(length)
+        loop = asyncio.get_event_loop()
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(self.watch_disconnect(receive, disconnected))
+        try:
+            await loop.run_in_executor(self.get_executor(scope['path']), self.run_wsgi, loop, environ, send, disconnected)
+        finally:
+            watcher.cancel()
+
+    async def watch_disconnect(self, receive, disconnected):
+        # the body has been read, the next message the server has for the request is the client leaving
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    def get_environ(self, scope, body):
+        # the WSGI strings are the bytes of the request decoded as latin-1
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ:
+                # repeated headers are joined, as the HTTP servers do (the cookies have their own separator)
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+    def run_wsgi(self, loop, environ, send, disconnected):
+        """
+        Run the WSGI application in the current pool thread and send its response from the event loop,
+        the whole response is produced in this thread (streamed responses may still use the database).
+        A streamed response is closed at its next chunk once the client has disconnected, which frees the thread.
+        """
+        async def send_message(message):
+            await send(message)
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send_message(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def send_start():
+            if not response.get('started'):
+                response['started'] = True
+                call({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in result:
+                if disconnected.is_set():
+                    return
+                if chunk:
+                    send_start()
+                    call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_start()
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            # sends request_finished in this thread, which holds the database connections of the request
+            if hasattr(result, 'close'):
+                result.close()
+
+
+application = ASGIHandler(wsgi_application)
@@ -48,6 +48,11 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
+        'burger_api.authentication.SignedTokenAuthentication',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'burger_api.throttling.UserTokenBucketThrottle',
+        'burger_api.throttling.RouteTokenBucketThrottle',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -55,6 +60,8 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'burger_api.metrics.MetricsMiddleware',
+    'burger_api.throttling.LoadSheddingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,11 +94,58 @@ WSGI_APPLICATION = 'burger_shop.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
+# Configured from the environment: BURGER_DB_ENGINE is sqlite (the default) or postgresql (needs psycopg2),
+# see BURGER_SQLITE_PRAGMAS below for the tuning of the SQLite connections
+
+# Seconds a connection is kept open between requests (0 closes it after every request)
+DB_CONN_MAX_AGE = int(os.environ.get('BURGER_DB_CONN_MAX_AGE', 60))
+
+# Seconds a SQLite connection waits for the write lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('BURGER_SQLITE_BUSY_TIMEOUT', 20))
+
+if os.environ.get('BURGER_DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BURGER_DB_NAME', 'burger_shop'),
+            'USER': os.environ.get('BURGER_DB_USER', ''),
+            'PASSWORD': os.environ.get('BURGER_DB_PASSWORD', ''),
+            'HOST': os.environ.get('BURGER_DB_HOST', ''),
+            'PORT': os.environ.get('BURGER_DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, os.environ.get('BURGER_DB_NAME', 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+        }
+    }
 
-DATABASES = {
-    'default': {
+# Read-only copies of the default database, as a comma separated list of SQLite files.
+# To try it locally, copy db.sqlite3 and run with BURGER_REPLICA_DATABASES=replica.sqlite3
+for index, name in enumerate(filter(None, os.environ.get('BURGER_REPLICA_DATABASES', '').split(','))):
+    DATABASES['replica%d' % index] = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.path.join(BASE_DIR, name),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['burger_api.routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# The local memory cache is per process, use a shared cache (e.g. memcached) when running several workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -133,3 +187,99 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Burger API
+
+# How often each process reads the versions of the data it keeps (e.g. the menu catalog) from the database (seconds),
+# the changes made by the other processes are seen within that time
+BURGER_VERSION_CHECK_INTERVAL = 1
+
+# How long the menu responses are cached for a catalog version (seconds)
+BURGER_CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Maximum number of orders submitted at once to /burger/orders/batch/
+BURGER_ORDER_BATCH_MAX_SIZE = 500
+
+# Serialize the order listings from plain rows (same output, much less CPU than OrderSerializer)
+BURGER_LEAN_ORDER_LISTINGS = False
+
+# Number of orders read per query by the order export (/burger/orders/export/)
+BURGER_EXPORT_CHUNK_SIZE = 2000
+
+# Database aliases the statistics and menu reads are sent to (see burger_api.routers)
+BURGER_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# How long the replicas may lag behind the primary (seconds), the menu is read from the primary for that long after a change
+BURGER_REPLICA_LAG = 5
+
+# How long the statistics are served from the cache before they are refreshed (seconds)
+BURGER_STATISTICS_CACHE_TTL = 5 * 60
+
+# How long stale statistics are still served while they are refreshed in the background (seconds)
+BURGER_STATISTICS_CACHE_MAX_STALENESS = 60 * 60
+
+# Refresh the stale statistics in a background thread (when off, the request serving the stale data refreshes them)
+BURGER_STATISTICS_BACKGROUND_REFRESH = True
+
+# How long the tokens issued by /burger/token/ are valid (seconds)
+BURGER_TOKEN_MAX_AGE = 7 * 24 * 60 * 60
+
+# Number of users kept in memory by each process for the token authentication, and how long before they are read again (seconds)
+BURGER_TOKEN_USER_CACHE_SIZE = 1000
+BURGER_TOKEN_USER_CACHE_TIMEOUT = 60
+
+# PRAGMAs run on every new SQLite connection (see burger_api.db): the write-ahead log lets the readers work while
+# an order is written and makes the commits cheaper, with synchronous=normal they are only synced at checkpoints
+# (a power loss may lose the last commits but never corrupts the database), and the file is read through mmap
+BURGER_SQLITE_PRAGMAS = (
+    ('journal_mode', os.environ.get('BURGER_SQLITE_JOURNAL_MODE', 'wal')),
+    ('synchronous', os.environ.get('BURGER_SQLITE_SYNCHRONOUS', 'normal')),
+    ('mmap_size', int(os.environ.get('BURGER_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))),
+)
+
+# Check that a persistent connection still works at the start of every request, and reconnect if it does not
+BURGER_DB_HEALTH_CHECKS = os.environ.get('BURGER_DB_HEALTH_CHECKS', 'true') == 'true'
+
+# Threads of each process served by burger_shop.asgi, the statistics reports and the exports have their own smaller
+# pool so that slow reports can't take the threads of the other requests
+BURGER_ASGI_THREADS = 16
+BURGER_ASGI_REPORT_THREADS = 4
+BURGER_ASGI_REPORT_PATHS = ('/burger/statistics/', '/burger/orders/export/')
+# the dispatch screens wait for changes (long poll, server-sent events) in a large pool of their own
+BURGER_ASGI_STREAM_THREADS = 256
+BURGER_ASGI_STREAM_PATHS = ('/burger/orders/dispatch/',)
+
+# Token bucket rates of the throttled routes, 'N/period' (second, minute, hour or day): bursts of N requests,
+# then N per period. Per user (per address for anonymous users), and per route for all the users together.
+# The order batches are counted in orders
+BURGER_USER_THROTTLE_RATES = {
+    'order-create': '120/minute',
+    'statistics': '120/minute',
+}
+BURGER_ROUTE_THROTTLE_RATES = {
+    'order-create': '100/second',
+    'statistics': '20/second',
+}
+
+# Cache holding the throttle buckets: a local memory cache limits each process, a shared cache limits all the workers
+BURGER_THROTTLE_CACHE = 'default'
+
+# Limits of the requests in progress in a process and of the average query time of the recent requests, over which
+# the statistics and the order writes are refused with a 503 and Retry-After (seconds), the statistics first
+BURGER_LOAD_SHEDDING = {
+    'statistics': {'max_in_flight': 8, 'max_query_time': 0.25, 'retry_after': 30},
+    'orders': {'max_in_flight': 32, 'max_query_time': 1.0, 'retry_after': 2},
+}
+
+# Dispatch queue (/burger/orders/dispatch/): the most orders returned, the longest long poll, how long an event stream
+# lasts before the client reconnects and the keepalive interval (seconds), and how often the waiters check for
+# the changes made by the other processes (the changes of their own process wake them up right away)
+BURGER_DISPATCH_MAX_ORDERS = 500
+BURGER_DISPATCH_MAX_WAIT = 30
+BURGER_DISPATCH_STREAM_DURATION = 5 * 60
+BURGER_DISPATCH_KEEPALIVE = 15
+BURGER_DISPATCH_POLL_INTERVAL = 1
+
+# Addresses allowed to read /burger/metrics/ without an admin login (behind a proxy, the address of the proxy)
+BURGER_METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')